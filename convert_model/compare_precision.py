@@ -8,7 +8,7 @@ import editdistance
 import numpy as np
 import torch
 # project libraries
-from speech.models.ctc_decoder import decode as ctc_decode
+from speech.models.ctc_decoder_fast import decode as ctc_decode
 from speech.utils.convert import to_numpy
 from speech.utils.io import read_data_json, read_pickle
 from onnx_to_coreml import onnx_to_coreml
@@ -19,7 +19,8 @@ def compare_precision(model_name:str,
                       num_frames:int, 
                       half_precision:bool, 
                       quarter_precision:bool,
-                      audio_dir:str):
+                      audio_dir:str,
+                      pruning:dict=None):
     """
     Arguments
     ---------
@@ -33,9 +34,12 @@ def compare_precision(model_name:str,
         whether to conver the coreml model to quarter precision
     audio_dir: str
         path to the directory containing the audio files to evaluate the models
+    pruning: dict
+        optional `blank_threshold`, `top_k`, and `cum_prob` pruning arguments of the decoder
     """
 
     BLANK_INDEX=39
+    pruning = pruning or dict()
 
     torch_model, _ = torch_to_onnx(model_name, 
                                     num_frames, 
@@ -100,7 +104,7 @@ def compare_precision(model_name:str,
                                         )
             # unpacking the torch_ouput and converting to numpy
             torch_probs, torch_h, torch_c = to_numpy(torch_output[0]), to_numpy(torch_output[1][0]), to_numpy(torch_output[1][1])
-            torch_preds_int = ctc_decode(torch_probs[0], beam_size=50, blank=BLANK_INDEX)
+            torch_preds_int = ctc_decode(torch_probs[0], beam_size=50, blank=BLANK_INDEX, **pruning)
             # converting the integers to character labels
             torch_preds = preproc.decode(torch_preds_int[0])
 
@@ -110,7 +114,7 @@ def compare_precision(model_name:str,
             coreml_probs = np.array(coreml_output['output'])
             coreml_h = np.array(coreml_output['hidden'])
             coreml_c = np.array(coreml_output['cell'])
-            coreml_preds_int = ctc_decode(coreml_probs[0], beam_size=50,blank=BLANK_INDEX)
+            coreml_preds_int = ctc_decode(coreml_probs[0], beam_size=50,blank=BLANK_INDEX, **pruning)
             coreml_preds = preproc.decode(coreml_preds_int[0])
 
             dist = editdistance.eval(torch_preds, coreml_preds)
@@ -145,7 +149,12 @@ if __name__ == "__main__":
     parser.add_argument("--audio-dir", type=str, help="path to the dataset.json file used for validation.")
     parser.add_argument("--half-precision", action='store_true', default=False,  help="converts the model to half precision.")
     parser.add_argument("--quarter-precision", action='store_true', default=False, help="converts the model to quarter precision.")
+    parser.add_argument("--blank-threshold", type=float, default=None, help="decoder skips frames with at least this blank probability.")
+    parser.add_argument("--top-k", type=int, default=None, help="decoder only extends by the top-k labels in a frame.")
+    parser.add_argument("--cum-prob", type=float, default=None, help="decoder only extends by the labels within this cumulative probability.")
     args = parser.parse_args()
 
     compare_precision(args.model_name, args.num_frames, args.half_precision, 
-                        args.quarter_precision, args.audio_dir)
+                        args.quarter_precision, args.audio_dir, 
+                        {"blank_threshold": args.blank_threshold, "top_k": args.top_k, 
+                         "cum_prob": args.cum_prob})
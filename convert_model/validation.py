@@ -21,6 +21,7 @@ from get_paths import validation_paths
 from import_export import preproc_to_dict, preproc_to_json, export_state_dict
 from speech.loader import log_spectrogram_from_data, log_spectrogram_from_file
 from speech.models.ctc_decoder import decode as ctc_decode
+from speech.models.greedy_decoder import greedy_decode
 from speech.models import ctc_model
 from speech.utils.compat import normalize
 from speech.utils.convert import to_numpy
@@ -380,14 +381,9 @@ def load_audio(preproc, test_names, test_fns, base_path, test_h, test_c, num_fra
 
 
 def max_decode(output, blank=39):
-    pred = np.argmax(output, 1)
-    prev = pred[0]
-    seq = [prev] if prev != blank else []
-    for p in pred[1:]:
-        if p != blank and p != prev:
-            seq.append(p)
-        prev = p
-    return seq
+    """Returns the greedy prediction from the (time x vocab) output of a single utterance"""
+    labels, _, _ = greedy_decode(output[None], blank=blank)
+    return labels[0].tolist()
 
 
 
@@ -25,7 +25,8 @@ from speech.dataset_info import AllDatasets, TatoebaDataset
 from speech.utils.data_helpers import (
     get_record_ids_map, get_dataset_ids, path_to_id, process_text, today_date
 )
-from speech.utils.io import read_data_json, write_pickle
+from speech.utils.io import write_pickle
+from speech.utils.manifest import CompactManifest, load_manifest
 from speech.utils.visual import plot_count, print_stats, print_symmetric_table
 
 
@@ -301,7 +302,7 @@ def assess_speak_train(dataset_paths: List[str],
         unq_date_counter = {name: dict() for name in constraint_names}
         # iterate through the datasets
         for dataset_path in dataset_paths:
-            dataset = read_data_json(dataset_path)
+            dataset = load_manifest(dataset_path)
             print(f"dataset {path_to_id(dataset_path)} size is: {len(dataset)}")
 
             # iterate through the exmaples in the dataset
@@ -404,12 +405,18 @@ def dataset_stats(dataset_path:str)->None:
         dataset_path (str): path to the dataset
     """
 
-    dataset = read_data_json(dataset_path)
+    dataset = load_manifest(dataset_path)
 
-    data_features = {
-        "target_len": [len(xmpl['text']) for xmpl in dataset],
-        "audio_dur": [xmpl['duration'] for xmpl in dataset]
-    }
+    if isinstance(dataset, CompactManifest):
+        data_features = {
+            "target_len": dataset.label_lens,
+            "audio_dur": dataset.durations
+        }
+    else:
+        data_features = {
+            "target_len": [len(xmpl['text']) for xmpl in dataset],
+            "audio_dur": [xmpl['duration'] for xmpl in dataset]
+        }
 
     stat_functions = {
         "mean": np.mean,
@@ -18,7 +18,7 @@ from typing import List
 import numpy as np
 import yaml
 # project libs
-from speech.utils.io import read_data_json
+from speech.utils.manifest import load_manifest
 from speech.utils.data_helpers import check_disjoint_filter, check_distribution_filter, check_update_contraints
 from speech.utils.data_helpers import get_dataset_ids, get_disjoint_sets, get_record_ids_map
 from speech.utils.data_helpers import path_to_id, process_text
@@ -60,9 +60,11 @@ def filter_speak_train(config:dict)->None:
     print("constraints: ", constraints)
 
     # read and shuffle the full dataset and convert to iterator to save memory
-    full_dataset = read_data_json(full_json_path)
-    random.shuffle(full_dataset)
-    full_dataset = iter(full_dataset)
+    full_dataset = load_manifest(full_json_path, indexed=True)
+    # shuffling the indices allows the dataset to be a read-only compact manifest
+    shuffled_indices = list(range(len(full_dataset)))
+    random.shuffle(shuffled_indices)
+    full_dataset = (full_dataset[idx] for idx in shuffled_indices)
 
     # get the mapping from record_id to other ids (like speaker, lesson, line) for each example
     record_ids_map = get_record_ids_map(metadata_path, list(constraints.keys()))
@@ -6,7 +6,8 @@ import os
 import random
 
 # project libraries
-from speech.utils.io import read_data_json, write_data_json
+from speech.utils.io import write_data_json
+from speech.utils.manifest import load_manifest
 
 def main(dataset_path:str, write_path: str, subset_size:int, use_internal:bool, mix_with_speak:bool):
     """
@@ -49,7 +50,8 @@ def main(dataset_path:str, write_path: str, subset_size:int, use_internal:bool,
 class DataSubsetor():
     def __init__(self, dataset_path:str, subset_size:int):
         self.dataset_path = dataset_path
-        self.data_json = read_data_json(dataset_path)
+        # the sampled rows are parsed without loading every example
+        self.data_json = load_manifest(dataset_path, indexed=True)
         self.subset = random.sample(self.data_json, k=subset_size)        
     
     def get_full_dataset(self):
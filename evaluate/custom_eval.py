@@ -12,7 +12,7 @@ import tqdm
 # project libraries
 from evaluate.eval import run_eval
 import speech.loader
-from speech.models.ctc_decoder import decode as ctc_decode
+from speech.models.ctc_decoder_fast import decode as ctc_decode
 from speech.models.ctc_model_train import CTC_train as CTC_train
 from speech.utils.data_helpers import lexicon_to_dict, path_to_id, text_to_phonemes
 from speech.utils.io import get_names, load_config, load_state_dict, read_data_json, read_pickle
@@ -71,12 +71,13 @@ def eval1(config:dict)->None:
                 inputs, dummy_target = preproc.preprocess(str(audio_path), dummy_target)
                 inputs = torch.FloatTensor(inputs)
                 inputs = torch.unsqueeze(inputs, axis=0).to(device)   # add the batch dim and push to `device`
-                probs, _ = model(inputs, softmax=True)      # don't need rnn_args output in `_`
-                probs = probs.data.cpu().numpy().squeeze() # convert to numpy and remove batch-dim
-                top_beams = ctc_decode(probs, 
+                log_probs, _ = model(inputs, log_softmax=True)      # don't need rnn_args output in `_`
+                log_probs = log_probs.data.cpu().numpy().squeeze() # convert to numpy and remove batch-dim
+                top_beams = ctc_decode(log_probs, 
                                         beam_size=3, 
                                         blank=model.blank, 
-                                        n_top_beams=config['n_top_beams']
+                                        n_top_beams=config['n_top_beams'],
+                                        log_input=True
                 )
                 top_beams = [(preproc.decode(preds), probs) for preds, probs in top_beams]
                 output_dict[rec_id]['infer'].update({model_name: top_beams})
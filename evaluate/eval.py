@@ -3,8 +3,10 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 import argparse
+from collections import deque
 import os
 import json
+import time
 # third-party libraries
 import editdistance
 import matplotlib as plt
@@ -14,39 +16,141 @@ import tqdm
 # project libraries
 import speech
 import speech.loader as loader
-from speech.models.ctc_decoder import decode
+from speech.models.batch_decoder import BatchDecoder
+from speech.models.ctc_decoder_fast import decode
 from speech.models.ctc_model_train import CTC_train
-from speech.utils.io import get_names, load_config, load_state_dict, read_data_json, read_pickle
+from speech.utils.feature_cache import build_feature_cache, FeatureCache
+from speech.utils.io import get_names, load_config, load_state_dict, read_pickle
+from speech.utils.manifest import load_manifest
 
 
-def eval_loop(model, ldr, device):
+def eval_loop(model, ldr, device, decode_workers:int=0, beam_size:int=3, pruning:dict=None):
     """Runs the evaluation loop on the input data `ldr`.
     
     Args:
         model (torch.nn.Module): model to be evaluated
         ldr (torch.utils.data.DataLoader): evaluation data loader
         device (torch.device): device inference will be run on
+        decode_workers (int): if greater than zero, the batches are decoded in a pool of worker
+            processes while the next batches run through the model
+        beam_size (int): size of the beam of the decoder
+        pruning (dict): optional `blank_threshold`, `top_k`, and `cum_prob` pruning arguments of
+            the decoder
 
     Returns:
         list: list of labels, predictions, and confidence levels for each example in
             the dataloader
     """
-    all_preds = []; all_labels = []; all_preds_dist=[]
-    all_confidence = []
+    all_labels = []; preds_confidence = []
+    # only a few decoded batches are pending at a time to limit the shared memory
+    pending_jobs = deque()
+    max_pending = max(2 * decode_workers, 1)
+    decoder = BatchDecoder(
+        decode_workers, beam_size=beam_size, blank=model.blank, pruning=pruning, log_input=True
+    )
+    with decoder:
+        with torch.no_grad():
+            for batch in tqdm.tqdm(ldr):
+                batch = list(batch)
+                inputs, targets, inputs_lens, targets_lens = model.collate(*batch)
+                inputs = inputs.to(device)
+                log_probs, rnn_args = model(inputs, lengths=inputs_lens, log_softmax=True)
+                # each example is decoded over its own length
+                pending_jobs.append(decoder.submit(log_probs, inputs_lens))
+                all_labels.extend(batch[1])
+                while len(pending_jobs) > max_pending:
+                    preds_confidence.extend(nbest[0] for nbest in pending_jobs.popleft().get())
+        while pending_jobs:
+            preds_confidence.extend(nbest[0] for nbest in pending_jobs.popleft().get())
+    all_preds = [x[0] for x in preds_confidence]
+    all_confidence = [x[1] for x in preds_confidence]
+    return list(zip(all_labels, all_preds, all_confidence))
+
+
+def pruning_report(model, ldr, device, preproc, beam_size:int=3, pruning:dict=None)->dict:
+    """Decodes the outputs of the model on `ldr` with and without the decoder pruning.
+
+    Returns:
+        dict: the PER and decoding time with and without pruning, the PER difference, and the 
+            fractions of the frames that were pruned and of the expansions that were saved
+    """
+    all_log_probs = []; all_labels = []
     with torch.no_grad():
         for batch in tqdm.tqdm(ldr):
             batch = list(batch)
             inputs, targets, inputs_lens, targets_lens = model.collate(*batch)
             inputs = inputs.to(device)
-            probs, rnn_args = model(inputs, softmax=True)
-            probs = probs.data.cpu().numpy()
-            preds_confidence = [decode(p, beam_size=3, blank=model.blank)[0] for p in probs]
-            preds = [x[0] for x in preds_confidence]
-            confidence = [x[1] for x in preds_confidence]
-            all_preds.extend(preds)
-            all_confidence.extend(confidence)
+            log_probs, rnn_args = model(inputs, lengths=inputs_lens, log_softmax=True)
+            log_probs = log_probs.cpu().numpy()
+            all_log_probs.extend(lp[:length] for lp, length in zip(log_probs, inputs_lens.tolist()))
             all_labels.extend(batch[1])
-    return list(zip(all_labels, all_preds, all_confidence))
+
+    report = dict()
+    for name, decode_kwargs in [("exact", dict()), ("pruned", pruning or dict())]:
+        stats = dict()
+        start = time.time()
+        preds = [decode(lp, beam_size, model.blank, stats=stats, log_input=True, **decode_kwargs)[0][0] 
+                 for lp in all_log_probs]
+        report[f"{name}_decode_time"] = time.time() - start
+        results = [(preproc.decode(label), preproc.decode(pred)) 
+                   for label, pred in zip(all_labels, preds)]
+        report[f"{name}_per"] = speech.compute_cer(results, verbose=False) if results else 0.0
+    report["per_delta"] = report["pruned_per"] - report["exact_per"]
+    # an empty loader has no frames and a loader of empty outputs has no expansions
+    report["pruned_frames"] = stats["pruned_frames"] / stats["frames"] if stats.get("frames") else 0.0
+    report["expansions_saved"] = 1 - stats["expansions"] / stats["full_expansions"] \
+        if stats.get("full_expansions") else 0.0
+    return report
+
+
+def log_input_report(model, ldr, device, beam_size:int=3)->dict:
+    """Benchmarks decoding the outputs of the model on `ldr` from the softmax probabilities,
+    which the decoder converts with a log, against decoding the log-softmax outputs directly.
+    The model runs once and each path times its output activation, copy to the cpu, and decoding.
+
+    Returns:
+        dict: the time of each path, the fraction of the time that is saved, the fraction of the
+            examples with the same top beam, the largest score difference of those examples, 
+            and the fraction of the probabilities that underflow to zero after the softmax
+    """
+    all_outputs = []
+    with torch.no_grad():
+        for batch in tqdm.tqdm(ldr):
+            batch = list(batch)
+            inputs, targets, inputs_lens, targets_lens = model.collate(*batch)
+            inputs = inputs.to(device)
+            out, rnn_args = model(inputs, lengths=inputs_lens)
+            all_outputs.append((out, inputs_lens.tolist()))
+
+    report = dict()
+    all_beams = dict()
+    for name, log_input in [("softmax", False), ("log_softmax", True)]:
+        beams = list()
+        start = time.time()
+        for out, lengths in all_outputs:
+            if log_input:
+                outputs = torch.nn.functional.log_softmax(out, dim=2).cpu().numpy()
+            else:
+                outputs = torch.nn.functional.softmax(out, dim=2).cpu().numpy()
+            beams.extend(decode(output[:length], beam_size, model.blank, log_input=log_input)[0]
+                         for output, length in zip(outputs, lengths))
+        report[f"{name}_time"] = time.time() - start
+        all_beams[name] = beams
+    report["time_saved"] = 1 - report["log_softmax_time"] / report["softmax_time"]
+    
+    same_preds = [(prob_beam[1], log_beam[1]) 
+                  for prob_beam, log_beam in zip(all_beams["softmax"], all_beams["log_softmax"])
+                  if prob_beam[0] == log_beam[0]]
+    report["same_preds"] = len(same_preds) / len(all_beams["softmax"])
+    report["max_score_diff"] = max(abs(prob_score - log_score) for prob_score, log_score in same_preds) \
+        if same_preds else 0.0
+    zero_probs = sum(
+        (torch.nn.functional.softmax(out, dim=2)[i, :length] == 0).sum().item() 
+        for out, lengths in all_outputs for i, length in enumerate(lengths)
+    )
+    num_probs = sum(sum(lengths) * out.shape[2] for out, lengths in all_outputs)
+    report["zero_probs"] = zero_probs / num_probs
+    return report
 
 
 def run_eval(
@@ -60,7 +164,13 @@ def run_eval(
         add_maxdecode:bool=False, 
         formatted=False, 
         config_path = None, 
-        out_file=None)->int:
+        out_file=None,
+        feature_cache_dir:str=None,
+        decode_workers:int=0,
+        beam_size:int=3,
+        pruning:dict=None,
+        compare_pruning:bool=False,
+        benchmark_log_input:bool=False)->int:
     """
     calculates the  distance between the predictions from
     the model in model_path and the labels in dataset_json
@@ -79,6 +189,16 @@ def run_eval(
             `format_save` outputs a more human-readable output file
         config_path (bool): specific path to the config file, if the one in `model_path` is not desired
         out_file (str): path where the output file will be saved
+        feature_cache_dir (str): if not None, the features will be read from a precomputed cache
+            in this directory, which is built if it doesn't exist
+        decode_workers (int): number of processes that decode the batches while the model runs
+        beam_size (int): size of the beam of the decoder
+        pruning (dict): optional `blank_threshold`, `top_k`, and `cum_prob` pruning arguments of
+            the decoder
+        compare_pruning (bool): if true, the PER and decoding time with and without `pruning`
+            are printed and the PER with pruning is returned
+        benchmark_log_input (bool): if true, the `log_input_report` of decoding from the softmax
+            and log-softmax outputs is printed and the PER is computed as usual
     
     Returns:
         (int): returns the computed error rate of the model on the dataset
@@ -107,10 +227,16 @@ def run_eval(
     state_dict = load_state_dict(model_path, device=device)
     model.load_state_dict(state_dict)
     
+    feature_cache = None
+    if feature_cache_dir is not None:
+        cache_path = build_feature_cache(dataset_json, preproc, feature_cache_dir)
+        feature_cache = FeatureCache(cache_path, dataset_json)
+
     ldr =  loader.make_loader(
         dataset_json,
         preproc, 
-        batch_size
+        batch_size,
+        feature_cache=feature_cache
     )
     
     model.to(device)
@@ -121,7 +247,19 @@ def run_eval(
     print(f"preproc train_status after set_eval: {preproc.train_status}")
 
 
-    results = eval_loop(model, ldr, device)
+    if compare_pruning:
+        report = pruning_report(model, ldr, device, preproc, beam_size, pruning)
+        for key, value in report.items():
+            print(f"{key}: {value:.4f}")
+        return round(report["pruned_per"], 3)
+
+    if benchmark_log_input:
+        report = log_input_report(model, ldr, device, beam_size)
+        for key, value in report.items():
+            print(f"{key}: {value:.4g}")
+
+    results = eval_loop(model, ldr, device, decode_workers=decode_workers, 
+                        beam_size=beam_size, pruning=pruning)
     print(f"number of examples: {len(results)}")
     #results_dist = [[(preproc.decode(pred[0]), preproc.decode(pred[1]), prob)] 
     #                for example_dist in results_dist
@@ -216,7 +354,8 @@ def match_filename(label:list, dataset_json:str, return_order=False) -> str:
     returns the filename in dataset_json that matches
     the phonemes in label
     """
-    dataset = read_data_json(dataset_json)
+    # the rows are parsed one at a time rather than loading the whole dataset
+    dataset = load_manifest(dataset_json, indexed=True)
     matches = []
     for i, sample in enumerate(dataset):
         if sample['text'] == label:
@@ -331,6 +470,22 @@ if __name__ == "__main__":
         help="Output will be written to file in a cleaner format.")
     parser.add_argument("--config-path", type=str, default=None,
         help="Replace the preproc from model path a  preproc copy using the config file.")
+    parser.add_argument("--feature-cache-dir", type=str, default=None,
+        help="Directory of the precomputed feature cache. The cache is built if it doesn't exist.")
+    parser.add_argument("--decode-workers", type=int, default=0,
+        help="Number of processes that decode the batches while the model runs on the next batch.")
+    parser.add_argument("--beam-size", type=int, default=3,
+        help="Size of the beam of the decoder.")
+    parser.add_argument("--blank-threshold", type=float, default=None,
+        help="The prefixes aren't extended in frames with at least this blank probability.")
+    parser.add_argument("--top-k", type=int, default=None,
+        help="The prefixes are only extended by the labels with the top-k probabilities in a frame.")
+    parser.add_argument("--cum-prob", type=float, default=None,
+        help="The prefixes are only extended by the labels within this cumulative probability.")
+    parser.add_argument("--compare-pruning", action="store_true", default=False,
+        help="Prints the PER and decoding time with and without pruning.")
+    parser.add_argument("--benchmark-log-input", action="store_true", default=False,
+        help="Prints the decoding time from the softmax and from the log-softmax outputs.")
     args = parser.parse_args()
 
     run_eval(
@@ -341,5 +496,12 @@ if __name__ == "__main__":
         add_filename=args.filename,  
         formatted=args.formatted, 
         config_path=args.config_path, 
-        out_file=args.save
+        out_file=args.save,
+        feature_cache_dir=args.feature_cache_dir,
+        decode_workers=args.decode_workers,
+        beam_size=args.beam_size,
+        pruning={"blank_threshold": args.blank_threshold, "top_k": args.top_k, 
+                 "cum_prob": args.cum_prob},
+        compare_pruning=args.compare_pruning,
+        benchmark_log_input=args.benchmark_log_input
     )
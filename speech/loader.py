@@ -4,8 +4,12 @@ from __future__ import division
 from __future__ import print_function
 # standard libraries
 import copy
+from functools import partial
+import hashlib
 import json
 import math
+import multiprocessing as mp
+import os
 import random
 from typing import List, Tuple
 # third-party libraries
@@ -19,9 +23,14 @@ import torch.utils.data as tud
 from torch.utils.data.distributed import DistributedSampler
 # project libraries
 from speech.utils.wave import array_from_wave
-from speech.utils.io import read_data_json
+from speech.utils.data_structs import TensorBatch
+from speech.utils.io import read_pickle, write_pickle
+from speech.utils.manifest import CompactManifest, is_compact_manifest, load_manifest, ManifestView, META_NAME
+from speech.utils.feature_cache import FeatureCache
+from speech.utils.feature_frontend import BatchFeatureFrontend, pad_audio
+from speech.utils.shards import decode_audio, iterate_shard, read_shard_index
 from speech.utils.signal_augment import (
-    inject_noise, synthetic_gaussian_noise_inject, tempo_gain_pitch_perturb
+    inject_noise, NoiseBank, synthetic_gaussian_noise_inject, tempo_gain_pitch_perturb
 )
 from speech.utils.feature_augment import apply_spec_augment
 
@@ -64,6 +73,8 @@ class Preprocessor():
         self.tempo_range = preproc_cfg['tempo_range']
         self.gain_range = preproc_cfg['gain_range']
         self.pitch_range = preproc_cfg['pitch_range']
+        # 'sox' runs a sox subprocess, 'numpy' perturbs the audio in-process
+        self.tempo_gain_pitch_engine = preproc_cfg.get('tempo_gain_pitch_engine', 'sox')
        
         self.synthetic_gaussian_noise = preproc_cfg.get('synthetic_gaussian_noise', False)
         self.gauss_noise_prob = preproc_cfg.get('gauss_noise_prob', 1.0)
@@ -74,28 +85,52 @@ class Preprocessor():
         self.noise_dir = preproc_cfg.get('background_noise_dir', preproc_cfg.get('noise_directory'))
         self.background_noise_prob = preproc_cfg.get('background_noise_prob', preproc_cfg.get('noise_prob'))
         self.background_noise_range = preproc_cfg.get('background_noise_range', preproc_cfg.get('noise_levels'))     
+        # the noise bank preloads the noise files into a memory-map shared by the loader workers
+        self.noise_bank = None
+        if self.background_noise and preproc_cfg.get('background_noise_bank', False):
+            self.noise_bank = NoiseBank(self.noise_dir, 
+                                        cache_dir=preproc_cfg.get('background_noise_bank_dir'))
         
         self.spec_augment = preproc_cfg.get('spec_augment', preproc_cfg.get('use_spec_augment'))
         self.spec_augment_prob = preproc_cfg.get('spec_augment_prob', 1.0)
         self.spec_augment_policy = preproc_cfg['spec_augment_policy']
 
-        # Compute data mean, std from sample
-        data = read_data_json(data_json)
-        audio_files = [sample['audio'] for sample in data]
-        random.shuffle(audio_files)
-        self.mean, self.std = compute_mean_std(audio_files[:max_samples],
-                                                self.preprocessor, 
-                                                window_size = self.window_size, 
-                                                step_size = self.step_size,
-                                                use_feature_normalize = self.use_feature_normalize
-        )
+        # Compute data mean, std from sample or read them from the stats cache
+        data = load_manifest(data_json)
+        stats_path = None
+        if preproc_cfg.get('mean_std_cache_dir'):
+            stats_path = get_mean_std_cache_path(preproc_cfg['mean_std_cache_dir'], data_json, 
+                                                    preproc_cfg, max_samples)
+        if stats_path is not None and os.path.exists(stats_path):
+            self.mean, self.std = read_pickle(stats_path)
+        else:
+            if isinstance(data, CompactManifest):
+                sample_indices = np.random.permutation(len(data))[:max_samples]
+                audio_files = [data.audio_path(idx) for idx in sample_indices]
+            else:
+                audio_files = [sample['audio'] for sample in data]
+                random.shuffle(audio_files)
+            self.mean, self.std = compute_mean_std(audio_files[:max_samples],
+                                                    self.preprocessor, 
+                                                    window_size = self.window_size, 
+                                                    step_size = self.step_size,
+                                                    use_feature_normalize = self.use_feature_normalize,
+                                                    num_workers = preproc_cfg.get('mean_std_workers', 1)
+            )
+            if stats_path is not None:
+                # written to a temporary file first so other processes never read a partial file
+                write_pickle(stats_path + f".{os.getpid()}.tmp", (self.mean, self.std))
+                os.replace(stats_path + f".{os.getpid()}.tmp", stats_path)
         self._input_dim = self.mean.shape[0]
         self.use_log = (logger is not None)
         self.logger = logger
 
 
         # Make char map
-        chars = sorted(list(set(label for datum in data for label in datum['text'])))
+        if isinstance(data, CompactManifest):
+            chars = sorted(data.tokens)
+        else:
+            chars = sorted(list(set(label for datum in data for label in datum['text'])))
         if start_and_end:
             # START must be last so it can easily be
             # excluded in the output classes of a model.
@@ -115,11 +150,14 @@ class Preprocessor():
         self.char_to_int = {v : k for k, v in self.int_to_char.items()}
     
 
-    def preprocess(self, wave_file:str, text:List[str])->Tuple[np.ndarray, List[int]]:
+    def preprocess(self, wave_file:str, text:List[str], audio_data:np.ndarray=None, 
+                    samp_rate:int=None)->Tuple[np.ndarray, List[int]]:
         """Performs the feature-processing pipeline on the input wave file and text transcript.
         Args: 
             wave_file (str): path to wav file
             text (List[str]): a list of labels 
+            audio_data (np.ndarray): if not None, the pcm16 audio is used instead of reading `wave_file`
+            samp_rate (int): sample rate of `audio_data`
         
         Returns:
             feature_data (np.ndarray): a feature array augmented and processed by a log-spec 
@@ -130,7 +168,7 @@ class Preprocessor():
         if self.use_log: self.logger.info(f"preproc: wave_file: {wave_file}")
         if self.use_log: self.logger.info(f"preproc: text: {text}") 
 
-        audio_data, samp_rate = self.signal_augmentations(wave_file)
+        audio_data, samp_rate = self.signal_augmentations(wave_file, audio_data, samp_rate)
 
         # apply audio processing function
         feature_data = process_audio(audio_data, 
@@ -154,29 +192,50 @@ class Preprocessor():
         return feature_data, targets
 
 
-    def signal_augmentations(self, wave_file:str)-> tuple:
+    def preprocess_raw(self, wave_file:str, text:List[str])->Tuple[np.ndarray, int, List[int]]:
+        """Performs only the signal augmentations and target encoding so the features can be 
+        computed for the whole batch by `FrontendCollate`.
+        Returns:
+            audio_data (np.ndarray): augmented single-channel audio
+            samp_rate (int): sample rate of the audio
+            targets (List[int]): a list of the integer-encoded phoneme labels
+        """
+        audio_data, samp_rate = self.signal_augmentations(wave_file)
+        audio_data = average_channels(audio_data)
+        return audio_data, samp_rate, self.encode(text)
+
+
+    def signal_augmentations(self, wave_file:str, audio_data:np.ndarray=None, 
+                                samp_rate:int=None)-> tuple:
         """
         Performs all of the augmtations to the raw audio signal. The audio data is in pcm16 format.
         Arguments:
             wave_file - str: the path to the audio sample
+            audio_data - np.ndarray: if not None, the audio is used instead of reading `wave_file`
+            samp_rate - int: sample rate of `audio_data`
         Returns:
             audio_data - np.ndarray: augmented np-array
             samp_rate - int: sample rate of the audio recording
         """
         if self.use_log: self.logger.info(f"preproc: audio_data read: {wave_file}")
         
-        audio_data, samp_rate = array_from_wave(wave_file)
+        if audio_data is None:
+            audio_data, samp_rate = array_from_wave(wave_file)
+            audio_source = wave_file
+        else:   # the in-memory audio is passed to sox if it doesn't come from a file 
+            audio_source = audio_data
 
         # sox-based tempo, gain, pitch augmentations
         if self.tempo_gain_pitch_perturb and self.train_status:
             if np.random.binomial(1, self.tempo_gain_pitch_prob): 
-                audio_data, samp_rate = tempo_gain_pitch_perturb(wave_file, 
+                audio_data, samp_rate = tempo_gain_pitch_perturb(audio_source, 
                                                                 samp_rate, 
                                                                 self.tempo_range,
                                                                 self.gain_range, 
                                                                 self.pitch_range, 
                                                                 self.augment_from_normal, 
-                                                                logger=self.logger)
+                                                                logger=self.logger,
+                                                                engine=self.tempo_gain_pitch_engine)
                 if self.use_log: self.logger.info(f"preproc: tempo_gain_pitch applied")
 
         # synthetic gaussian noise
@@ -196,7 +255,8 @@ class Preprocessor():
                                             self.noise_dir, 
                                             self.background_noise_range, 
                                             self.augment_from_normal, 
-                                            self.logger) 
+                                            self.logger,
+                                            noise_bank=self.noise_bank) 
                 if self.use_log: self.logger.info(f"preproc: noise injected")
         
         return audio_data, samp_rate
@@ -257,6 +317,8 @@ class Preprocessor():
                 self.pitch_range = [0,0]    # no pitch augmentation
             else:
                 self.tempo_gain_pitch_perturb = False
+        if not hasattr(self, 'tempo_gain_pitch_engine'):
+            self.tempo_gain_pitch_engine = 'sox'
         if not hasattr(self, 'train_status'):
             self.train_status = True
         if not hasattr(self, 'synthetic_gaussian_noise'):
@@ -267,6 +329,8 @@ class Preprocessor():
             self.preprocessor = "log_spectrogram"
         if not hasattr(self, 'background_noise'):
             self.background_noise = False
+        if not hasattr(self, 'noise_bank'):
+            self.noise_bank = None
         if not hasattr(self, 'use_feature_normalize'):
             self.use_feature_normalize = False
         # removing the old attritube to separate feature_normalize
@@ -287,6 +351,21 @@ class Preprocessor():
         """
         self.train_status = True
 
+    @property
+    def is_deterministic(self)->bool:
+        """
+        returns true if no augmentation will be applied, so the features of an audio file
+        will be the same every time it is preprocessed
+        """
+        if not self.train_status:
+            return True
+        augmentations = [
+            self.tempo_gain_pitch_perturb,
+            getattr(self, 'synthetic_gaussian_noise', False),
+            getattr(self, 'background_noise', False),
+            getattr(self, 'spec_augment', False)
+        ]
+        return not any(augmentations)
 
     @property
     def input_dim(self):
@@ -327,50 +406,139 @@ def compute_mean_std(audio_files: List[str],
                      preprocessor: str, 
                      window_size: int, 
                      step_size: int, 
-                     use_feature_normalize:bool)->Tuple[np.ndarray, np.ndarray]:
+                     use_feature_normalize:bool,
+                     num_workers:int=1)->Tuple[np.ndarray, np.ndarray]:
     """
     Compute the mean and std deviation of all of the feature bins (frequency bins if log_spec
     preprocessor). Will first normalize the audio samples if use_feature_normalize is true.
+    The statistics of each file are merged into a running count, mean, and sum of squared 
+    deviations, so the feature frames of all files are never held in memory at once.
     Args:
         audio_files - List[str]: a list of shuffled audio files. len = max_samples
         preprocessor (str): name of preprocessor
         window_size - int: window_size of preprocessor
         step_size - int: step_size of preprocessor
         use_feature_normalize - bool: whether or not the features themselves are normalized
+        num_workers - int: number of processes computing the features, if 1 no pool is used
     Returns:
         mean - np.ndarray: the mean of the feature bins - shape = (# feature bins,)
         std  - np.ndarray: the std deviation of the feature bins - shape = (# bins,)
     """
     assert len(audio_files) > 0, "input list of audio_files is empty"
 
-    samples = []
-    for audio_file in audio_files: 
-        audio_data, samp_rate = array_from_wave(audio_file)
-        feature_array = process_audio(audio_data, samp_rate, window_size, step_size, preprocessor)
-        if use_feature_normalize:
-            feature_array = feature_normalize(feature_array)   # normalize the feature
-        samples.append(feature_array)
+    stats_fn = partial(feature_stats, 
+                        preprocessor=preprocessor, 
+                        window_size=window_size, 
+                        step_size=step_size, 
+                        use_feature_normalize=use_feature_normalize)
+    
+    total_stats = None
+    if num_workers > 1:
+        with mp.Pool(processes=num_workers) as pool:
+            # imap keeps the merge order fixed so the result doesn't depend on the workers
+            for stats in pool.imap(stats_fn, audio_files, chunksize=4):
+                total_stats = merge_feature_stats(total_stats, stats)
+    else:
+        for audio_file in audio_files:
+            total_stats = merge_feature_stats(total_stats, stats_fn(audio_file))
+    
+    count, mean, sq_dev_sum = total_stats
+    std = np.sqrt(sq_dev_sum / count)
+    return mean.astype(np.float32), std.astype(np.float32)
+
+
+def feature_stats(audio_file:str, 
+                  preprocessor:str, 
+                  window_size:int, 
+                  step_size:int, 
+                  use_feature_normalize:bool)->Tuple[int, np.ndarray, np.ndarray]:
+    """
+    Returns the number of frames, the mean, and the sum of squared deviations from the mean 
+    of the feature bins of a single audio file.
+    """
+    audio_data, samp_rate = array_from_wave(audio_file)
+    feature_array = process_audio(audio_data, samp_rate, window_size, step_size, preprocessor)
+    if use_feature_normalize:
+        feature_array = feature_normalize(feature_array)   # normalize the feature
     
-    # compute mean and std dev of the feature bins (along axis=0)
-    # feature arrays aka samples are time x feature bin
-    samples = np.vstack(samples) # stacks along time axis: shape = (all_time, feature bin)
-    mean = np.mean(samples, axis=0, dtype='float32') # computes mean along time axis: shape = (feature bin,)
-    std = np.std(samples, axis=0, dtype='float32')
-    return mean, std
+    feature_array = feature_array.astype(np.float64)
+    mean = feature_array.mean(axis=0)
+    sq_dev_sum = ((feature_array - mean)**2).sum(axis=0)
+    return feature_array.shape[0], mean, sq_dev_sum
+
+
+def merge_feature_stats(stats_a:tuple, stats_b:tuple)->Tuple[int, np.ndarray, np.ndarray]:
+    """
+    Merges two sets of (count, mean, sum of squared deviations) with the parallel update 
+    of Chan et al. If `stats_a` is None, `stats_b` is returned. A set with a count of zero, 
+    like a file shorter than a window, has a NaN mean and is skipped.
+    """
+    if stats_a is None:
+        return stats_b
+    count_a, mean_a, sq_dev_a = stats_a
+    count_b, mean_b, sq_dev_b = stats_b
+    if count_b == 0:
+        return stats_a
+    if count_a == 0:
+        return stats_b
+    count = count_a + count_b
+    delta = mean_b - mean_a
+    mean = mean_a + delta * count_b / count
+    sq_dev_sum = sq_dev_a + sq_dev_b + delta**2 * count_a * count_b / count
+    return count, mean, sq_dev_sum
+
+
+def get_mean_std_cache_path(cache_dir:str, data_json:str, preproc_cfg:dict, max_samples:int)->str:
+    """
+    Returns the path of the cached mean and std. The name is a hash of the contents of the 
+    dataset json and the feature configuration, so the stats are recomputed if either changes.
+    """
+    hasher = hashlib.md5()
+    # the meta file of a compact manifest includes the hash of its source json
+    if is_compact_manifest(data_json):
+        data_json = os.path.join(data_json, META_NAME)
+    with open(data_json, 'rb') as fid:
+        for chunk in iter(lambda: fid.read(2**20), b''):
+            hasher.update(chunk)
+    config = {
+        "preprocessor": preproc_cfg['preprocessor'],
+        "window_size": preproc_cfg['window_size'],
+        "step_size": preproc_cfg['step_size'],
+        "use_feature_normalize": preproc_cfg['use_feature_normalize'],
+        "max_samples": max_samples
+    }
+    hasher.update(json.dumps(config, sort_keys=True).encode('utf-8'))
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(cache_dir, f"mean_std_{hasher.hexdigest()}.pickle")
 
 
 class AudioDataset(tud.Dataset):
 
-    def __init__(self, data_json, preproc, batch_size):
+    def __init__(self, data_json, preproc, batch_size, feature_cache:FeatureCache=None,
+                 raw_audio:bool=False):
         """
         this code sorts the samples in data based on the length of the transcript lables and the audio
         sample duration. It does this by creating a number of buckets and sorting the samples
         into different buckets based on the length of the labels. It then sorts the buckets based 
         on the duration of the audio sample.
+
+        Args:
+            feature_cache (FeatureCache): if not None, the precomputed features will be read from 
+                the cache when the preprocessor applies no augmentation
+            raw_audio (bool): if true, the augmented audio is returned instead of the features
+                so the features can be computed by `FrontendCollate`
         """
 
-        data = read_data_json(data_json)        #loads the data_json into a list
+        data = load_manifest(data_json)         #loads the data_json into a list or compact manifest
         self.preproc = preproc                  # assign the preproc object
+        self.feature_cache = feature_cache
+        self.raw_audio = raw_audio
+
+        if isinstance(data, CompactManifest):
+            # the compact manifest is sorted by index without creating a dict for every example
+            self.data = ManifestView(data, bucket_sort_order(data.label_lens, data.durations))
+            print(f"in AudioDataset: length of data: {len(self.data)}")
+            return
 
         bucket_diff = 4                             # number of different buckets
         max_len = max(len(x['text']) for x in data) # max number of phoneme labels in data
@@ -397,10 +565,171 @@ class AudioDataset(tud.Dataset):
 
     def __getitem__(self, idx):
         datum = self.data[idx]
+        if self.raw_audio:
+            return self.preproc.preprocess_raw(datum["audio"], datum["text"])
+        if self.use_feature_cache(datum["audio"]):
+            return self.feature_cache[datum["audio"]], self.preproc.encode(datum["text"])
+
         datum = self.preproc.preprocess(datum["audio"],
                                         datum["text"])
         return datum
 
+    def use_feature_cache(self, audio_path:str)->bool:
+        """
+        the cached features are only used if the preprocessor won't augment the audio
+        """
+        return self.feature_cache is not None \
+            and self.preproc.is_deterministic \
+            and audio_path in self.feature_cache
+
+
+def bucket_sort_order(label_lens:np.ndarray, durations:np.ndarray, bucket_diff:int=4)->np.ndarray:
+    """
+    Returns the indices of the examples in the order of `AudioDataset`: sorted into buckets by 
+    label length and within each bucket by the rounded duration and the label length.
+    """
+    num_buckets = label_lens.max() // bucket_diff
+    bucket_ids = np.minimum(label_lens // bucket_diff, num_buckets - 1)
+    # python's round is used because np.round differs on values like 0.95
+    rounded_durations = np.array([round(float(duration), 1) for duration in durations])
+    # lexsort is stable and sorts by the last key first
+    return np.lexsort((label_lens, rounded_durations, bucket_ids))
+
+
+class ShardedAudioDataset(tud.IterableDataset):
+    """
+    Streams the examples in the tar shards written by `speech.utils.shards.write_shards` and 
+    yields batches. The shards are shuffled each epoch and split across the distributed replicas 
+    and dataloader workers. Examples are read into a buffer that is sorted by duration and label 
+    length, like the buckets in `AudioDataset`, and split into batches that are yielded 
+    in random order. 
+
+    Every replica yields the same number of batches so the distributed processes stay in step.
+
+    Args:
+        shard_index (str): path to the `shards.json` shard index
+        preproc (Preprocessor): preprocessor applied to each example
+        batch_size (int): number of examples in a batch
+        buffer_size (int): number of examples sorted together into batches
+        num_workers (int): number of dataloader workers that will iterate the dataset
+        num_replicas (int, optional): number of distributed processes
+        rank (int, optional): rank of the current process within num_replicas
+        seed (int): seed for the shuffling of the shards and batches
+    """
+
+    def __init__(self, shard_index:str, preproc, batch_size:int, buffer_size:int=2000,
+                 num_workers:int=0, num_replicas:int=None, rank:int=None, seed:int=0):
+        
+        if num_replicas is None:
+            num_replicas = torch.distributed.get_world_size() \
+                if torch.distributed.is_initialized() else 1
+        if rank is None:
+            rank = torch.distributed.get_rank() if torch.distributed.is_initialized() else 0
+
+        self.shards = read_shard_index(shard_index)
+        assert len(self.shards) >= num_replicas * max(num_workers, 1), \
+            f"{len(self.shards)} shards can't be split across {num_replicas} replicas " \
+            f"with {num_workers} workers"
+        assert buffer_size >= batch_size, "buffer_size must be at least the batch_size"
+
+        self.preproc = preproc
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self.num_workers = num_workers
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.epoch = 0
+        print(f"in ShardedAudioDataset: rank: {self.rank} num shards: {len(self.shards)}")
+        print(f"in ShardedAudioDataset: rank: {self.rank} batches per replica: {len(self)}")
+
+    def set_epoch(self, epoch:int)->None:
+        self.epoch = epoch
+
+    def _replica_shards(self, rank:int)->List[List[dict]]:
+        """returns the shards of each worker for the replica `rank`"""
+        # all replicas shuffle the shards identically based on the epoch
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        order = torch.randperm(len(self.shards), generator=g).tolist()
+        replica_shards = [self.shards[i] for i in order[rank::self.num_replicas]]
+        num_workers = max(self.num_workers, 1)
+        return [replica_shards[w::num_workers] for w in range(num_workers)]
+
+    def _worker_batch_limits(self, rank:int)->List[int]:
+        """
+        returns the number of batches each worker of replica `rank` will yield. The total for
+        each replica is the smallest total across all replicas so every replica takes the same
+        number of steps.
+        """
+        def worker_batches(rank):
+            return [
+                sum(shard['num_examples'] for shard in shards) // self.batch_size
+                for shards in self._replica_shards(rank)
+            ]
+
+        replica_total = min(sum(worker_batches(r)) for r in range(self.num_replicas))
+        limits = list()
+        for n_batches in worker_batches(rank):
+            limits.append(min(n_batches, replica_total - sum(limits)))
+        return limits
+
+    def __iter__(self):
+        worker_info = tud.get_worker_info()
+        worker_id = 0 if worker_info is None else worker_info.id
+        shards = self._replica_shards(self.rank)[worker_id]
+        batch_limit = self._worker_batch_limits(self.rank)[worker_id]
+        rng = random.Random(hash((self.seed, self.epoch, self.rank, worker_id)))
+        # the worker's shards are read in a random order
+        rng.shuffle(shards)
+
+        n_batches = 0
+        buffer = list()
+        for shard in shards:
+            for example in iterate_shard(shard['path']):
+                buffer.append(example)
+                if len(buffer) < self.buffer_size:
+                    continue
+                batches, buffer = self._buffer_to_batches(buffer, rng)
+                for batch in batches:
+                    if n_batches == batch_limit:
+                        return
+                    yield self._preprocess_batch(batch)
+                    n_batches += 1
+        
+        batches, _ = self._buffer_to_batches(buffer, rng)
+        for batch in batches:
+            if n_batches == batch_limit:
+                return
+            yield self._preprocess_batch(batch)
+            n_batches += 1
+
+    def _buffer_to_batches(self, buffer:List[dict], rng:random.Random)->Tuple[list, list]:
+        """
+        sorts the buffer and splits it into full batches in random order. The examples that
+        don't fill a batch are returned to be carried into the next buffer.
+        """
+        sort_fn = lambda x: (round(x['duration'], 1), len(x['text']))
+        buffer.sort(key=sort_fn)
+        n_full = len(buffer) // self.batch_size * self.batch_size
+        batches = [
+            buffer[i:i + self.batch_size] for i in range(0, n_full, self.batch_size)
+        ]
+        rng.shuffle(batches)
+        return batches, buffer[n_full:]
+
+    def _preprocess_batch(self, batch:List[dict])->List[tuple]:
+        output = list()
+        for example in batch:
+            audio_data, samp_rate = decode_audio(example['audio_bytes'])
+            output.append(
+                self.preproc.preprocess(example['audio'], example['text'], audio_data, samp_rate)
+            )
+        return output
+
+    def __len__(self):
+        return sum(self._worker_batch_limits(self.rank))
+
 
 class BatchRandomSampler(tud.sampler.Sampler):
     """
@@ -427,7 +756,41 @@ class BatchRandomSampler(tud.sampler.Sampler):
         return len(self.data_source)
 
 
-class DistributedBatchRandomSampler(DistributedSampler):
+class ResumableDistributedSampler(DistributedSampler):
+    """
+    Distributed sampler whose position in an epoch can be saved and restored. The order of 
+    the batches depends only on the epoch, so the epoch and the number of batches the replica
+    has consumed are enough to resume an epoch from the next batch. The sub-classes slice the
+    replica's batches with `start_batch` in `__iter__`.
+    """
+
+    def __init__(self, dataset, num_replicas=None, rank=None):
+        super().__init__(dataset=dataset, num_replicas=num_replicas, rank=rank)
+        self.start_batch = 0
+
+    def set_epoch(self, epoch:int)->None:
+        super().set_epoch(epoch)
+        self.start_batch = 0
+
+    def state_dict(self, batches_consumed:int)->dict:
+        """Returns the sampler position after `batches_consumed` batches of the current
+        iteration, which started at `start_batch` if the epoch was resumed
+        """
+        return {
+            "epoch": self.epoch, 
+            "batches_consumed": self.start_batch + batches_consumed,
+            "num_replicas": self.num_replicas
+        }
+
+    def load_state_dict(self, state:dict)->None:
+        """Sets the epoch and the number of batches to skip in the next iteration"""
+        assert state["num_replicas"] == self.num_replicas, \
+            f"sampler state from {state['num_replicas']} replicas can't resume {self.num_replicas} replicas"
+        self.epoch = state["epoch"]
+        self.start_batch = state["batches_consumed"]
+
+
+class DistributedBatchRandomSampler(ResumableDistributedSampler):
     """
     Batches the data consecutively and randomly samples
     by batch without replacement with distributed data parallel
@@ -482,6 +845,8 @@ class DistributedBatchRandomSampler(DistributedSampler):
         offset = self.n_batch_per_replica * self.rank
         batch_indices = batch_indices[offset:offset + self.n_batch_per_replica]
         assert len(batch_indices) == self.n_batch_per_replica
+        # skips the batches consumed before the epoch was resumed
+        batch_indices = batch_indices[self.start_batch:]
         
         print(f"in DistBatchSamp: rank: {self.rank} batches per replica: {len(batch_indices)}")
         print(f"in DistBatchSamp: rank: {self.rank} total_size: {self.total_size}")
@@ -493,41 +858,244 @@ class DistributedBatchRandomSampler(DistributedSampler):
         return  (idx for batch_idx in batch_indices for idx in self.batches[batch_idx])
 
     def __len__(self):
-        return self.n_batch_per_replica * self.batch_size
+        return (self.n_batch_per_replica - self.start_batch) * self.batch_size
+
+
+class DistributedFrameBatchSampler(ResumableDistributedSampler):
+    """
+    Packs the duration-sorted examples into batches whose padded size, the number of examples 
+    times the frames of the longest example, is at most `max_frames`. The batches are shuffled
+    by epoch and split across the replicas so every replica takes the same number of steps.
+    This sampler yields lists of indices and is passed to the loader as the `batch_sampler`.
+
+    Args: 
+        dataset: AudioDataset whose examples have a `duration` in seconds
+        max_frames (int): maximum number of padded feature frames in a batch
+        step_size (int): step size of the preprocessor in milliseconds, used to convert the
+            durations into feature frames
+        num_replicas (int, optional): Number of processes participating in distributed training.
+        rank (int, optional): Rank of the current process within num_replicas.
+        max_batch_size (int, optional): if not None, the maximum number of examples in a batch
+    """
+
+    def __init__(self, dataset, max_frames:int, step_size:int, num_replicas=None, rank=None, 
+                 max_batch_size:int=None):
+        super().__init__(dataset=dataset, num_replicas=num_replicas, rank=rank)
+        
+        self.max_frames = max_frames
+        frames = [example_frames(example['duration'], step_size) for example in dataset.data]
+        self.batches = pack_frame_batches(frames, max_frames, max_batch_size)
+        if len(self.batches) < self.num_replicas:
+            raise ValueError(f"number of batches: {len(self.batches)} is less than num_replicas")
+        self.n_batch_per_replica = len(self.batches) // self.num_replicas
+        self.total_size = self.n_batch_per_replica * self.num_replicas
+        self.efficiency = padding_efficiency(frames, self.batches)
+
+        print(f"in FrameBatchSamp: rank: {self.rank} num batches: {len(self.batches)}")
+        print(f"in FrameBatchSamp: rank: {self.rank} batches per replica: {self.n_batch_per_replica}")
+        print(f"in FrameBatchSamp: rank: {self.rank} mean batch size: {len(dataset) / len(self.batches):.1f}")
+        print(f"in FrameBatchSamp: rank: {self.rank} padding efficiency: {self.efficiency:.3f}")
+
+    def __iter__(self):
+        # deterministically shuffle based on epoch so all replicas have the same order
+        g = torch.Generator()
+        g.manual_seed(self.epoch)
+        batch_indices = torch.randperm(len(self.batches), generator=g).tolist()[:self.total_size]
+        
+        # the batches are dealt out so each replica gets a mix of short and long batches
+        batch_indices = batch_indices[self.rank:self.total_size:self.num_replicas]
+        assert len(batch_indices) == self.n_batch_per_replica
+        return (self.batches[batch_idx] for batch_idx in batch_indices[self.start_batch:])
+
+    def __len__(self):
+        return self.n_batch_per_replica - self.start_batch
+
+
+class DistributedEvalBatchSampler(tud.sampler.Sampler):
+    """
+    Splits the dataset into consecutive batches of the length-sorted examples and deals the 
+    batches out to the replicas. Unlike the training samplers, no example is dropped or 
+    repeated, so the replicas together evaluate every example exactly once. The last batch can
+    be smaller than `batch_size` and a replica can have one batch fewer than the others.
+    This sampler yields lists of indices and is passed to the loader as the `batch_sampler`.
+
+    Args: 
+        dataset: Dataset used for sampling.
+        batch_size (int): maximum number of examples in a batch
+        num_replicas (int, optional): Number of processes participating in distributed training.
+        rank (int, optional): Rank of the current process within num_replicas.
+    """
+
+    def __init__(self, dataset, batch_size:int, num_replicas=None, rank=None):
+        if num_replicas is None:
+            num_replicas = torch.distributed.get_world_size()
+        if rank is None:
+            rank = torch.distributed.get_rank()
+        assert 0 <= rank < num_replicas, f"rank: {rank} is not in [0, {num_replicas})"
+        self.num_replicas = num_replicas
+        self.rank = rank
+        batches = [
+            list(range(i, min(i + batch_size, len(dataset)))) 
+            for i in range(0, len(dataset), batch_size)
+        ]
+        self.batches = batches[rank::num_replicas]
+
+    def __iter__(self):
+        return iter(self.batches)
+
+    def __len__(self):
+        return len(self.batches)
+
+
+def get_resumable_sampler(ldr:tud.DataLoader)->ResumableDistributedSampler:
+    """Returns the resumable sampler of the loader or None if it doesn't have one"""
+    for sampler in (ldr.batch_sampler, ldr.sampler):
+        if isinstance(sampler, ResumableDistributedSampler):
+            return sampler
+    return None
+
+
+def example_frames(duration:float, step_size:int)->int:
+    """Approximate number of feature frames in an example of `duration` seconds
+    """
+    return max(int(duration * 1000 / step_size), 1)
+
+
+def pack_frame_batches(frames:List[int], max_frames:int, max_batch_size:int=None)->List[List[int]]:
+    """
+    Greedily packs the indices of the examples sorted by number of frames into batches with 
+    at most `max_frames` padded frames. An example longer than `max_frames` is its own batch.
+    """
+    sorted_indices = sorted(range(len(frames)), key=lambda idx: frames[idx])
+    batches, batch = list(), list()
+    for idx in sorted_indices:
+        # the examples are sorted, so the current example is the longest in the batch
+        padded_frames = (len(batch) + 1) * frames[idx]
+        batch_full = max_batch_size is not None and len(batch) >= max_batch_size
+        if batch and (padded_frames > max_frames or batch_full):
+            batches.append(batch)
+            batch = list()
+        batch.append(idx)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def padding_efficiency(frames:List[int], batches:List[List[int]])->float:
+    """
+    Ratio of the number of real frames to the number of padded frames across all batches
+    """
+    real_frames = sum(frames[idx] for batch in batches for idx in batch)
+    padded_frames = sum(len(batch) * max(frames[idx] for idx in batch) for batch in batches)
+    return real_frames / padded_frames
 
 
 def make_loader(dataset_json, preproc,
-                batch_size, num_workers=4):
-    dataset = AudioDataset(dataset_json, preproc, batch_size)
+                batch_size, num_workers=4, feature_cache:FeatureCache=None, 
+                batch_frontend:bool=False):
+    """Creates a loader with batches sorted by length. If `batch_frontend` is true, the features
+    are computed for the whole batch in the collate function by `FrontendCollate`.
+    """
+    dataset = AudioDataset(dataset_json, preproc, batch_size, feature_cache=feature_cache,
+                            raw_audio=batch_frontend)
     sampler = BatchRandomSampler(dataset, batch_size)
     loader = tud.DataLoader(dataset,
                 batch_size=batch_size,
                 sampler=sampler,
                 num_workers=num_workers,
-                collate_fn=collate_fn,
+                collate_fn=FrontendCollate(preproc) if batch_frontend else collate_fn,
                 drop_last=True)
     return loader
 
 def make_ddp_loader(dataset_json, 
                     preproc,
                     batch_size, 
-                    num_workers=4):
+                    num_workers=4,
+                    batch_frontend:bool=False,
+                    max_frames:int=None,
+                    tensor_collate:bool=False):
     """Creates a load compatibile with distributed data parallel (ddp).
+    If `max_frames` is not None, the batches are packed up to a budget of padded feature frames
+    by `DistributedFrameBatchSampler` instead of having `batch_size` examples. 
+    If `tensor_collate` is true, the loader returns a pinned `TensorBatch` built by `TensorCollate`.
     """
     
-    dataset = AudioDataset(dataset_json, preproc, batch_size)
+    dataset = AudioDataset(dataset_json, preproc, batch_size, raw_audio=batch_frontend)
+    batch_collate_fn = FrontendCollate(preproc) if batch_frontend else collate_fn
+    if tensor_collate:
+        batch_collate_fn = TensorCollate(feature_collate=batch_collate_fn if batch_frontend else None)
+
+    if max_frames is not None:
+        batch_sampler = DistributedFrameBatchSampler(dataset, max_frames, preproc.step_size)
+        loader = tud.DataLoader(
+                    dataset,
+                    batch_sampler=batch_sampler,
+                    num_workers=num_workers,
+                    collate_fn=batch_collate_fn,
+                    pin_memory=True
+        )
+        return loader
+
     sampler = DistributedBatchRandomSampler(dataset, batch_size=batch_size)
     loader = tud.DataLoader(
                 dataset,
                 batch_size=batch_size,
                 sampler=sampler,
                 num_workers=num_workers,
-                collate_fn=collate_fn,
+                collate_fn=batch_collate_fn,
                 drop_last=True,
                 pin_memory=True
     )
     return loader
 
+def make_eval_loader(dataset_json, 
+                     preproc,
+                     batch_size, 
+                     num_workers=4,
+                     feature_cache:FeatureCache=None,
+                     num_replicas:int=None,
+                     rank:int=None):
+    """Creates a loader over this replica's share of the dataset for distributed evaluation. 
+    The batches are split by `DistributedEvalBatchSampler`, so the replicas evaluate every 
+    example exactly once.
+    """
+    dataset = AudioDataset(dataset_json, preproc, batch_size, feature_cache=feature_cache)
+    batch_sampler = DistributedEvalBatchSampler(
+        dataset, batch_size, num_replicas=num_replicas, rank=rank
+    )
+    loader = tud.DataLoader(
+                dataset,
+                batch_sampler=batch_sampler,
+                num_workers=num_workers,
+                collate_fn=collate_fn,
+                pin_memory=True
+    )
+    return loader
+
+def make_shard_loader(shard_index:str,
+                      preproc,
+                      batch_size:int,
+                      num_workers:int=4,
+                      buffer_size:int=2000):
+    """Creates a loader that streams the tar shards in `shard_index`. The dataset does the 
+    batching, shuffling, and distributed splitting, so the loader has no sampler.
+    """
+    dataset = ShardedAudioDataset(
+        shard_index, 
+        preproc, 
+        batch_size, 
+        buffer_size=buffer_size, 
+        num_workers=num_workers
+    )
+    loader = tud.DataLoader(
+                dataset,
+                batch_size=None,
+                num_workers=num_workers,
+                collate_fn=collate_fn,
+                pin_memory=True
+    )
+    return loader
+
 class CustomBatch:
     """
     This class is based on: https://pytorch.org/docs/stable/data.html#memory-pinning. 
@@ -555,6 +1123,98 @@ def collate_fn(batch):
     return zip(*batch)
 
 
+class FrontendCollate():
+    """Collate function that computes the normalized features of a batch of raw audio from 
+    `AudioDataset` with `raw_audio=True` in a single call to `BatchFeatureFrontend`. The feature 
+    augmentations are applied to each example afterwards, so the output matches `collate_fn` 
+    applied to the output of `Preprocessor.preprocess`.
+
+    Args:
+        preproc (Preprocessor): preprocessor with the feature configuration and normalization
+        sample_rate (int): sample rate of all audio in the dataset
+    """
+
+    def __init__(self, preproc, sample_rate:int=16000):
+        self.preproc = preproc
+        self.sample_rate = sample_rate
+        self.frontend = BatchFeatureFrontend.from_preproc(preproc, sample_rate)
+
+    def __call__(self, batch):
+        audio_list, samp_rates, labels = zip(*batch)
+        assert all(rate == self.sample_rate for rate in samp_rates), \
+            f"sample rates: {set(samp_rates)} don't match frontend rate: {self.sample_rate}"
+
+        audio, audio_lens = pad_audio(audio_list)
+        with torch.no_grad():
+            features, frame_lens = self.frontend(audio, audio_lens)
+        features = features.numpy()
+
+        inputs = tuple(
+            self.preproc.feature_augmentations(features[i, :n]) 
+            for i, n in enumerate(frame_lens.tolist())
+        )
+        return inputs, labels
+
+
+class TensorCollate():
+    """Collate function that builds a `TensorBatch` of the zero-padded inputs, the concatenated 
+    labels, and the true lengths inside the loader workers, so the training process only moves 
+    tensors to the device. The padded inputs are written into a ring of preallocated buffers 
+    whose sizes are rounded up to `bucket_frames` per example, so a buffer is reused by all 
+    batches of a similar size instead of allocating a new array for every batch.
+
+    Args:
+        num_buffers (int): number of buffers in the ring. A buffer is overwritten `num_buffers` 
+            batches after it was returned, so it must be greater than the number of batches 
+            in flight for each worker (`prefetch_factor` + 1).
+        bucket_frames (int): the buffer size is rounded up to a multiple of this many frames
+        feature_collate (callable): if not None, it is called on the batch first and returns 
+            the (inputs, labels) of the batch, such as `FrontendCollate`
+    """
+
+    def __init__(self, num_buffers:int=4, bucket_frames:int=64, feature_collate=None):
+        self.num_buffers = num_buffers
+        self.bucket_frames = bucket_frames
+        self.feature_collate = feature_collate
+        self._buffers = [None] * num_buffers
+        self._buffer_idx = 0
+
+    def __getstate__(self):
+        # the buffers are not pickled and each worker allocates its own
+        state = self.__dict__.copy()
+        state['_buffers'] = [None] * self.num_buffers
+        return state
+
+    def _next_buffer(self, batch_size:int, max_t:int, feature_dim:int)->torch.Tensor:
+        """Returns a zeroed, contiguous (batch_size, max_t, feature_dim) view of the next buffer
+        """
+        bucket_t = int(math.ceil(max_t / self.bucket_frames)) * self.bucket_frames
+        numel = batch_size * bucket_t * feature_dim
+        buffer = self._buffers[self._buffer_idx]
+        if buffer is None or buffer.numel() < numel:
+            buffer = torch.empty(numel, dtype=torch.float32)
+            self._buffers[self._buffer_idx] = buffer
+        self._buffer_idx = (self._buffer_idx + 1) % self.num_buffers
+        
+        inputs = buffer[:batch_size * max_t * feature_dim].view(batch_size, max_t, feature_dim)
+        return inputs.zero_()
+
+    def __call__(self, batch)->TensorBatch:
+        if self.feature_collate is not None:
+            inputs, labels = self.feature_collate(batch)
+        else:
+            inputs, labels = zip(*batch)
+
+        input_lens = torch.IntTensor([inp.shape[0] for inp in inputs])
+        padded_inputs = self._next_buffer(len(inputs), int(input_lens.max()), inputs[0].shape[1])
+        for e, inp in enumerate(inputs):
+            padded_inputs[e, :inp.shape[0]] = torch.from_numpy(np.asarray(inp, dtype=np.float32))
+
+        label_lens = torch.IntTensor([len(label) for label in labels])
+        flat_labels = torch.IntTensor([l for label in labels for l in label])
+        return TensorBatch(padded_inputs, flat_labels, input_lens, label_lens)
+
+
 #######    DATA PREPROCESSING    ########
 
 def process_audio(audio, samp_rate:int, window_size=32, step_size=16, processing='log_spectrogram'):
@@ -0,0 +1,144 @@
+"""
+Decodes the utterances of a batch in parallel in a persistent pool of worker processes. The
+padded probabilities of a batch are copied once into a shared-memory block, which the workers
+read without pickling the arrays. A submitted batch is decoded while the next batch runs through
+the model, and `DecodeJob.get` returns the n-best lists of the batch in order.
+"""
+# standard libraries
+import math
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from typing import List, Tuple
+# third-party libraries
+import numpy as np
+import torch
+# project libraries
+from speech.models.ctc_decoder_fast import decode
+
+
+class DecodeJob():
+    """Handle of a submitted batch whose `get` method returns the n-best list of each utterance"""
+
+    def __init__(self, results:list=None, async_results:list=None, shm=None):
+        self._results = results
+        self._async_results = async_results
+        self._shm = shm
+
+    def ready(self)->bool:
+        return self._results is not None or all(result.ready() for result in self._async_results)
+
+    def get(self)->List[List[Tuple[Tuple[int, ...], float]]]:
+        if self._results is None:
+            try:
+                self._results = [nbest for result in self._async_results for nbest in result.get()]
+            finally:
+                self._shm.close()
+                self._shm.unlink()
+        return self._results
+
+
+class BatchDecoder():
+    """
+    Beam search decoder of padded batches that spreads the utterances across a persistent pool
+    of `num_workers` processes. If `num_workers` is zero, the batches are decoded in the calling
+    process when they are submitted.
+
+    Args:
+        num_workers (int): number of decoding processes
+        beam_size (int): size of the beam of the decoder
+        blank (int): index of the CTC blank label
+        n_top_beams (int): number of beams in the n-best list of each utterance
+        pruning (dict): optional `blank_threshold`, `top_k`, and `cum_prob` pruning arguments of
+            the decoder
+        log_input (bool): if true, the submitted batches are log-probabilities
+    """
+
+    def __init__(self, num_workers:int=4, beam_size:int=3, blank:int=0, n_top_beams:int=1,
+                 pruning:dict=None, log_input:bool=False):
+        self.num_workers = num_workers
+        self.beam_size = beam_size
+        self.blank = blank
+        self.n_top_beams = n_top_beams
+        self.pruning = pruning or dict()
+        self.log_input = log_input
+        # spawn doesn't copy the cuda state of the model process into the workers
+        self._pool = mp.get_context("spawn").Pool(num_workers) if num_workers > 0 else None
+
+    def submit(self, probs, lengths=None)->DecodeJob:
+        """Starts decoding the batch of probabilities
+
+        Args:
+            probs (torch.Tensor or np.ndarray): padded (batch, time, vocab) output probabilities
+                or log-probabilities if `log_input` is true
+            lengths (torch.Tensor or np.ndarray): number of valid time steps of each utterance.
+                if None, every utterance is decoded over the full time dimension.
+        """
+        if isinstance(probs, torch.Tensor):
+            probs = probs.detach().cpu().numpy()
+        probs = np.ascontiguousarray(probs, dtype=np.float32)
+        batch_size, max_len, _ = probs.shape
+        if lengths is None:
+            lengths = [max_len] * batch_size
+        elif isinstance(lengths, torch.Tensor):
+            lengths = lengths.tolist()
+        else:
+            lengths = [int(length) for length in lengths]
+        assert len(lengths) == batch_size, f"{len(lengths)} lengths for a batch of {batch_size}"
+        decode_args = (self.beam_size, self.blank, self.n_top_beams, self.pruning, self.log_input)
+
+        if self._pool is None or batch_size == 0:
+            return DecodeJob(results=_decode_rows(probs, range(batch_size), lengths, *decode_args))
+
+        shm = shared_memory.SharedMemory(create=True, size=max(probs.nbytes, 1))
+        np.ndarray(probs.shape, dtype=probs.dtype, buffer=shm.buf)[:] = probs
+        # the utterances are split into contiguous chunks, one for each worker
+        chunk_size = math.ceil(batch_size / self.num_workers)
+        async_results = [
+            self._pool.apply_async(
+                _decode_shared_rows,
+                (shm.name, probs.shape, range(start, min(start + chunk_size, batch_size)),
+                 lengths, *decode_args)
+            )
+            for start in range(0, batch_size, chunk_size)
+        ]
+        return DecodeJob(async_results=async_results, shm=shm)
+
+    def decode(self, probs, lengths=None)->List[List[Tuple[Tuple[int, ...], float]]]:
+        """Decodes the batch and waits for the n-best lists"""
+        return self.submit(probs, lengths).get()
+
+    def close(self)->None:
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def _decode_rows(probs:np.ndarray, rows:range, lengths:List[int], beam_size:int, blank:int,
+                 n_top_beams:int, pruning:dict, log_input:bool
+                 )->List[List[Tuple[Tuple[int, ...], float]]]:
+    return [decode(probs[row, :lengths[row]], beam_size, blank, n_top_beams, log_input=log_input,
+                   **pruning) 
+            for row in rows]
+
+
+def _decode_shared_rows(shm_name:str, shape:tuple, rows:range, lengths:List[int], beam_size:int,
+                        blank:int, n_top_beams:int, pruning:dict, log_input:bool
+                        )->List[List[Tuple[Tuple[int, ...], float]]]:
+    # the block is owned and unlinked by the submitting process, whose resource tracker is
+    # shared by the spawned workers
+    shm = shared_memory.SharedMemory(name=shm_name)
+    probs = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+    try:
+        return _decode_rows(probs, rows, lengths, beam_size, blank, n_top_beams, pruning, log_input)
+    finally:
+        # the array is released before the block is closed
+        del probs
+        shm.close()
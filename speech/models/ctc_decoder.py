@@ -35,7 +35,7 @@ def logsumexp(*args):
                       for a in args))
   return a_max + lsp
 
-def decode(probs, beam_size=10, blank=0, n_top_beams=1):
+def decode(probs, beam_size=10, blank=0, n_top_beams=1, log_input=False):
   """
   Performs inference for the given output probabilities.
 
@@ -45,6 +45,7 @@ def decode(probs, beam_size=10, blank=0, n_top_beams=1):
     beam_size (int): Size of the beam to use during inference.
     blank (int): Index of the CTC blank label.
     n_top_beams (int): number of top beams to output
+    log_input (bool): if true, `probs` are log-probabilities (e.g. post-log-softmax)
 
   Returns the output label sequence and the corresponding negative
   log-likelihood estimated by the decoder.
@@ -53,7 +54,8 @@ def decode(probs, beam_size=10, blank=0, n_top_beams=1):
     f"beam_size {beam_size} is less than number of top beams {n_top_beams}"
   
   T, S = probs.shape
-  probs = np.log(probs)
+  if not log_input:
+    probs = np.log(probs)
 
   # Elements in the beam are (prefix, (p_blank, p_no_blank))
   # Initialize the beam with the empty sequence, a probability of
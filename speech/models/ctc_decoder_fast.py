@@ -0,0 +1,245 @@
+"""
+Array-backed CTC prefix beam search with the same interface and output as the reference
+decoder in `speech.models.ctc_decoder`.
+
+The beams are kept in NumPy arrays of the probabilities of ending in blank and non-blank, and
+each prefix is identified by an integer id in a prefix trie instead of a tuple of labels. At
+every frame, the extensions of all the beams by all the labels are scored together as a
+(beam x vocab) array. An extension can only be merged with a prefix that is already in the beam,
+which is found by comparing the parent ids of the beams with the beam ids. Only the extensions
+that survive the pruning are added to the trie.
+"""
+# standard libraries
+from typing import List, Tuple
+# third-party libraries
+import numpy as np
+
+NEG_INF = -float("inf")
+
+
+class PrefixTrie():
+    """
+    Assigns an integer id to each label sequence. The root, id 0, is the empty sequence.
+    """
+
+    def __init__(self):
+        self.parents = [-1]
+        self.labels = [-1]
+        self._children = dict()
+
+    def child(self, parent:int, label:int)->int:
+        """Returns the id of the sequence `parent` extended by `label`, adding it if it's new"""
+        key = (parent, label)
+        child = self._children.get(key)
+        if child is None:
+            child = len(self.parents)
+            self._children[key] = child
+            self.parents.append(parent)
+            self.labels.append(label)
+        return child
+
+    def sequence(self, prefix_id:int)->Tuple[int, ...]:
+        labels = list()
+        while prefix_id > 0:
+            labels.append(self.labels[prefix_id])
+            prefix_id = self.parents[prefix_id]
+        return tuple(reversed(labels))
+
+
+def decode(probs, beam_size=10, blank=0, n_top_beams=1, blank_threshold:float=None, 
+           top_k:int=None, cum_prob:float=None, stats:dict=None, 
+           log_input:bool=False)->List[Tuple[Tuple[int, ...], float]]:
+    """
+    Performs inference for the given output probabilities. Without the pruning arguments, the
+    output is the same as the reference decoder.
+
+    Arguments:
+        probs: The output probabilities (e.g. post-softmax) for each
+            time step. Should be an array of shape (time x output dim).
+        beam_size (int): Size of the beam to use during inference.
+        blank (int): Index of the CTC blank label.
+        n_top_beams (int): number of top beams to output
+        blank_threshold (float): if not None, the prefixes aren't extended in the frames where
+            the blank probability is at least this value
+        top_k (int): if not None, the prefixes are only extended by the labels with the `top_k`
+            highest probabilities in each frame
+        cum_prob (float): if not None, the prefixes are only extended by the most probable labels
+            whose cumulative probability in each frame first reaches this value
+        stats (dict): if not None, the counts of `frames`, `pruned_frames`, `expansions`, and
+            `full_expansions`, the expansions without pruning, are added to this dict
+        log_input (bool): if true, `probs` are log-probabilities (e.g. post-log-softmax), which
+            skips the log of every output and keeps the precision of tiny probabilities
+
+    Returns a list of the `n_top_beams` tuples of the output label sequence and the
+    corresponding negative log-likelihood estimated by the decoder.
+    """
+    assert beam_size >= n_top_beams, \
+        f"beam_size {beam_size} is less than number of top beams {n_top_beams}"
+
+    T, S = probs.shape
+    if log_input:
+        log_probs = np.asarray(probs, dtype=np.float64)
+        # the labels are ranked the same by their log-probabilities, so the probabilities are
+        # only needed for the cumulative pruning
+        probs = np.exp(log_probs) if cum_prob is not None else log_probs
+    else:
+        probs = np.asarray(probs, dtype=np.float64)
+        with np.errstate(divide='ignore'):
+            log_probs = np.log(probs)
+    # the blank is never an extension
+    label_masks = prune_labels(probs, top_k, cum_prob)
+    label_masks[:, blank] = False
+    frame_labels = [np.flatnonzero(label_mask) for label_mask in label_masks]
+    if blank_threshold is None:
+        pruned_frames = np.zeros(T, dtype=bool)
+    else:
+        with np.errstate(divide='ignore'):
+            pruned_frames = log_probs[:, blank] >= np.log(blank_threshold)
+    n_pruned_frames, n_expansions, n_full_expansions = 0, 0, 0
+
+    trie = PrefixTrie()
+    # the beam starts with the empty sequence, which has a probability of 1 of ending in blank
+    beam_ids = np.zeros(1, dtype=np.int64)
+    beam_parents = np.full(1, -1, dtype=np.int64)
+    beam_last = np.full(1, -1, dtype=np.int64)
+    p_b = np.zeros(1)
+    p_nb = np.full(1, NEG_INF)
+
+    with np.errstate(invalid='ignore'):
+        for t in range(T):
+            lp = log_probs[t]
+            num_beams = beam_ids.size
+            has_last = beam_last >= 0
+            last_lp = np.where(has_last, lp[beam_last], NEG_INF)
+
+            # the unchanged prefixes end in blank by proposing a blank and end in non-blank
+            # by repeating their last label, which is merged by CTC
+            stay_b = np.logaddexp(p_b, p_nb) + lp[blank]
+            stay_nb = p_nb + last_lp
+            n_full_expansions += num_beams * (S - 1)
+
+            # the labels that can extend the prefixes in this frame
+            labels = frame_labels[t]
+            num_labels = labels.size
+            if pruned_frames[t] or num_labels == 0:
+                # a frame dominated by blank only updates and re-orders the current prefixes
+                n_pruned_frames += 1
+                order = np.argsort(-np.logaddexp(stay_b, stay_nb), kind='stable')
+                beam_ids, beam_parents, beam_last = beam_ids[order], beam_parents[order], beam_last[order]
+                p_b, p_nb = stay_b[order], stay_nb[order]
+                continue
+            # maps a label to its column in the extensions or -1 if it is pruned
+            label_cols = np.full(S, -1)
+            label_cols[labels] = np.arange(num_labels)
+
+            # the extensions by a different label continue from both the blank and non-blank
+            # probabilities and the extensions by the last label only from the blank probability
+            ext_nb = np.logaddexp(p_b, p_nb)[:, None] + lp[labels][None, :]
+            repeat_rows = np.flatnonzero(has_last)
+            repeat_cols = label_cols[beam_last[repeat_rows]]
+            repeat_rows, repeat_cols = repeat_rows[repeat_cols >= 0], repeat_cols[repeat_cols >= 0]
+            ext_nb[repeat_rows, repeat_cols] = p_b[repeat_rows] + last_lp[repeat_rows]
+            valid = np.ones((num_beams, num_labels), dtype=bool)
+
+            # an extension that is already a prefix in the beam is merged into that prefix
+            merge_beam, merge_src = np.nonzero(beam_parents[:, None] == beam_ids[None, :])
+            if merge_beam.size:
+                merge_cols = label_cols[beam_last[merge_beam]]
+                is_kept = merge_cols >= 0
+                merge_beam, merge_src, merge_cols = merge_beam[is_kept], merge_src[is_kept], merge_cols[is_kept]
+                stay_nb[merge_beam] = np.logaddexp(stay_nb[merge_beam], ext_nb[merge_src, merge_cols])
+                valid[merge_src, merge_cols] = False
+
+            # the candidates are ordered as the unchanged prefixes then the extensions
+            scores = np.concatenate([np.logaddexp(stay_b, stay_nb), np.where(valid, ext_nb, NEG_INF).ravel()])
+            is_candidate = np.concatenate([np.ones(num_beams, dtype=bool), valid.ravel()])
+            n_expansions += num_beams * num_labels
+            k = min(beam_size, int(np.count_nonzero(is_candidate)))
+            top = _top_k(scores, k)
+            if not is_candidate[top].all():
+                # an invalid extension tied with a -inf candidate, so only the candidates are ranked
+                candidates = np.flatnonzero(is_candidate)
+                top = candidates[_top_k(scores[candidates], k)]
+
+            is_stay = top < num_beams
+            stay_idx = top[is_stay]
+            src, col = np.divmod(top[~is_stay] - num_beams, num_labels)
+            label = labels[col]
+
+            new_ids = np.empty(top.size, dtype=np.int64)
+            new_parents = np.empty(top.size, dtype=np.int64)
+            new_last = np.empty(top.size, dtype=np.int64)
+            new_p_b = np.empty(top.size)
+            new_p_nb = np.empty(top.size)
+
+            new_ids[is_stay] = beam_ids[stay_idx]
+            new_parents[is_stay] = beam_parents[stay_idx]
+            new_last[is_stay] = beam_last[stay_idx]
+            new_p_b[is_stay] = stay_b[stay_idx]
+            new_p_nb[is_stay] = stay_nb[stay_idx]
+
+            src_ids = beam_ids[src]
+            new_ids[~is_stay] = [trie.child(parent, lbl) for parent, lbl in zip(src_ids.tolist(), label.tolist())]
+            new_parents[~is_stay] = src_ids
+            new_last[~is_stay] = label
+            new_p_b[~is_stay] = NEG_INF
+            new_p_nb[~is_stay] = ext_nb[src, col]
+
+            beam_ids, beam_parents, beam_last, p_b, p_nb = new_ids, new_parents, new_last, new_p_b, new_p_nb
+
+    if stats is not None:
+        for key, count in [("frames", T), ("pruned_frames", n_pruned_frames), 
+                           ("expansions", n_expansions), ("full_expansions", n_full_expansions)]:
+            stats[key] = stats.get(key, 0) + count
+
+    # each beam is Tuple[preds, probs] with the negative log-likelihood of the prefix
+    best_beams = list()
+    for i in range(min(n_top_beams, beam_ids.size)):
+        best_beams.append((trie.sequence(int(beam_ids[i])), -float(np.logaddexp(p_b[i], p_nb[i]))))
+    return best_beams
+
+
+def prune_labels(probs:np.ndarray, top_k:int=None, cum_prob:float=None)->np.ndarray:
+    """
+    Returns a (time x output dim) boolean mask of the labels in each frame that are within the
+    `top_k` highest probabilities and the smallest set of labels whose cumulative probability
+    reaches `cum_prob`. If both are None, every label is kept.
+    """
+    T, S = probs.shape
+    mask = np.ones((T, S), dtype=bool)
+    if top_k is None and cum_prob is None:
+        return mask
+    # the labels sorted from the highest to lowest probability in each frame
+    order = np.argsort(-probs, axis=1, kind='stable')
+    num_kept = np.full(T, S)
+    if top_k is not None:
+        num_kept = np.minimum(num_kept, top_k)
+    if cum_prob is not None:
+        cum_probs = np.cumsum(np.take_along_axis(probs, order, axis=1), axis=1)
+        num_kept = np.minimum(num_kept, (cum_probs < cum_prob).sum(axis=1) + 1)
+    np.put_along_axis(mask, order, np.arange(S)[None, :] < num_kept[:, None], axis=1)
+    return mask
+
+
+def _top_k(scores:np.ndarray, k:int)->np.ndarray:
+    """Returns the indices of the `k` highest scores from highest to lowest. Equal scores keep
+    their order, like the stable sort of the reference decoder.
+    """
+    if k < scores.size:
+        # the partition is only a pre-selection, the ties at the k-th score are kept
+        kth = np.partition(scores, scores.size - k)[scores.size - k]
+        candidates = np.flatnonzero(scores >= kth)
+    else:
+        candidates = np.arange(scores.size)
+    order = np.argsort(-scores[candidates], kind='stable')
+    return candidates[order[:k]]
+
+
+def decode_batch(probs_list, blank=0, beam_size=3, log_input=False)->List[Tuple[int, ...]]:
+    """
+    Returns the top beam of each output probability array in `probs_list`, which are 
+    log-probabilities if `log_input` is true.
+    This is a module-level function so it can run in a worker pool.
+    """
+    return [decode(probs, beam_size=beam_size, blank=blank, log_input=log_input)[0][0] 
+            for probs in probs_list]
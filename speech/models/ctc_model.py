@@ -8,6 +8,7 @@ import torch.autograd as autograd
 
 from . import model
 from .ctc_decoder import decode
+from .greedy_decoder import collapse_repeats, greedy_decode
 
 
 class CTC(model.Model):
@@ -30,15 +31,17 @@ class CTC(model.Model):
         
         self.fc = model.LinearND(self.encoder_dim, output_dim + 1)
 
-    def forward(self, x, rnn_args=None, softmax=False):
+    def forward(self, x, rnn_args=None, softmax=False, log_softmax=False):
        # x, y, x_lens, y_lens = self.collate(*batch)
-        return self.forward_impl(x, rnn_args,  softmax=softmax)
+        return self.forward_impl(x, rnn_args,  softmax=softmax, log_softmax=log_softmax)
 
-    def forward_impl(self, x, rnn_args=None, softmax=False):
+    def forward_impl(self, x, rnn_args=None, softmax=False, log_softmax=False):
         if self.is_cuda:
             x = x.cuda()
         x, rnn_args = self.encode(x, rnn_args)    
         x = self.fc(x)          
+        if log_softmax:
+            return torch.nn.functional.log_softmax(x, dim=2), rnn_args
         if softmax:
             return torch.nn.functional.softmax(x, dim=2), rnn_args
         return x, rnn_args
@@ -60,25 +63,40 @@ class CTC(model.Model):
                 v.volatile = True
         return batch
     
-    def infer(self, batch):
+    def infer(self, batch, decoder=None):
+        """Returns the top prediction and its score for each example. If `decoder`, a
+        `BatchDecoder`, is not None, the examples are decoded in parallel by its worker pool.
+        """
         x, y, x_lens, y_lens = self.collate(*batch)
-        probs, rnn_args = self.forward_impl(x, softmax=True)
+        if decoder is not None:
+            probs, rnn_args = self.forward_impl(
+                x, softmax=not decoder.log_input, log_softmax=decoder.log_input
+            )
+            return [nbest[0] for nbest in decoder.decode(probs)]
+        log_probs, rnn_args = self.forward_impl(x, log_softmax=True)
         # convert the torch tensor into a numpy array
-        probs = probs.data.cpu().numpy()
-        return [decode(p, beam_size=3, blank=self.blank)[0]
-                    for p in probs]
+        log_probs = log_probs.data.cpu().numpy()
+        return [decode(p, beam_size=3, blank=self.blank, log_input=True)[0]
+                    for p in log_probs]
     
+    def infer_maxdecode(self, batch):
+        """Returns the greedy prediction of each example"""
+        x, y, x_lens, y_lens = self.collate(*batch)
+        log_probs, rnn_args = self.forward_impl(x, log_softmax=True)
+        labels, _, _ = greedy_decode(log_probs, blank=self.blank)
+        return [tuple(label.tolist()) for label in labels]
+
     def infer_confidence(self, batch):
         """
         returns the confidence value was well as the prediction
         as a tuple
         """
         x, y, x_lens, y_lens = self.collate(*batch)
-        probs, rnn_args = self.forward_impl(x, softmax=True)
+        log_probs, rnn_args = self.forward_impl(x, log_softmax=True)
         # convert the torch tensor into a numpy array
-        probs = probs.data.cpu().numpy()
-        preds_confidence = [decode(p, beam_size=3, blank=self.blank)
-                    for p in probs]
+        log_probs = log_probs.data.cpu().numpy()
+        preds_confidence = [decode(p, beam_size=3, blank=self.blank, log_input=True)
+                    for p in log_probs]
         preds = [x[0] for x in preds_confidence]
         confidence = [x[1] for x in preds_confidence]
         return preds, confidence    
@@ -86,10 +104,4 @@ class CTC(model.Model):
 
     @staticmethod
     def max_decode(pred, blank):
-        prev = pred[0]
-        seq = [prev] if prev != blank else []
-        for p in pred[1:]:
-            if p != blank and p != prev:
-                seq.append(p)
-            prev = p
-        return seq
+        return collapse_repeats(pred, blank)
@@ -10,7 +10,8 @@ import torch.nn as nn
 
 from speech.models import ctc_model
 from speech.models import model
-from .ctc_decoder import decode
+from .ctc_decoder_fast import decode
+from .greedy_decoder import collapse_repeats, greedy_decode
 
 
 
@@ -29,27 +30,29 @@ class CTC_train(ctc_model.CTC):
 
         self.fc = model.LinearND(self.encoder_dim, output_dim + 1)
 
-    def forward(self, x, rnn_args=None, softmax=False):
-        # softmax should be true for inference, false for loss calculation
+    def forward(self, x, rnn_args=None, softmax=False, lengths=None, log_softmax=False):
+        # softmax or log_softmax should be true for inference, false for loss calculation
         #x, y, x_lens, y_lens = self.collate(*batch)
-        return self.forward_impl(x, rnn_args,  softmax=softmax)
-
-    def forward_impl(self, x, rnn_args=None, softmax=False):
+        return self.forward_impl(x, rnn_args,  softmax=softmax, lengths=lengths, 
+                                 log_softmax=log_softmax)
+
+    def forward_impl(self, x, rnn_args=None, softmax=False, lengths=None, log_softmax=False):
+        """
+        Args:
+            lengths (torch.Tensor): if not None, the output lengths from `collate` that the 
+                rnn uses to skip the padding frames of each example
+            log_softmax (bool): if true, the log-probabilities are returned, which the decoders
+                take directly with `log_input=True`
+        """
         #if self.is_cuda:
         #    x = x.cuda()
 
-        # padding is half the filters of the 3 conv layers. 
-        # conv.children are: [Conv2d, BatchNorm2d, ReLU, Dropout, Conv2d, 
-        # BatchNorm2d, ReLU, Dropout, Conv2d, BatchNorm2d, ReLU, Dropout]
-        # conv indicies with batch norm: 0, 4, 8
-        # conv layer indicies without batch norm: 0, 3, 6
-        pad = list(self.conv.children())[0].kernel_size[0]//2 + \
-            list(self.conv.children())[4].kernel_size[0]//2 + \
-            list(self.conv.children())[8].kernel_size[0]//2
-        x = nn.functional.pad(x, (0,0,pad,pad))
-
-        x, rnn_args = self.encode(x, rnn_args)    
+        x = nn.functional.pad(x, (0,0,self.time_pad,self.time_pad))
+
+        x, rnn_args = self.encode(x, rnn_args, lengths)    
         x = self.fc(x)          
+        if log_softmax:
+            return torch.nn.functional.log_softmax(x, dim=2), rnn_args
         if softmax:
             return torch.nn.functional.softmax(x, dim=2), rnn_args
         return x, rnn_args
@@ -61,10 +64,26 @@ class CTC_train(ctc_model.CTC):
     #    loss = loss_fn(out, y, x_lens, y_lens)
     #    return loss
 
+    @property
+    def time_pad(self)->int:
+        # the time dimension is padded by half the filter height of each conv layer
+        return sum(c.kernel_size[0]//2 for c in self.conv.children() if type(c) == nn.Conv2d)
+
+    def output_lens(self, input_lens:torch.Tensor)->torch.IntTensor:
+        """Number of output time steps of each example from the number of input frames"""
+        return self.conv_out_lens(input_lens + 2 * self.time_pad, 0).clamp(min=1).int()
+
+    def collate_tensors(self, batch):
+        """
+        Returns the same [x, y, x_lens, y_lens] as `collate` from a `TensorBatch` that was 
+        already padded in the loader workers.
+        """
+        x_lens = self.output_lens(batch.input_lens)
+        return [batch.inputs, batch.labels, x_lens, batch.label_lens]
+
     def collate(self, inputs, labels):
-        max_t = max(i.shape[0] for i in inputs)
-        max_t = self.conv_out_size(max_t, 0)
-        x_lens = torch.IntTensor([max_t] * len(inputs))
+        # the output length of each example, so the rnn and loss skip the padding frames
+        x_lens = self.output_lens(torch.IntTensor([i.shape[0] for i in inputs]))
         x = torch.FloatTensor(model.zero_pad_concat(inputs))
         y_lens = torch.IntTensor([len(l) for l in labels])
         y = torch.IntTensor([l for label in labels for l in label])
@@ -72,30 +91,32 @@ class CTC_train(ctc_model.CTC):
 
         return batch
     
-    def infer(self, batch):
+    def infer(self, batch, decoder=None):
+        """Returns the top prediction of each example. If `decoder`, a `BatchDecoder`, is not
+        None, the examples are decoded in parallel by its worker pool.
+        """
         x, y, x_lens, y_lens = self.collate(*batch)
         x = x.cuda()
-        probs, rnn_args = self.forward_impl(x, softmax=True)
+        if decoder is not None:
+            probs, rnn_args = self.forward_impl(
+                x, softmax=not decoder.log_input, lengths=x_lens, log_softmax=decoder.log_input
+            )
+            return [nbest[0][0] for nbest in decoder.decode(probs, x_lens)]
+        log_probs, rnn_args = self.forward_impl(x, lengths=x_lens, log_softmax=True)
         # convert the torch tensor into a numpy array
-        probs = probs.data.cpu().numpy()
+        log_probs = log_probs.data.cpu().numpy()
         # decode returns a list of tuples. `[0][0]` grabs the sequence in the first tuple of the list
-        return [decode(p, beam_size=3, blank=self.blank)[0][0]
-                    for p in probs]
+        return [decode(p[:length], beam_size=3, blank=self.blank, log_input=True)[0][0]
+                    for p, length in zip(log_probs, x_lens.tolist())]
         
     def infer_maxdecode(self, batch):
+        """Returns the greedy prediction of each example"""
         x, y, x_lens, y_lens = self.collate(*batch)
-        probs, rnn_args = self.forward_impl(x, softmax=True)
-        # convert the torch tensor into a numpy array
-        probs = probs.data.cpu().numpy()
-        return [max_decode(p, blank=self.blank) for p in probs]
+        x = x.to(next(self.parameters()).device)
+        log_probs, rnn_args = self.forward_impl(x, lengths=x_lens, log_softmax=True)
+        labels, _, _ = greedy_decode(log_probs, x_lens, self.blank)
+        return [tuple(label.tolist()) for label in labels]
 
     @staticmethod
     def max_decode(pred, blank):
-        prev = pred[0]
-        seq = [prev] if prev != blank else []
-        for p in pred[1:]:
-            if p != blank and p != prev:
-                seq.append(p)
-            prev = p
-        return seq
-
+        return collapse_repeats(pred, blank)
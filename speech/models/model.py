@@ -84,16 +84,41 @@ class Model(nn.Module):
                 n = int(math.ceil(n))
         return n
 
+    def conv_out_lens(self, lens:torch.Tensor, dim:int)->torch.Tensor:
+        """Same as `conv_out_size` for a tensor of lengths"""
+        lens = lens.long()
+        for c in self.conv.children():
+            if type(c) == nn.Conv2d:
+                k = c.kernel_size[dim]
+                s = c.stride[dim]
+                p = c.padding[dim]
+                # integer ceiling of (n - k + 1 + 2*p) / s
+                lens = (lens - k + 2*p + s) // s
+        return lens
+
+    def collate_tensors(self, batch):
+        """
+        Returns the same [x, y, x_lens, y_lens] as `collate` from a `TensorBatch` that was 
+        already padded in the loader workers.
+        """
+        max_t = self.conv_out_size(batch.inputs.shape[1], 0)
+        x_lens = torch.full_like(batch.input_lens, max_t)
+        return [batch.inputs, batch.labels, x_lens, batch.label_lens]
+
     def forward(self, batch):
         """
         Must be overridden by subclasses.
         """
         raise NotImplementedError
 
-    def encode(self, x, rnn_args=None):
+    def encode(self, x, rnn_args=None, lengths=None):
         """this function processes the input data x through the CNN and RNN layers specified
             in the model encoder config.
 
+        Args:
+            lengths (torch.Tensor): if not None, the number of valid output time steps of each
+                example. The rnn skips the padding after each example with a packed sequence
+                and the padded outputs are zero.
         """
         if self.use_conv:
             x = x.unsqueeze(1) 
@@ -111,7 +136,15 @@ class Model(nn.Module):
             x = x.view((x.data.size()[0], x.data.size()[1], -1)) 
 
         if self.use_rnn:
-            x, rnn_args = self.rnn(x, rnn_args)
+            if lengths is not None:
+                total_length = x.size(1)
+                x = nn.utils.rnn.pack_padded_sequence(
+                    x, lengths.cpu().long(), batch_first=True, enforce_sorted=False
+                )
+                x, rnn_args = self.rnn(x, rnn_args)
+                x, _ = nn.utils.rnn.pad_packed_sequence(x, batch_first=True, total_length=total_length)
+            else:
+                x, rnn_args = self.rnn(x, rnn_args)
         
             # if self.rnn.bidirectional:
             #     half = x.size()[-1] // 2
@@ -184,3 +217,13 @@ def zero_pad_concat(inputs):
         input_mat[e, :inp.shape[0], :] = inp
     return input_mat
 
+
+def pad_flat_labels(labels, label_lens, fill_value):
+    """Pads the concatenated labels of a `TensorBatch` into a LongTensor of shape 
+    (batch, max_label_len) filled with `fill_value` after the end of each label sequence.
+    """
+    max_len = int(label_lens.max())
+    mask = torch.arange(max_len)[None, :] < label_lens[:, None].long()
+    padded = torch.full((label_lens.shape[0], max_len), fill_value, dtype=torch.long)
+    padded[mask] = labels.long()
+    return padded
@@ -10,6 +10,7 @@ import torch.nn as nn
 import torch.autograd as autograd
 
 from . import model
+from speech.utils.data_structs import TensorBatch
 
 class Seq2Seq(model.Model):
 
@@ -50,7 +51,7 @@ class Seq2Seq(model.Model):
         self.scheduled_sampling = (self.sample_prob != 0)
 
     def loss(self, batch):
-        x, y = self.collate(*batch)
+        x, y = self.collate_batch(batch)
         if self.is_cuda:
             x = x.cuda()
             y = y.cuda()
@@ -69,7 +70,7 @@ class Seq2Seq(model.Model):
         return out, alis
 
     def forward(self, batch):
-        x, y = self.collate(*batch)
+        x, y = self.collate_batch(batch)
         if self.is_cuda:
             x = x.cuda()
             y = y.cuda()
@@ -236,6 +237,17 @@ class Seq2Seq(model.Model):
             labels.volatile = True
         return inputs, labels
 
+    def collate_tensors(self, batch):
+        # Assumes last item in each example is the end token.
+        end_tok = int(batch.labels[batch.label_lens[0] - 1])
+        labels = model.pad_flat_labels(batch.labels, batch.label_lens, end_tok)
+        return batch.inputs, labels
+
+    def collate_batch(self, batch):
+        if isinstance(batch, TensorBatch):
+            return self.collate_tensors(batch)
+        return self.collate(*batch)
+
 def end_pad_concat(labels):
     # Assumes last item in each example is the end token.
     batch_size = len(labels)
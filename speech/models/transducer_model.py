@@ -10,6 +10,7 @@ import torch.autograd as autograd
 import transducer.decoders as td
 import transducer.transducer as transducer
 from . import model
+from speech.utils.data_structs import TensorBatch
 
 class Transducer(model.Model):
     def __init__(self, freq_dim, vocab_size, config):
@@ -31,8 +32,7 @@ class Transducer(model.Model):
         self.fc2 = model.LinearND(rnn_dim, vocab_size + 1)
 
     def forward(self, batch):
-        x, y, x_lens, y_lens = self.collate(*batch)
-        y_mat = self.label_collate(batch[1])
+        x, y, x_lens, y_lens, y_mat = self.collate_batch(batch)
         return self.forward_impl(x, y_mat)
 
     def forward_impl(self, x, y):
@@ -44,8 +44,7 @@ class Transducer(model.Model):
         return out
 
     def loss(self, batch):
-        x, y, x_lens, y_lens = self.collate(*batch)
-        y_mat = self.label_collate(batch[1])
+        x, y, x_lens, y_lens, y_mat = self.collate_batch(batch)
         out = self.forward_impl(x, y_mat)
         loss_fn = transducer.Transducer().apply
         loss = loss_fn(out, y, x_lens, y_lens)
@@ -89,6 +88,21 @@ class Transducer(model.Model):
                 v.volatile = True
         return batch
 
+    def collate_batch(self, batch):
+        """
+        Returns the collated batch and the padded label matrix from either a `TensorBatch` 
+        or a batch of (inputs, labels)
+        """
+        if isinstance(batch, TensorBatch):
+            x, y, x_lens, y_lens = self.collate_tensors(batch)
+            # Doesn't matter what we pad the end with since it will be ignored.
+            end_tok = int(batch.labels[batch.label_lens[0] - 1])
+            y_mat = model.pad_flat_labels(batch.labels, batch.label_lens, end_tok)
+        else:
+            x, y, x_lens, y_lens = self.collate(*batch)
+            y_mat = self.label_collate(batch[1])
+        return x, y, x_lens, y_lens, y_mat
+
     def infer(self, batch, beam_size=4):
         out = self(batch)
         out = out.cpu().data.numpy()
@@ -0,0 +1,201 @@
+# This module evaluates the dev sets in a separate process so the training processes don't
+# wait for the evaluation at the end of each epoch. The process holds a cpu copy of the model
+# and each evaluation job sends a frozen cpu snapshot of the weights with the job's epoch.
+
+# standard libraries
+import copy
+import queue
+import traceback
+from typing import Callable, Dict, List, Tuple
+# third-party libraries
+import torch
+import torch.multiprocessing as mp
+# project libraries
+import speech.loader as loader
+from speech.models.batch_decoder import BatchDecoder
+from speech.utils.checkpoint import snapshot_to_cpu
+from speech.utils.feature_cache import FeatureCache
+
+
+class AsyncEvaluator():
+    """
+    Evaluates the dev sets on the cpu in a background process. The jobs are evaluated in the
+    order they are submitted and their results are returned by `poll` with the epoch and the
+    weights they belong to.
+
+    Args:
+        eval_fn (callable): module-level function with the signature of `train.eval_dev` that
+            returns the loss and error rate of a model on a loader
+        model (torch.nn.Module): model whose copy is evaluated, without the ddp wrapper
+        preproc (Preprocessor): preprocessor of the dev sets
+        dev_sets (dict): mapping from dev-set name to the dataset json path
+        loss_name (str): name of the loss function passed to `eval_fn`
+        feature_caches (dict): optional mapping from dev-set name to a feature-cache path
+        batch_size (int): batch size of the dev loaders
+        num_workers (int): number of loader workers in the evaluation process
+        decode_workers (int): number of processes of the beam-search decoding pool, which is
+            kept across the jobs
+        dev_decoder (str): decoder of the predictions passed to `eval_fn`, "greedy" or "beam"
+        num_threads (int): if not None, number of torch threads in the evaluation process
+        max_pending (int): maximum number of submitted jobs that haven't started
+        poll_secs (float): interval at which the blocking calls check that the evaluation 
+            process is alive
+    """
+
+    def __init__(self, eval_fn:Callable, model, preproc, dev_sets:Dict[str, str], loss_name:str,
+                 feature_caches:Dict[str, str]=None, batch_size:int=8, num_workers:int=0,
+                 decode_workers:int=0, dev_decoder:str="greedy", num_threads:int=None, 
+                 max_pending:int=1, poll_secs:float=1.0):
+        # spawn doesn't copy the cuda state of the training process into the child
+        ctx = mp.get_context("spawn")
+        self._jobs = ctx.Queue(maxsize=max_pending)
+        self._results = ctx.Queue()
+        self._snapshots = dict()
+        self._finished = list()
+        self._error = None
+        self.poll_secs = poll_secs
+        model = copy.deepcopy(model).cpu()
+        # the logger can't be pickled into the evaluation process
+        preproc = copy.copy(preproc)
+        preproc.logger = None
+        worker_args = (
+            eval_fn, model, preproc, dev_sets, loss_name, feature_caches or dict(), batch_size,
+            num_workers, decode_workers, dev_decoder, num_threads, self._jobs, self._results
+        )
+        # the process isn't a daemon so it can start the loader and decoding workers
+        self._process = ctx.Process(target=_eval_worker, args=worker_args, name="async-eval")
+        self._process.start()
+
+    def submit(self, epoch:int, model)->None:
+        """Evaluates a frozen cpu copy of the current weights of `model` for `epoch`. Blocks if
+        `max_pending` jobs are waiting to start. Raises a RuntimeError if the evaluation process
+        has exited.
+        """
+        state_dict = snapshot_to_cpu(model.state_dict())
+        # the queue is full until the process takes a job, which a dead process never does
+        while True:
+            self._check_alive()
+            try:
+                self._jobs.put((epoch, state_dict), timeout=self.poll_secs)
+                break
+            except queue.Full:
+                continue
+        self._snapshots[epoch] = state_dict
+
+    def poll(self, block:bool=False)->List[Tuple[int, dict, dict]]:
+        """Returns the finished jobs as a list of tuples of the epoch, the weights that were
+        evaluated, and a dict of the dev results that maps the dev-set name to a (loss, error
+        rate) tuple or None if the job failed. If `block` is True, waits for the pending jobs.
+        Raises a RuntimeError if the evaluation process has exited with pending jobs, whose
+        finished results are then returned by `close`.
+        """
+        while self._receive():
+            pass
+        while block and self._snapshots:
+            if not self._receive(timeout=self.poll_secs):
+                self._check_alive()
+        if self._snapshots:
+            self._check_alive()
+        finished, self._finished = self._finished, list()
+        return finished
+
+    def close(self)->List[Tuple[int, dict, dict]]:
+        """Waits for the pending jobs, stops the evaluation process, and returns the results
+        that weren't polled
+        """
+        try:
+            while self._snapshots:
+                if not self._receive(timeout=self.poll_secs):
+                    self._check_alive()
+        except RuntimeError as error:
+            print(error)
+        while self._receive():
+            pass
+        if self._process.is_alive():
+            # the job queue is empty as the pending jobs have finished
+            self._jobs.put(None)
+        self._process.join()
+        if self._snapshots:
+            print(f"async evaluation of epochs {sorted(self._snapshots)} was lost")
+            self._snapshots.clear()
+        finished, self._finished = self._finished, list()
+        return finished
+
+    def _receive(self, timeout:float=None)->bool:
+        """Moves a result from the results queue to the finished jobs. If `timeout` is None,
+        doesn't wait. Returns False if there was no result.
+        """
+        try:
+            if timeout is None:
+                epoch, results = self._results.get_nowait()
+            else:
+                epoch, results = self._results.get(timeout=timeout)
+        except queue.Empty:
+            return False
+        if epoch is None:
+            # the process couldn't create the dev loaders and exited
+            self._error = results
+        else:
+            if isinstance(results, str):
+                print(f"async evaluation of epoch {epoch} failed with:\n{results}")
+                results = None
+            self._finished.append((epoch, self._snapshots.pop(epoch), results))
+        return True
+
+    def _check_alive(self)->None:
+        """Raises a RuntimeError if the evaluation process has exited"""
+        if not self._process.is_alive():
+            # the results sent before the process exited are kept for `close`
+            while self._receive():
+                pass
+            msg = f"the async evaluation process exited with code {self._process.exitcode}"
+            if self._error is not None:
+                msg += f":\n{self._error}"
+            raise RuntimeError(msg)
+
+
+def _eval_worker(eval_fn:Callable, model, preproc, dev_sets:Dict[str, str], loss_name:str,
+                 feature_caches:Dict[str, str], batch_size:int, num_workers:int,
+                 decode_workers:int, dev_decoder:str, num_threads:int, jobs:mp.Queue, 
+                 results:mp.Queue)->None:
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    dev_ldr_dict = dict()
+    try:
+        for dev_name, dev_path in dev_sets.items():
+            feature_cache = None
+            if feature_caches.get(dev_name):
+                feature_cache = FeatureCache(feature_caches[dev_name], dev_path)
+            dev_ldr_dict[dev_name] = loader.make_loader(
+                dev_path, preproc, batch_size=batch_size, num_workers=num_workers,
+                feature_cache=feature_cache
+            )
+        # the beam-search decoding pool is kept across the jobs
+        decoder = None
+        if dev_decoder == "beam":
+            decoder = BatchDecoder(decode_workers, beam_size=3, blank=model.blank, log_input=True)
+    except Exception:
+        # a setup failure is sent without an epoch before the process exits
+        results.put((None, traceback.format_exc()))
+        return
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            if decoder is not None:
+                decoder.close()
+            return
+        epoch, state_dict = job
+        try:
+            model.load_state_dict(state_dict)
+            dev_results = {
+                dev_name: eval_fn(
+                    model, dev_ldr, preproc, None, loss_name, decode_workers, 
+                    dev_decoder=dev_decoder, decoder=decoder
+                )
+                for dev_name, dev_ldr in dev_ldr_dict.items()
+            }
+        except Exception:
+            # the traceback is sent as a string as the exception may not be picklable
+            dev_results = traceback.format_exc()
+        results.put((epoch, dev_results))
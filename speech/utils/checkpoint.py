@@ -1,19 +1,43 @@
 """
 """
 # standard libraries
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
 import os
 from pathlib import Path
+import queue
+import shutil
+import threading
+from typing import Any, Callable, Dict, List
 # third-party libs
-from google.cloud import storage
+import torch
+
 
 class GCSCheckpointHandler():
-    def __init__(self, cfg):
+    def __init__(self, cfg, storage_backend=None):
+        """
+        Args:
+            cfg (dict): checkpoint config
+            storage_backend: object with an `upload(local_path, remote_path)` method, the files are
+                uploaded to the gcs bucket if None
+        """
+        from google.cloud import storage
         self.client = storage.Client()
         self.local_save_dir = cfg['local_save_path']
         self.gcs_bucket = cfg['gcs_bucket']
         self.gcs_dir = cfg['gcs_dir']
         self.bucket = self.client.bucket(bucket_name=self.gcs_bucket)
         self.chkpt_per_epoch = cfg['checkpoints_per_epoch']
+        if storage_backend is None:
+            storage_backend = GCSStorage(self.bucket)
+        self.storage = storage_backend
+        # only the new or changed tensorboard files are uploaded at each checkpoint
+        self.tensorboard_sync = DirectorySync(
+            self.storage, 
+            os.path.join(self.local_save_dir, "tensorboard_sync.json"),
+            num_workers=cfg.get('sync_workers', 4)
+        )
 
     def download_from_gcs_bucket(self, filepath:str):
         """
@@ -27,7 +51,7 @@ class GCSCheckpointHandler():
             #paths.sort(key=lambda x: x.time_created)
             #latest_blob = paths[-1]
             local_path = os.path.join("/tmp/", filepath)
-            os.makedirs(local_path, exist_ok=True)
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
             paths[0].download_to_filename(local_path)
             return local_path
         else:
@@ -44,25 +68,241 @@ class GCSCheckpointHandler():
     def upload_to_gcs(self, filename:str):
         gcs_path = os.path.join(self.gcs_dir, filename)
         local_path = os.path.join(self.local_save_dir, filename)
-        blob = self.bucket.blob(gcs_path)
-        blob.upload_from_filename(local_path)
+        self.storage.upload(local_path, gcs_path)
 
     def upload_tensorboard_ckpt(self):
-        tb_train_dir = os.path.join(self.local_save_dir, "train")
-        tb_dev_dir = os.path.join(self.local_save_dir, "dev")
+        for tb_dir in ["train", "dev", "profile"]:
+            self.tensorboard_sync.sync(
+                os.path.join(self.local_save_dir, tb_dir), 
+                os.path.join(self.gcs_dir, tb_dir)
+            )
+
+
+class GCSStorage():
+    """Storage backend that uploads files to the gcs `bucket`"""
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def upload(self, local_path:str, remote_path:str)->None:
+        blob = self.bucket.blob(remote_path)
+        blob.upload_from_filename(local_path)
+
 
-        self._upload_dir_to_gcs(tb_train_dir, "train")
-        self._upload_dir_to_gcs(tb_dev_dir, "dev")
+class LocalStorage():
+    """Storage backend that copies files into `root_dir`. It stands in for gcs in tests and
+    can mirror checkpoints to a mounted disk.
+    """
 
-    def _upload_dir_to_gcs(self, dir_path:str, gcs_path_prefix:str):
-        """This function recursively uploads all of the contents of a directory
-        to the gcs bucket and directory
+    def __init__(self, root_dir:str):
+        self.root_dir = root_dir
+
+    def upload(self, local_path:str, remote_path:str)->None:
+        dest_path = os.path.join(self.root_dir, remote_path)
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        shutil.copyfile(local_path, dest_path + ".tmp")
+        os.replace(dest_path + ".tmp", dest_path)
+
+
+class DirectorySync():
+    """
+    Incrementally uploads the files of a directory tree to a storage backend. The size, 
+    modification time, and md5 hash of every uploaded file are recorded in a json manifest at
+    `manifest_path`, so a file is only uploaded if it is new or its contents changed. A file
+    whose size and modification time are unchanged isn't read. The files are uploaded 
+    concurrently by `num_workers` threads.
+
+    Args:
+        storage_backend: object with an `upload(local_path, remote_path)` method
+        manifest_path (str): path of the json manifest of the uploaded files
+        num_workers (int): number of concurrent uploads
+    """
+
+    def __init__(self, storage_backend, manifest_path:str, num_workers:int=4):
+        self.storage = storage_backend
+        self.manifest_path = manifest_path
+        self.num_workers = num_workers
+        self._lock = threading.Lock()
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as fid:
+                self.manifest = json.load(fid)
+        else:
+            self.manifest = dict()
+
+    def sync(self, local_dir:str, remote_dir:str)->List[str]:
+        """Uploads the new and changed files under `local_dir` to `remote_dir`. A failed 
+        upload is retried at the next sync and the first error is raised after the manifest 
+        of the successful uploads is saved.
+
+        Returns:
+            List[str]: the remote paths of the uploaded files
         """
-        dir_path = Path(dir_path)
-        for local_file in dir_path.glob('*'):
-            if local_file.is_dir():
-               self._upload_dir_to_gcs(str(local_file), os.path.join(gcs_path_prefix,  local_file.name))
-            elif local_file.is_file():
-               self.upload_to_gcs(os.path.join(gcs_path_prefix, local_file.name))
+        with self._lock:
+            to_upload = list()
+            for local_file in sorted(Path(local_dir).rglob('*')):
+                if not local_file.is_file():
+                    continue
+                remote_path = os.path.join(remote_dir, str(local_file.relative_to(local_dir)))
+                file_stat = local_file.stat()
+                record = self.manifest.get(remote_path)
+                if record is not None \
+                and (record['size'], record['mtime_ns']) == (file_stat.st_size, file_stat.st_mtime_ns):
+                    continue
+                new_record = {
+                    "size": file_stat.st_size,
+                    "mtime_ns": file_stat.st_mtime_ns,
+                    "md5": file_md5(str(local_file))
+                }
+                # a touched file with the same contents only needs its record updated
+                if record is not None and record['md5'] == new_record['md5']:
+                    self.manifest[remote_path] = new_record
+                    continue
+                to_upload.append((str(local_file), remote_path, new_record))
+
+            def upload(item):
+                local_path, remote_path, _ = item
+                self.storage.upload(local_path, remote_path)
+
+            errors = list()
+            uploaded = list()
+            with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+                futures = [(executor.submit(upload, item), item) for item in to_upload]
+                for future, (_, remote_path, new_record) in futures:
+                    err = future.exception()
+                    if err is not None:
+                        errors.append(err)
+                    else:
+                        self.manifest[remote_path] = new_record
+                        uploaded.append(remote_path)
+
+            self._write_manifest()
+            if errors:
+                raise errors[0]
+            return uploaded
+
+    def _write_manifest(self)->None:
+        with open(self.manifest_path + ".tmp", 'w') as fid:
+            json.dump(self.manifest, fid)
+        os.replace(self.manifest_path + ".tmp", self.manifest_path)
+
+
+def file_md5(file_path:str, chunk_size:int=2**20)->str:
+    hasher = hashlib.md5()
+    with open(file_path, 'rb') as fid:
+        for chunk in iter(lambda: fid.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def snapshot_to_cpu(state:Any)->Any:
+    """Returns a copy of `state` with every tensor copied to cpu memory. The containers are 
+    copied so later training steps can't modify the snapshot.
+    """
+    if isinstance(state, torch.Tensor):
+        return state.detach().to("cpu", copy=True)
+    if isinstance(state, dict):
+        snapshot = type(state)((key, snapshot_to_cpu(value)) for key, value in state.items())
+        # the `_metadata` of a module state dict is needed by `load_state_dict`
+        if hasattr(state, "_metadata"):
+            snapshot._metadata = state._metadata
+        return snapshot
+    if isinstance(state, (list, tuple)):
+        return type(state)(snapshot_to_cpu(value) for value in state)
+    return state
+
+
+class AsyncCheckpointWriter():
+    """
+    Writes and uploads checkpoints on a background thread so training only stops to copy the 
+    states into cpu memory. The jobs are run in order from a bounded queue; if `max_pending` 
+    jobs are waiting, `submit` blocks until a job finishes, which limits the memory held by
+    the snapshots. The local files are written to a temporary file and renamed, so a reader
+    or a preemption never sees a partially written checkpoint.
+
+    Args:
+        storage_backend: object with an `upload(local_path, remote_path)` method
+        local_dir (str): directory where the files are written
+        remote_dir (str): directory in the storage backend where the files are uploaded
+        max_pending (int): maximum number of jobs waiting in the queue
+        on_complete (callable): called with the job name after a job succeeds
+        on_failure (callable): called with the job name and the exception if a job fails
+    """
+
+    def __init__(self, storage_backend, local_dir:str, remote_dir:str='', max_pending:int=2, 
+                 on_complete:Callable[[str], None]=None, 
+                 on_failure:Callable[[str, Exception], None]=None):
+        self.storage = storage_backend
+        self.local_dir = local_dir
+        self.remote_dir = remote_dir
+        self.on_complete = on_complete
+        self.on_failure = on_failure
+        self.failures = list()
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name="checkpoint-writer", daemon=True)
+        self._thread.start()
+
+    def save(self, name:str, files:Dict[str, Any], upload:bool=True)->None:
+        """Snapshots the objects in `files`, a mapping from file name to object, and writes 
+        them in the background. `bytes` objects are written as is and the others are written
+        with `torch.save`.
+        """
+        files = {filename: obj if isinstance(obj, bytes) else snapshot_to_cpu(obj)
+                 for filename, obj in files.items()}
+        self.submit(name, self._write_files, files, upload)
+
+    def submit(self, name:str, fn:Callable, *args)->None:
+        """Runs `fn(*args)` on the background thread"""
+        if not self._thread.is_alive():
+            raise RuntimeError("checkpoint writer is closed")
+        self._queue.put((name, fn, args))
+
+    def upload(self, filename:str)->None:
+        """Uploads the existing local file `filename` in the background"""
+        self.submit(filename, self._upload, filename)
+
+    def wait(self)->None:
+        """Blocks until all of the submitted jobs are finished"""
+        self._queue.join()
+
+    def close(self)->None:
+        """Finishes the submitted jobs and stops the background thread"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _run(self)->None:
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                name, fn, args = job
+                try:
+                    fn(*args)
+                except Exception as err:
+                    self.failures.append((name, err))
+                    if self.on_failure is not None:
+                        self.on_failure(name, err)
+                    else:
+                        print(f"checkpoint job: {name} failed with: {err}")
+                else:
+                    if self.on_complete is not None:
+                        self.on_complete(name)
+            finally:
+                self._queue.task_done()
+
+    def _write_files(self, files:Dict[str, Any], upload:bool)->None:
+        for filename, obj in files.items():
+            local_path = os.path.join(self.local_dir, filename)
+            if isinstance(obj, bytes):
+                with open(local_path + ".tmp", 'wb') as fid:
+                    fid.write(obj)
             else:
-                continue
+                torch.save(obj, local_path + ".tmp")
+            os.replace(local_path + ".tmp", local_path)
+            if upload:
+                self._upload(filename)
+
+    def _upload(self, filename:str)->None:
+        self.storage.upload(os.path.join(self.local_dir, filename), 
+                            os.path.join(self.remote_dir, filename))
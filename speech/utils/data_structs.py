@@ -1,5 +1,5 @@
 # standard libraries
-from typing import Tuple, Iterable, List
+from typing import Tuple, Iterable, List, NamedTuple
 # third-party libraries
 import numpy as np
 import torch
@@ -16,3 +16,11 @@ TorchParams = Iterable[torch.nn.parameter.Parameter]
 
 # batches from the dataloader
 Batch = Tuple[Tuple[np.ndarray], Tuple[List[str]]]
+
+
+class TensorBatch(NamedTuple):
+    """padded batch of tensors built in the dataloader workers by `speech.loader.TensorCollate`"""
+    inputs: torch.Tensor        # float features, shape: (batch, max_time, feature_dim)
+    labels: torch.Tensor        # int labels of all examples concatenated, shape: (sum(label_lens),)
+    input_lens: torch.Tensor    # int number of feature frames of each example, shape: (batch,)
+    label_lens: torch.Tensor    # int number of labels of each example, shape: (batch,)
@@ -0,0 +1,281 @@
+# This module builds and reads a memory-mapped store of the normalized features
+# of a dataset. When the preprocessor is deterministic (no augmentation), the features
+# of an utterance never change, so they can be computed once and read back from disk
+# instead of re-decoding the wav file and re-computing the spectrogram every epoch.
+
+# standard libraries
+from functools import partial
+import hashlib
+import json
+import multiprocessing as mp
+import os
+from typing import List
+# third-party libraries
+import numpy as np
+import tqdm
+# project libraries
+from speech.utils.manifest import load_manifest
+from speech.utils.wave import array_from_wave
+
+
+INDEX_NAME = "index.json"
+SHARD_NAME = "shard_{:05d}.bin"
+
+
+def feature_cache_key(preproc)->str:
+    """Returns a hash of the preprocessor attributes that determine the value of the
+    normalized features: the feature type, window and step sizes, feature normalization,
+    and the mean and std-deviation arrays.
+
+    Args:
+        preproc (Preprocessor): preprocessor whose features will be cached
+    Returns:
+        (str): hex digest that identifies the feature configuration
+    """
+    config = {
+        "preprocessor": preproc.preprocessor,
+        "window_size": preproc.window_size,
+        "step_size": preproc.step_size,
+        "use_feature_normalize": preproc.use_feature_normalize
+    }
+    hasher = hashlib.md5()
+    hasher.update(json.dumps(config, sort_keys=True).encode('utf-8'))
+    hasher.update(np.ascontiguousarray(preproc.mean, dtype=np.float32).tobytes())
+    hasher.update(np.ascontiguousarray(preproc.std, dtype=np.float32).tobytes())
+    return hasher.hexdigest()
+
+
+def dataset_key(data_json:str)->str:
+    """Returns a hash of the absolute path of `data_json`, so datasets with the same file
+    name in different directories, like `common-voice/dev.json` and `tedlium/dev.json`, have
+    different caches.
+    """
+    return hashlib.md5(os.path.abspath(data_json).encode('utf-8')).hexdigest()[:12]
+
+
+def manifest_hash(data_json:str)->str:
+    """Returns the md5 hash of the contents of the `data_json` manifest"""
+    hasher = hashlib.md5()
+    with open(data_json, 'rb') as fid:
+        for block in iter(lambda: fid.read(1 << 20), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def get_cache_path(cache_dir:str, data_json:str, preproc)->str:
+    """Returns the directory of the feature cache for the `data_json` dataset and the
+    feature configuration of `preproc`.
+    """
+    dataset_name = os.path.splitext(os.path.basename(data_json))[0]
+    return os.path.join(
+        cache_dir, f"{dataset_name}_{dataset_key(data_json)}_{feature_cache_key(preproc)}"
+    )
+
+
+def check_cache_source(meta:dict, cache_path:str, data_json:str, check_contents:bool=False)->None:
+    """Raises a ValueError if the cache at `cache_path` wasn't built from `data_json` or, if
+    `check_contents` is True, if the manifest has changed since the cache was built.
+    """
+    source = meta.get('source')
+    if source != os.path.abspath(data_json):
+        raise ValueError(
+            f"feature cache: {cache_path} was built from: {source}, not from: {data_json}"
+        )
+    if check_contents and meta['source_md5'] != manifest_hash(data_json):
+        raise ValueError(
+            f"feature cache: {cache_path} is stale as {data_json} has changed since it was "
+            f"built. delete the cache directory to rebuild it."
+        )
+
+
+def build_feature_cache(data_json:str,
+                        preproc,
+                        cache_dir:str,
+                        dtype:str='float32',
+                        shard_size_mb:int=1024,
+                        num_workers:int=4)->str:
+    """Computes the normalized features without augmentation for every example in `data_json`
+    and writes them into large binary shard files with an index of the shard, frame offset,
+    and number of frames for each audio file. If the cache already exists, it is not rebuilt.
+
+    Args:
+        data_json (str): path to the dataset json file
+        preproc (Preprocessor): preprocessor used to compute the features
+        cache_dir (str): directory where the feature caches are stored
+        dtype (str): 'float32' or 'float16', the dtype of the stored features
+        shard_size_mb (int): maximum size of a single shard file in megabytes
+        num_workers (int): number of processes computing the features
+    Returns:
+        (str): path to the feature cache directory
+    """
+    assert dtype in ['float32', 'float16'], f"dtype: {dtype} must be 'float32' or 'float16'"
+
+    cache_path = get_cache_path(cache_dir, data_json, preproc)
+    index_path = os.path.join(cache_path, INDEX_NAME)
+    if os.path.exists(index_path):
+        with open(index_path, 'r') as fid:
+            check_cache_source(json.load(fid), cache_path, data_json, check_contents=True)
+        print(f"feature cache exists at: {cache_path}")
+        return cache_path
+    os.makedirs(cache_path, exist_ok=True)
+
+    audio_paths = sorted(set(example['audio'] for example in load_manifest(data_json)))
+    max_shard_bytes = shard_size_mb * 1024 * 1024
+    itemsize = np.dtype(dtype).itemsize
+
+    index = dict()
+    shard_files = list()
+    shard_fid, shard_bytes, shard_frames = None, 0, 0
+    feature_dim = None
+
+    compute_fn = partial(_compute_features, preproc=preproc)
+    with mp.Pool(processes=num_workers) as pool:
+        feature_iter = pool.imap(compute_fn, audio_paths, chunksize=16)
+        for audio_path, features in tqdm.tqdm(zip(audio_paths, feature_iter), total=len(audio_paths)):
+            if feature_dim is None:
+                feature_dim = features.shape[1]
+            assert features.shape[1] == feature_dim, \
+                f"feature dim: {features.shape[1]} of {audio_path} doesn't match {feature_dim}"
+
+            n_bytes = features.shape[0] * feature_dim * itemsize
+            # start a new shard if the current shard is full
+            if shard_fid is None or (shard_bytes + n_bytes > max_shard_bytes and shard_bytes > 0):
+                if shard_fid is not None:
+                    shard_fid.close()
+                shard_files.append(SHARD_NAME.format(len(shard_files)))
+                shard_fid = open(os.path.join(cache_path, shard_files[-1]), 'wb')
+                shard_bytes, shard_frames = 0, 0
+
+            shard_fid.write(features.astype(dtype).tobytes())
+            index[audio_path] = [len(shard_files) - 1, shard_frames, features.shape[0]]
+            shard_bytes += n_bytes
+            shard_frames += features.shape[0]
+
+        if shard_fid is not None:
+            shard_fid.close()
+
+    meta = {
+        "key": feature_cache_key(preproc),
+        "source": os.path.abspath(data_json),
+        "source_md5": manifest_hash(data_json),
+        "dtype": dtype,
+        "feature_dim": feature_dim,
+        "shards": shard_files,
+        "index": index
+    }
+    # the index is written last and atomically so its presence marks a complete cache
+    tmp_index_path = index_path + ".tmp"
+    with open(tmp_index_path, 'w') as fid:
+        json.dump(meta, fid)
+    os.replace(tmp_index_path, index_path)
+    print(f"feature cache of {len(index)} examples written to: {cache_path}")
+
+    return cache_path
+
+
+def _compute_features(audio_path:str, preproc)->np.ndarray:
+    """Computes the normalized features of `audio_path` without any augmentation.
+    """
+    # importing here avoids a circular import with `speech.loader`
+    from speech.loader import process_audio
+
+    audio_data, samp_rate = array_from_wave(audio_path)
+    features = process_audio(audio_data,
+                             samp_rate,
+                             preproc.window_size,
+                             preproc.step_size,
+                             preproc.preprocessor)
+    return preproc.normalize(features)
+
+
+class FeatureCache():
+    """Reads the features written by `build_feature_cache`. The shards are opened as read-only
+    memory-maps so the features of an example are a view into the page cache and are
+    shared across all processes reading the same cache.
+
+    Args:
+        cache_path (str): path to the feature cache directory
+        data_json (str): if not None, the cache must have been built from this dataset
+    """
+
+    def __init__(self, cache_path:str, data_json:str=None):
+        self.cache_path = cache_path
+        with open(os.path.join(cache_path, INDEX_NAME), 'r') as fid:
+            meta = json.load(fid)
+        if data_json is not None:
+            check_cache_source(meta, cache_path, data_json)
+        self.key = meta['key']
+        self.dtype = np.dtype(meta['dtype'])
+        self.feature_dim = meta['feature_dim']
+        self.shard_files = meta['shards']
+        self.index = meta['index']
+        self._shards = None
+
+    def _open_shards(self)->List[np.memmap]:
+        shards = list()
+        for shard_file in self.shard_files:
+            shard = np.memmap(os.path.join(self.cache_path, shard_file), dtype=self.dtype, mode='r')
+            shards.append(shard.reshape(-1, self.feature_dim))
+        return shards
+
+    def __contains__(self, audio_path:str)->bool:
+        return audio_path in self.index
+
+    def __len__(self)->int:
+        return len(self.index)
+
+    def __getitem__(self, audio_path:str)->np.ndarray:
+        """Returns the normalized features of `audio_path` with shape (time, feature_dim).
+        Float32 caches return a read-only view into the memory-map without a copy.
+        """
+        # the memory-maps are opened lazily so each dataloader worker opens its own
+        if self._shards is None:
+            self._shards = self._open_shards()
+        shard_idx, offset, n_frames = self.index[audio_path]
+        features = self._shards[shard_idx][offset:offset + n_frames]
+        if self.dtype != np.float32:
+            features = features.astype(np.float32)
+        return features
+
+    def __getstate__(self):
+        # memory-maps are not pickled and are re-opened in the new process
+        state = self.__dict__.copy()
+        state['_shards'] = None
+        return state
+
+
+def open_feature_cache(cache_dir:str, data_json:str, preproc)->FeatureCache:
+    """Returns the FeatureCache of `data_json` that matches the feature configuration
+    of `preproc`, or None if no such cache has been built.
+    """
+    if cache_dir is None:
+        return None
+    cache_path = get_cache_path(cache_dir, data_json, preproc)
+    if not os.path.exists(os.path.join(cache_path, INDEX_NAME)):
+        return None
+    return FeatureCache(cache_path, data_json)
+
+
+if __name__ == "__main__":
+    import argparse
+    from speech.utils.io import read_pickle
+
+    parser = argparse.ArgumentParser(
+        description="Builds a memory-mapped feature cache for the input datasets."
+    )
+    parser.add_argument("--preproc-path", type=str, required=True,
+        help="Path to the pickled preprocessor whose features will be cached.")
+    parser.add_argument("--data-jsons", type=str, nargs='+', required=True,
+        help="Paths to the dataset json files to be cached.")
+    parser.add_argument("--cache-dir", type=str, required=True,
+        help="Directory where the feature caches will be written.")
+    parser.add_argument("--dtype", type=str, default='float32', choices=['float32', 'float16'],
+        help="Dtype of the stored features.")
+    parser.add_argument("--num-workers", type=int, default=4,
+        help="Number of processes computing the features.")
+    args = parser.parse_args()
+
+    preproc = read_pickle(args.preproc_path)
+    preproc.update()
+    for data_json in args.data_jsons:
+        build_feature_cache(data_json, preproc, args.cache_dir, args.dtype, num_workers=args.num_workers)
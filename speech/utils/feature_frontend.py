@@ -0,0 +1,260 @@
+# This module computes the log-spectrogram, log-mel filterbank, and mfcc features for a
+# padded batch of audio at once with vectorized torch operations. The output matches the
+# single-utterance functions in `speech.loader` (`log_spectrogram`, `log_mel_filterbank`, `mfcc`)
+# within floating-point tolerance. As a torch module, the frontend can run in the dataloader
+# collate function on cpu or on the training device.
+
+# standard libraries
+from typing import List, Tuple
+# third-party libraries
+import numpy as np
+import python_speech_features
+import torch
+import torch.nn as nn
+
+
+# constants of python_speech_features used in the log_mel and mfcc features
+NFFT = 512
+NUM_FILTERS = 26
+NUM_CEPSTRA = 13
+PREEMPHASIS = 0.97
+CEP_LIFTER = 22
+FLOAT_EPS = np.finfo(float).eps
+
+
+def pad_audio(audio_list:List[np.ndarray], dtype=torch.float32)->Tuple[torch.Tensor, torch.Tensor]:
+    """Zero-pads a list of 1d audio arrays into a single tensor.
+    Args:
+        audio_list (List[np.ndarray]): list of audio arrays
+        dtype (torch.dtype): dtype of the output tensor
+    Returns:
+        audio (torch.Tensor): padded audio with shape (batch, max_samples)
+        audio_lens (torch.Tensor): number of samples of each audio array
+    """
+    audio_lens = torch.LongTensor([audio.shape[0] for audio in audio_list])
+    audio = torch.zeros((len(audio_list), int(audio_lens.max())), dtype=dtype)
+    for i, audio_array in enumerate(audio_list):
+        audio[i, :audio_array.shape[0]] = torch.from_numpy(np.asarray(audio_array))
+    return audio, audio_lens
+
+
+def mask_frames(features:torch.Tensor, frame_lens:torch.Tensor)->torch.Tensor:
+    """Sets the frames beyond the length of each example to zero.
+    """
+    mask = torch.arange(features.shape[1], device=features.device)[None, :] < frame_lens[:, None]
+    return features * mask.unsqueeze(2).to(features.dtype)
+
+
+def batch_deltas(features:torch.Tensor, frame_lens:torch.Tensor, N:int=1)->torch.Tensor:
+    """Computes the delta features like `python_speech_features.delta` where the edges of each
+    example are padded by repeating the first and last valid frame.
+    Args:
+        features (torch.Tensor): features with shape (batch, time, feature)
+        frame_lens (torch.Tensor): number of valid frames in each example
+        N (int): number of preceding and following frames used in the delta
+    """
+    batch_size, max_frames, feature_dim = features.shape
+    time_idx = torch.arange(max_frames, device=features.device)[None, :]
+    last_idx = (frame_lens.to(features.device) - 1).clamp(min=0)[:, None]
+    denominator = 2 * sum(n**2 for n in range(1, N + 1))
+
+    deltas = torch.zeros_like(features)
+    for n in range(1, N + 1):
+        next_idx = torch.min(time_idx + n, last_idx).clamp(min=0)
+        prev_idx = (time_idx - n).clamp(min=0).expand(batch_size, -1)
+        next_idx = next_idx.unsqueeze(2).expand(-1, -1, feature_dim)
+        prev_idx = prev_idx.unsqueeze(2).expand(-1, -1, feature_dim)
+        deltas += n * (features.gather(1, next_idx) - features.gather(1, prev_idx))
+    return deltas / denominator
+
+
+def _add_deltas(features:torch.Tensor, frame_lens:torch.Tensor)->torch.Tensor:
+    """Concatenates the first and second order deltas with window 1, like `speech.loader.mfcc`
+    """
+    delta = batch_deltas(features, frame_lens, N=1)
+    delta_delta = batch_deltas(delta, frame_lens, N=1)
+    return torch.cat((features, delta, delta_delta), dim=2)
+
+
+class BatchFeatureFrontend(nn.Module):
+    """Computes the normalized features of a padded batch of audio.
+
+    Args:
+        preprocessor (str): 'log_spectrogram', 'log_mel', or 'mfcc'
+        sample_rate (int): sample rate of the audio
+        window_size (int): size of the window in milliseconds
+        step_size (int): size of the step in milliseconds
+        mean (np.ndarray): if not None, the mean of each feature bin subtracted from the features
+        std (np.ndarray): if not None, the std of each feature bin that divides the features
+        use_feature_normalize (bool): if true, each example is normalized to zero mean and unit
+            std before the `mean` and `std` normalization, like `speech.loader.feature_normalize`
+    """
+
+    def __init__(self,
+                 preprocessor:str,
+                 sample_rate:int,
+                 window_size:int,
+                 step_size:int,
+                 mean:np.ndarray=None,
+                 std:np.ndarray=None,
+                 use_feature_normalize:bool=False):
+        super().__init__()
+        assert preprocessor in ['log_spectrogram', 'log_mel', 'mfcc'], \
+            f"preprocessor name: {preprocessor} is unacceptable"
+        self.preprocessor = preprocessor
+        self.sample_rate = sample_rate
+        self.use_feature_normalize = use_feature_normalize
+
+        if preprocessor == 'log_spectrogram':
+            # matches the integer conversion in `speech.loader.log_spectrogram`
+            self.frame_len = int(window_size * sample_rate / 1e3)
+            self.frame_step = self.frame_len - int((window_size - step_size) * sample_rate / 1e3)
+            # scipy's 'hann' window is periodic
+            window = torch.hann_window(self.frame_len, periodic=True, dtype=torch.float64)
+        else:
+            # matches the rounding in `python_speech_features.sigproc.framesig`
+            self.frame_len = int(python_speech_features.sigproc.round_half_up(window_size * sample_rate / 1e3))
+            self.frame_step = int(python_speech_features.sigproc.round_half_up(step_size * sample_rate / 1e3))
+            # numpy's hanning window is symmetric
+            window = torch.hann_window(self.frame_len, periodic=False, dtype=torch.float64)
+            filterbank = python_speech_features.get_filterbanks(
+                NUM_FILTERS, NFFT, sample_rate, 0, sample_rate / 2
+            )
+            self.register_buffer('filterbank', torch.from_numpy(filterbank.T))
+            # orthonormal DCT-II matrix as used by scipy.fftpack.dct(norm='ortho')
+            n = np.arange(NUM_FILTERS)
+            k = np.arange(NUM_CEPSTRA)[:, None]
+            dct = np.cos(np.pi * k * (2 * n + 1) / (2 * NUM_FILTERS)) * np.sqrt(2 / NUM_FILTERS)
+            dct[0] /= np.sqrt(2)
+            lift = 1 + (CEP_LIFTER / 2.) * np.sin(np.pi * np.arange(NUM_CEPSTRA) / CEP_LIFTER)
+            self.register_buffer('dct', torch.from_numpy(dct.T * lift[None, :]))
+            self.register_buffer('lift', torch.from_numpy(lift))
+        self.register_buffer('window', window)
+
+        if mean is not None:
+            self.register_buffer('mean', torch.from_numpy(np.asarray(mean, dtype=np.float32)))
+            self.register_buffer('std', torch.from_numpy(np.asarray(std, dtype=np.float32)))
+        else:
+            self.mean, self.std = None, None
+
+    @classmethod
+    def from_preproc(cls, preproc, sample_rate:int=16000):
+        """Creates a frontend with the feature configuration and normalization of a Preprocessor
+        """
+        return cls(
+            preproc.preprocessor,
+            sample_rate,
+            preproc.window_size,
+            preproc.step_size,
+            mean=preproc.mean,
+            std=preproc.std,
+            use_feature_normalize=preproc.use_feature_normalize
+        )
+
+    def frame_lengths(self, audio_lens:torch.Tensor)->torch.Tensor:
+        """Returns the number of feature frames of audio with `audio_lens` samples.
+        """
+        if self.preprocessor == 'log_spectrogram':
+            # scipy doesn't pad the signal so incomplete frames are dropped
+            return ((audio_lens - self.frame_len) // self.frame_step + 1).clamp(min=0)
+        # python_speech_features zero-pads the signal to complete the last frame
+        n_frames = 1 + torch.ceil((audio_lens - self.frame_len).double() / self.frame_step).long()
+        return n_frames.clamp(min=1)
+
+    def forward(self, audio:torch.Tensor, audio_lens:torch.Tensor)->Tuple[torch.Tensor, torch.Tensor]:
+        """Computes the features of the padded audio.
+        Args:
+            audio (torch.Tensor): padded audio with shape (batch, samples)
+            audio_lens (torch.Tensor): number of samples of each example
+        Returns:
+            features (torch.Tensor): features with shape (batch, time, feature), the frames beyond
+                the length of each example are zero
+            frame_lens (torch.Tensor): number of frames of each example
+        """
+        audio_lens = audio_lens.to(audio.device)
+        frame_lens = self.frame_lengths(audio_lens)
+
+        if self.preprocessor == 'log_spectrogram':
+            features = self.log_spectrogram(audio, frame_lens)
+        elif self.preprocessor == 'log_mel':
+            features = _add_deltas(self.log_mel_filterbank(audio, audio_lens, frame_lens), frame_lens)
+        else:
+            features = _add_deltas(self.mfcc(audio, audio_lens, frame_lens), frame_lens)
+
+        features = self.normalize(features, frame_lens)
+        return mask_frames(features, frame_lens), frame_lens
+
+    def _frames(self, audio:torch.Tensor, frame_lens:torch.Tensor)->torch.Tensor:
+        """Splits the audio into windowed frames with shape (batch, time, frame_len)
+        """
+        max_frames = int(frame_lens.max()) if frame_lens.numel() > 0 else 0
+        padded_len = (max_frames - 1) * self.frame_step + self.frame_len
+        if audio.shape[1] < padded_len:
+            audio = nn.functional.pad(audio, (0, padded_len - audio.shape[1]))
+        frames = audio.unfold(1, self.frame_len, self.frame_step)[:, :max_frames]
+        return frames * self.window.to(audio.dtype)
+
+    def log_spectrogram(self, audio:torch.Tensor, frame_lens:torch.Tensor, eps=1e-10)->torch.Tensor:
+        """Log of the one-sided power spectral density like `scipy.signal.spectrogram`
+        """
+        frames = self._frames(audio, frame_lens)
+        spec = torch.fft.rfft(frames, dim=2).abs() ** 2
+        window = self.window.to(audio.dtype)
+        spec = spec / (self.sample_rate * (window ** 2).sum())
+        # one-sided density doubles all bins except the DC and nyquist bins
+        if self.frame_len % 2 == 0:
+            spec[:, :, 1:-1] *= 2
+        else:
+            spec[:, :, 1:] *= 2
+        return torch.log(spec.float() + eps)
+
+    def _power_spectrum(self, audio:torch.Tensor, audio_lens:torch.Tensor,
+                        frame_lens:torch.Tensor)->torch.Tensor:
+        """Power spectrum of the pre-emphasized frames like `python_speech_features.fbank`
+        """
+        emphasized = torch.cat(
+            (audio[:, :1], audio[:, 1:] - PREEMPHASIS * audio[:, :-1]), dim=1
+        )
+        # the padding beyond each example is zero after pre-emphasis in python_speech_features
+        sample_mask = torch.arange(audio.shape[1], device=audio.device)[None, :] < audio_lens[:, None]
+        emphasized = emphasized * sample_mask.to(audio.dtype)
+        frames = self._frames(emphasized, frame_lens)
+        return torch.fft.rfft(frames, n=NFFT, dim=2).abs() ** 2 / NFFT
+
+    def _filterbank_energies(self, pow_spec:torch.Tensor)->Tuple[torch.Tensor, torch.Tensor]:
+        energy = pow_spec.sum(dim=2)
+        energy = torch.where(energy == 0, torch.full_like(energy, FLOAT_EPS), energy)
+        feat = torch.matmul(pow_spec, self.filterbank.to(pow_spec.dtype))
+        feat = torch.where(feat == 0, torch.full_like(feat, FLOAT_EPS), feat)
+        return feat, energy
+
+    def log_mel_filterbank(self, audio:torch.Tensor, audio_lens:torch.Tensor,
+                            frame_lens:torch.Tensor)->torch.Tensor:
+        """Log of the mel filterbank energies, without deltas
+        """
+        pow_spec = self._power_spectrum(audio, audio_lens, frame_lens)
+        feat, _ = self._filterbank_energies(pow_spec)
+        return torch.log(feat).float()
+
+    def mfcc(self, audio:torch.Tensor, audio_lens:torch.Tensor, frame_lens:torch.Tensor)->torch.Tensor:
+        """Liftered mfcc's with the log frame energy as the first coefficient, without deltas
+        """
+        pow_spec = self._power_spectrum(audio, audio_lens, frame_lens)
+        feat, energy = self._filterbank_energies(pow_spec)
+        cepstra = torch.matmul(torch.log(feat), self.dct.to(feat.dtype))
+        cepstra[:, :, 0] = torch.log(energy)
+        return cepstra.float()
+
+    def normalize(self, features:torch.Tensor, frame_lens:torch.Tensor)->torch.Tensor:
+        """Applies the per-example and per-bin normalization of `Preprocessor.normalize`
+        """
+        if self.use_feature_normalize:
+            features = mask_frames(features, frame_lens)
+            n_values = (frame_lens * features.shape[2]).clamp(min=1).to(features.dtype)
+            mean = features.sum(dim=(1, 2)) / n_values
+            centered = mask_frames(features - mean[:, None, None], frame_lens)
+            std = torch.sqrt((centered ** 2).sum(dim=(1, 2)) / n_values)
+            features = (features - mean[:, None, None]) / (std[:, None, None] + 1e-7)
+        if self.mean is not None:
+            features = (features - self.mean) / self.std
+        return features
@@ -4,8 +4,10 @@ import glob
 import json 
 import os
 import pickle
+import random
 import yaml
 # third-party libraries
+import numpy as np
 import torch
 # project libraries
 
@@ -33,8 +35,13 @@ def get_names(path:str, tag:str, get_config:bool=False, model_name:str=''):
     return output
 
 def save(model, preproc, path, tag=""):
+    save_state_dict(model.state_dict(), preproc, path, tag)
+
+
+def save_state_dict(state_dict, preproc, path, tag=""):
+    """Same as `save` with the model's state dict"""
     model_n, preproc_n = get_names(path, tag)
-    torch.save(model.state_dict(), model_n)
+    torch.save(state_dict, model_n)
     with open(preproc_n, 'wb') as fid:
         pickle.dump(preproc, fid)
 
@@ -78,6 +85,87 @@ def load_state_dict(model_path:str, device:torch.device)->OrderedDict:
 
 
 
+TRAIN_CKPT = "ckpt_train_state.pth"
+
+
+def save_train_checkpoint(ckpt_path:str, model, optimizer, lr_scheduler, scaler, 
+                          sampler_state:dict, train_state:dict)->None:
+    """Saves everything needed to resume training in the middle of an epoch: the weights, the
+    optimizer state with the SGD momentum buffers, the learning rate scheduler, the gradient
+    scaler, the random number generator states, and the position of the sampler. The file is 
+    written atomically so a preempted save doesn't corrupt the previous checkpoint.
+
+    Args:
+        ckpt_path (str): path where the checkpoint is written
+        model (torch.nn.Module): model without the ddp wrapper
+        optimizer, lr_scheduler, scaler: training objects with a `state_dict` method
+        sampler_state (dict): from `ResumableDistributedSampler.state_dict` or None
+        train_state (dict): with keys `start_epoch`, `run_state`, and `best_so_far`
+    """
+    checkpoint = get_train_checkpoint(
+        model, optimizer, lr_scheduler, scaler, sampler_state, train_state
+    )
+    torch.save(checkpoint, ckpt_path + ".tmp")
+    os.replace(ckpt_path + ".tmp", ckpt_path)
+
+
+def get_train_checkpoint(model, optimizer, lr_scheduler, scaler, sampler_state:dict, 
+                         train_state:dict)->dict:
+    """Returns the checkpoint dict written by `save_train_checkpoint`. The tensors are 
+    references to the training states, not copies.
+    """
+    return {
+        "model": model.state_dict(),
+        "optimizer": optimizer.state_dict(),
+        "lr_scheduler": lr_scheduler.state_dict(),
+        "scaler": scaler.state_dict(),
+        "rng": get_rng_states(),
+        "sampler": sampler_state,
+        "train_state": train_state
+    }
+
+
+def load_train_checkpoint(ckpt_path:str, model, optimizer, lr_scheduler, scaler, 
+                          device:torch.device)->dict:
+    """Loads the checkpoint from `save_train_checkpoint` into the training objects and restores
+    the random number generator states. The model and optimizer should already be on `device`.
+
+    Returns:
+        dict: with the `sampler` state and the `train_state`
+    """
+    checkpoint = torch.load(ckpt_path, map_location=device)
+    model.load_state_dict(checkpoint["model"])
+    optimizer.load_state_dict(checkpoint["optimizer"])
+    lr_scheduler.load_state_dict(checkpoint["lr_scheduler"])
+    scaler.load_state_dict(checkpoint["scaler"])
+    set_rng_states(checkpoint["rng"])
+    return {"sampler": checkpoint["sampler"], "train_state": checkpoint["train_state"]}
+
+
+def get_rng_states()->dict:
+    # the numpy key array is stored as a tensor so the checkpoint holds only tensors and
+    # python primitives
+    name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    states = {
+        "python": random.getstate(),
+        "numpy": (name, torch.from_numpy(keys.astype(np.int64)), pos, has_gauss, cached_gaussian),
+        "torch": torch.get_rng_state()
+    }
+    if torch.cuda.is_available():
+        states["cuda"] = torch.cuda.get_rng_state_all()
+    return states
+
+
+def set_rng_states(states:dict)->None:
+    random.setstate(states["python"])
+    name, keys, pos, has_gauss, cached_gaussian = states["numpy"]
+    np.random.set_state((name, keys.cpu().numpy().astype(np.uint32), pos, has_gauss, cached_gaussian))
+    # the states may have been mapped to a cuda device by `torch.load`
+    torch.set_rng_state(states["torch"].cpu())
+    if "cuda" in states and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all([state.cpu() for state in states["cuda"]])
+
+
 def save_dict(dct, path):
     with open(path, 'wb') as fid:
         pickle.dump(dct, fid)
@@ -0,0 +1,443 @@
+# This module stores a dataset manifest in a compact, columnar format. The JSONL manifest of
+# `read_data_json` holds a python dict and a list of label strings for every example, which
+# for millions of examples costs gigabytes in every loader worker and ddp process. The compact
+# manifest stores the durations, the int-encoded labels in one flat array with offsets, and the
+# audio paths as indices into an interned directory table plus a flat buffer of file names.
+# The arrays are opened as read-only memory-maps so all processes share the same pages.
+# For tools that only touch a few rows of a JSONL manifest, `build_manifest_index` records the
+# byte offset of every line so `JsonlManifest` can parse single rows from a memory-mapped file.
+
+# standard libraries
+from collections.abc import Sequence
+import hashlib
+import json
+import mmap
+import os
+import random
+import tempfile
+from typing import List, Tuple, Union
+# third-party libraries
+import numpy as np
+import tqdm
+# project libraries
+from speech.utils.data_helpers import path_to_id
+from speech.utils.io import read_data_json
+
+
+META_NAME = "manifest.json"
+ARRAY_NAMES = ["durations", "label_ids", "label_offsets", "dir_ids", "name_bytes", "name_offsets"]
+INDEX_META_NAME = "index.json"
+
+
+def convert_to_compact(data_json:str, out_dir:str)->str:
+    """Converts the JSONL manifest at `data_json` into a compact manifest in `out_dir`.
+    Only the `audio`, `duration`, and `text` fields of each example are kept.
+
+    Args:
+        data_json (str): path to the JSONL dataset file
+        out_dir (str): directory where the compact manifest will be written
+    Returns:
+        (str): path to the compact manifest directory
+    """
+    os.makedirs(out_dir, exist_ok=True)
+
+    durations, label_lens, dir_ids, name_lens = list(), list(), list(), list()
+    label_ids, names = list(), list()
+    token_to_id, dir_to_id = dict(), dict()
+    source_hasher = hashlib.md5()
+
+    with open(data_json, 'rb') as fid:
+        for line in tqdm.tqdm(fid):
+            source_hasher.update(line)
+            example = json.loads(line)
+            durations.append(example['duration'])
+
+            label_lens.append(len(example['text']))
+            for token in example['text']:
+                label_ids.append(token_to_id.setdefault(token, len(token_to_id)))
+
+            dir_name, base_name = os.path.split(example['audio'])
+            dir_ids.append(dir_to_id.setdefault(dir_name, len(dir_to_id)))
+            base_name = base_name.encode('utf-8')
+            names.append(base_name)
+            name_lens.append(len(base_name))
+
+    arrays = {
+        "durations": np.array(durations, dtype=np.float64),
+        "label_ids": np.array(label_ids, dtype=_id_dtype(len(token_to_id))),
+        "label_offsets": np.concatenate(([0], np.cumsum(label_lens, dtype=np.int64))),
+        "dir_ids": np.array(dir_ids, dtype=_id_dtype(len(dir_to_id))),
+        "name_bytes": np.frombuffer(b''.join(names), dtype=np.uint8),
+        "name_offsets": np.concatenate(([0], np.cumsum(name_lens, dtype=np.int64)))
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(out_dir, name + ".npy"), array)
+
+    meta = {
+        "source": os.path.abspath(data_json),
+        "source_md5": source_hasher.hexdigest(),
+        "num_examples": len(durations),
+        "tokens": sorted(token_to_id, key=token_to_id.get),
+        "dirs": sorted(dir_to_id, key=dir_to_id.get)
+    }
+    # the meta file is written last so its presence marks a complete manifest
+    with open(os.path.join(out_dir, META_NAME + ".tmp"), 'w') as fid:
+        json.dump(meta, fid)
+    os.replace(os.path.join(out_dir, META_NAME + ".tmp"), os.path.join(out_dir, META_NAME))
+    print(f"{len(durations)} examples written to compact manifest: {out_dir}")
+
+    return out_dir
+
+
+def _id_dtype(num_ids:int)->np.dtype:
+    return np.uint16 if num_ids <= np.iinfo(np.uint16).max else np.int32
+
+
+def is_compact_manifest(path:str)->bool:
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, META_NAME))
+
+
+def load_manifest(path:str, indexed:bool=False)->Union[List[dict], 'CompactManifest', 'JsonlManifest']:
+    """Returns a CompactManifest if `path` is a compact manifest directory, and otherwise the
+    list of examples in the JSONL file from `read_data_json`. If `indexed` is True, a
+    JsonlManifest that parses rows on access is returned for a JSONL file instead. All are
+    sequences of dicts with `audio`, `duration`, and `text` keys.
+    """
+    if is_compact_manifest(path):
+        return CompactManifest(path)
+    if indexed:
+        return JsonlManifest(path)
+    return read_data_json(path)
+
+
+class CompactManifest(Sequence):
+    """Read-only, memory-mapped dataset manifest written by `convert_to_compact`. Indexing
+    returns the example as a dict like a row of `read_data_json`, and the columns can be read
+    as arrays without creating any dicts.
+
+    Args:
+        manifest_dir (str): path to the compact manifest directory
+    """
+
+    def __init__(self, manifest_dir:str):
+        self.manifest_dir = manifest_dir
+        with open(os.path.join(manifest_dir, META_NAME), 'r') as fid:
+            meta = json.load(fid)
+        self.source_md5 = meta['source_md5']
+        self.tokens = meta['tokens']
+        self.dirs = meta['dirs']
+        self._num_examples = meta['num_examples']
+        self._arrays = None
+
+    @property
+    def arrays(self)->dict:
+        # the memory-maps are opened lazily so each loader worker opens its own
+        if self._arrays is None:
+            self._arrays = {
+                name: np.load(os.path.join(self.manifest_dir, name + ".npy"), mmap_mode='r')
+                for name in ARRAY_NAMES
+            }
+        return self._arrays
+
+    def __getstate__(self):
+        # memory-maps are not pickled and are re-opened in the new process
+        state = self.__dict__.copy()
+        state['_arrays'] = None
+        return state
+
+    def __len__(self)->int:
+        return self._num_examples
+
+    def __getitem__(self, idx:int)->dict:
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"index: {idx} out of range for manifest of size: {len(self)}")
+        return {
+            "audio": self.audio_path(idx),
+            "duration": float(self.arrays['durations'][idx]),
+            "text": self.labels(idx)
+        }
+
+    def audio_path(self, idx:int)->str:
+        name_offsets = self.arrays['name_offsets']
+        name = self.arrays['name_bytes'][name_offsets[idx]:name_offsets[idx + 1]]
+        return os.path.join(self.dirs[self.arrays['dir_ids'][idx]], name.tobytes().decode('utf-8'))
+
+    def label_ids(self, idx:int)->np.ndarray:
+        label_offsets = self.arrays['label_offsets']
+        return self.arrays['label_ids'][label_offsets[idx]:label_offsets[idx + 1]]
+
+    def labels(self, idx:int)->List[str]:
+        return [self.tokens[token_id] for token_id in self.label_ids(idx)]
+
+    @property
+    def durations(self)->np.ndarray:
+        return self.arrays['durations']
+
+    @property
+    def label_lens(self)->np.ndarray:
+        return np.diff(self.arrays['label_offsets'])
+
+
+class ManifestView(Sequence):
+    """A reordered view of the examples of a manifest at `indices` without copying the examples
+    """
+
+    def __init__(self, manifest:Sequence, indices:np.ndarray):
+        self.manifest = manifest
+        self.indices = indices
+
+    def __len__(self)->int:
+        return len(self.indices)
+
+    def __getitem__(self, idx:int)->dict:
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        return self.manifest[int(self.indices[idx])]
+
+
+def default_index_dir(data_json:str)->str:
+    return data_json + ".index"
+
+
+def fallback_index_dirs(data_json:str)->List[str]:
+    """Returns the index directories in the user cache and the temp directory that are used
+    if the directory of the manifest isn't writable, e.g. on a read-only dataset mount
+    """
+    key = hashlib.md5(os.path.abspath(data_json).encode('utf-8')).hexdigest()
+    cache_root = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return [os.path.join(cache_root, "speech", "manifest_index", key),
+            os.path.join(tempfile.gettempdir(), "speech_manifest_index", key)]
+
+
+def build_manifest_index(data_json:str, index_dir:str=None, record_ids:bool=False,
+                         durations:bool=False)->str:
+    """Records the byte offset of every line of the JSONL manifest at `data_json`. Blank lines
+    are skipped. The secondary keys require parsing every line and are only built if requested.
+
+    Args:
+        data_json (str): path to the JSONL dataset file
+        index_dir (str): directory where the index is written, defaults to `<data_json>.index`
+        record_ids (bool): if True, the rows are indexed by the record id of the audio path
+        durations (bool): if True, the duration of every row is stored
+    Returns:
+        (str): path to the index directory
+    """
+    if index_dir is None:
+        index_dir = default_index_dir(data_json)
+    os.makedirs(index_dir, exist_ok=True)
+    parse_lines = record_ids or durations
+
+    offsets, id_hashes, row_durations = [0], list(), list()
+    with open(data_json, 'rb') as fid:
+        for line in tqdm.tqdm(fid, disable=not parse_lines):
+            if line.strip():
+                offsets.append(offsets[-1] + len(line))
+                if parse_lines:
+                    example = json.loads(line)
+                    if record_ids:
+                        id_hashes.append(_id_hash(path_to_id(example['audio'])))
+                    if durations:
+                        row_durations.append(example['duration'])
+            else:
+                # the row boundary is moved past a blank line
+                offsets[-1] += len(line)
+
+    # the end of the last row is stored so each row is `offsets[i]:offsets[i+1]`
+    np.save(os.path.join(index_dir, "offsets.npy"), np.array(offsets, dtype=np.int64))
+    if record_ids:
+        id_hashes = np.array(id_hashes, dtype=np.int64)
+        id_rows = np.argsort(id_hashes, kind='stable')
+        np.save(os.path.join(index_dir, "id_hashes.npy"), id_hashes[id_rows])
+        np.save(os.path.join(index_dir, "id_rows.npy"), id_rows)
+    if durations:
+        np.save(os.path.join(index_dir, "durations.npy"), np.array(row_durations, dtype=np.float64))
+
+    source_stat = os.stat(data_json)
+    meta = {
+        "source": os.path.abspath(data_json),
+        "source_size": source_stat.st_size,
+        "source_mtime_ns": source_stat.st_mtime_ns,
+        "num_examples": len(offsets) - 1,
+        "record_ids": record_ids,
+        "durations": durations
+    }
+    with open(os.path.join(index_dir, INDEX_META_NAME + ".tmp"), 'w') as fid:
+        json.dump(meta, fid)
+    os.replace(os.path.join(index_dir, INDEX_META_NAME + ".tmp"),
+               os.path.join(index_dir, INDEX_META_NAME))
+
+    return index_dir
+
+
+def _id_hash(record_id:str)->int:
+    # a stable 64-bit hash, unlike the salted builtin `hash`
+    return int.from_bytes(hashlib.md5(record_id.encode('utf-8')).digest()[:8], 'little', signed=True)
+
+
+def _read_index_meta(index_dir:str)->Union[dict, None]:
+    """Returns the index meta data or None if the index is missing"""
+    meta_path = os.path.join(index_dir, INDEX_META_NAME)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, 'r') as fid:
+        return json.load(fid)
+
+
+def _is_stale(meta:dict, data_json:str)->bool:
+    """Returns True if the manifest has changed since the index was built"""
+    source_stat = os.stat(data_json)
+    return (meta['source_size'], meta['source_mtime_ns']) != (source_stat.st_size, source_stat.st_mtime_ns)
+
+
+def _load_or_build_index(data_json:str, index_dirs:List[str], record_ids:bool, 
+                         durations:bool)->Tuple[str, dict]:
+    """Returns the first index in `index_dirs` that is current and has the requested keys.
+    Otherwise, the index is built in the first directory that is writable.
+    """
+    metas = [_read_index_meta(index_dir) for index_dir in index_dirs]
+    for index_dir, meta in zip(index_dirs, metas):
+        if meta is not None and not _is_stale(meta, data_json) \
+                and (meta['record_ids'] or not record_ids) and (meta['durations'] or not durations):
+            return index_dir, meta
+
+    # a rebuilt index keeps the keys of the previous index
+    for meta in metas:
+        if meta is not None:
+            record_ids = record_ids or meta['record_ids']
+            durations = durations or meta['durations']
+    for i, index_dir in enumerate(index_dirs):
+        try:
+            build_manifest_index(data_json, index_dir, record_ids, durations)
+        except OSError:
+            if i == len(index_dirs) - 1:
+                raise
+            continue
+        return index_dir, _read_index_meta(index_dir)
+
+
+class JsonlManifest(Sequence):
+    """Read-only view of a JSONL manifest that parses only the rows that are accessed. The
+    manifest is memory-mapped and the rows are located with the index of `build_manifest_index`,
+    which is built if it is missing, stale, or lacks a requested key.
+
+    Args:
+        data_json (str): path to the JSONL dataset file
+        index_dir (str): directory of the index, defaults to `<data_json>.index` or, if that 
+            isn't writable, a directory in the user cache or the temp directory
+        record_ids (bool): if True, rows can be found by record id with `find_record`
+        durations (bool): if True, rows can be selected by duration with `rows_by_duration`
+    """
+
+    def __init__(self, data_json:str, index_dir:str=None, record_ids:bool=False,
+                 durations:bool=False):
+        self.data_json = data_json
+        index_dirs = [index_dir] if index_dir is not None \
+            else [default_index_dir(data_json)] + fallback_index_dirs(data_json)
+        self.index_dir, meta = _load_or_build_index(data_json, index_dirs, record_ids, durations)
+        self.has_record_ids = meta['record_ids']
+        self.has_durations = meta['durations']
+        self._num_examples = meta['num_examples']
+        self._mmap = None
+        self._arrays = None
+
+    @property
+    def arrays(self)->dict:
+        # the file and index are opened lazily so each loader worker opens its own
+        if self._arrays is None:
+            names = ["offsets"]
+            if self.has_record_ids:
+                names.extend(["id_hashes", "id_rows"])
+            if self.has_durations:
+                names.append("durations")
+            self._arrays = {
+                name: np.load(os.path.join(self.index_dir, name + ".npy"), mmap_mode='r')
+                for name in names
+            }
+        return self._arrays
+
+    @property
+    def buffer(self)->mmap.mmap:
+        if self._mmap is None:
+            with open(self.data_json, 'rb') as fid:
+                # an empty file can't be memory-mapped
+                self._mmap = mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ) \
+                    if len(self) > 0 else b''
+        return self._mmap
+
+    def __getstate__(self):
+        # the memory-maps are not pickled and are re-opened in the new process
+        state = self.__dict__.copy()
+        state['_mmap'] = None
+        state['_arrays'] = None
+        return state
+
+    def __len__(self)->int:
+        return self._num_examples
+
+    def __getitem__(self, idx:int)->dict:
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"index: {idx} out of range for manifest of size: {len(self)}")
+        offsets = self.arrays['offsets']
+        return json.loads(self.buffer[offsets[idx]:offsets[idx + 1]])
+
+    def sample(self, k:int, rng:random.Random=None)->List[dict]:
+        """Uniformly samples `k` distinct rows. The rows match `random.sample` on the list
+        of all examples with the same random state.
+        """
+        rng = random if rng is None else rng
+        return [self[idx] for idx in rng.sample(range(len(self)), k=k)]
+
+    def find_record(self, record_id:str)->Union[dict, None]:
+        """Returns the row whose audio path has the record id `record_id` or None"""
+        if not self.has_record_ids:
+            raise ValueError(f"index of {self.data_json} was built without record ids")
+        id_hashes = self.arrays['id_hashes']
+        target = _id_hash(record_id)
+        pos = int(np.searchsorted(id_hashes, target))
+        # rows with colliding hashes are checked against the record id
+        while pos < len(id_hashes) and id_hashes[pos] == target:
+            example = self[int(self.arrays['id_rows'][pos])]
+            if path_to_id(example['audio']) == record_id:
+                return example
+            pos += 1
+        return None
+
+    def rows_by_duration(self, min_duration:float, max_duration:float)->np.ndarray:
+        """Returns the indices of the rows with `min_duration <= duration < max_duration`"""
+        if not self.has_durations:
+            raise ValueError(f"index of {self.data_json} was built without durations")
+        durations = self.arrays['durations']
+        return np.flatnonzero((durations >= min_duration) & (durations < max_duration))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Converts a JSONL dataset file into a compact, memory-mapped manifest, "
+                    "or builds a byte-offset index of the JSONL file with `--index`."
+    )
+    parser.add_argument("--data-json", type=str, required=True,
+        help="Path to the JSONL dataset file.")
+    parser.add_argument("--out-dir", type=str,
+        help="Directory where the compact manifest or index will be written.")
+    parser.add_argument("--index", action='store_true', default=False,
+        help="Builds a byte-offset index instead of a compact manifest.")
+    parser.add_argument("--record-ids", action='store_true', default=False,
+        help="Adds the record ids to the index.")
+    parser.add_argument("--durations", action='store_true', default=False,
+        help="Adds the durations to the index.")
+    args = parser.parse_args()
+
+    if args.index:
+        build_manifest_index(args.data_json, args.out_dir, args.record_ids, args.durations)
+    else:
+        assert args.out_dir is not None, "--out-dir is required for a compact manifest"
+        convert_to_compact(args.data_json, args.out_dir)
@@ -41,6 +41,78 @@ def check_nan_params_grads(model_params:TorchParams)->bool:
     return False
 
 
+def total_norm(tensors:Iterable[torch.Tensor])->torch.Tensor:
+    """
+    returns the 2-norm of all the tensors as a tensor on their device, so it is computed without
+    a device sync. the norm is NaN or inf if any of the values are NaN or inf.
+    """
+    norms = [tensor.detach().float().norm(2.0) for tensor in tensors]
+    if len(norms) == 0:
+        return torch.zeros(())
+    return torch.stack(norms).norm(2.0)
+
+
+def params_nonfinite(model_params:TorchParams, check_grads:bool=False)->bool:
+    """
+    checks if any of the parameters, and gradients if `check_grads` is true, have NaN or inf
+    values with a single fused reduction and one device sync, instead of a sync per parameter
+    as in `check_nan_params_grads`
+    Arguments:
+        model_params - Iterable[torch.nn.parameter.Parameter]: output of model.parameters()
+    """
+    params = list(model_params)
+    tensors = params
+    if check_grads:
+        tensors = params + [param.grad for param in params if param.grad is not None]
+    return not torch.isfinite(total_norm(tensors)).item()
+
+
+def layer_norms(named_params:TorchNamedParams)->dict:
+    """
+    returns a dict of the 2-norms of the parameter and gradient of each named parameter, which
+    are transferred to the cpu together. parameters without a gradient have a gradient norm of 0.
+    """
+    names, norms = list(), list()
+    for name, param in named_params:
+        param_norm = param.detach().float().norm(2.0)
+        grad_norm = param.grad.detach().float().norm(2.0) if param.grad is not None \
+            else torch.zeros((), device=param.device)
+        names.append(name)
+        norms.append(torch.stack([param_norm, grad_norm]))
+    if len(norms) == 0:
+        return dict()
+    norms = torch.stack(norms).tolist()
+    return {name: {"param": param_norm, "grad": grad_norm} 
+            for name, (param_norm, grad_norm) in zip(names, norms)}
+
+
+def save_nonfinite_step(save_dir:str, iter_count:int, rank:int, batch:dict, 
+                        named_params:TorchNamedParams)->str:
+    """
+    saves the tensors of the batch in a step with NaN or inf values and the norms of every layer
+    to `save_dir` so the step can be reproduced. returns the path of the saved file.
+    Arguments:
+        batch - dict: tensors and values of the step, like the inputs, labels, and loss
+    """
+    batch = {key: value.detach().cpu() if isinstance(value, torch.Tensor) else value 
+             for key, value in batch.items()}
+    step_state = {"iter_count": iter_count, "batch": batch, "layer_norms": layer_norms(named_params)}
+    os.makedirs(save_dir, exist_ok=True)
+    save_path = os.path.join(save_dir, f"nonfinite_step_{iter_count}_rank_{rank}.pth")
+    torch.save(step_state, save_path)
+    return save_path
+
+
+def list_nonfinite_steps(save_dir:str, rank:int)->List[str]:
+    """
+    returns the paths of the steps with NaN or inf values that `rank` saved to `save_dir`
+    """
+    suffix = f"_rank_{rank}.pth"
+    if not os.path.isdir(save_dir):
+        return []
+    return sorted(os.path.join(save_dir, filename) for filename in os.listdir(save_dir)
+                  if filename.startswith("nonfinite_step_") and filename.endswith(suffix))
+
 
 def log_model_grads(named_params:TorchNamedParams, logger:Logger)->None:
     """
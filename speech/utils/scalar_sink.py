@@ -0,0 +1,199 @@
+# standard libraries
+from collections import defaultdict
+import csv
+import json
+import os
+import queue
+import threading
+import time
+from typing import Dict, List, Tuple
+# third-party libraries
+import numpy as np
+
+
+class TensorboardBackend():
+    """Writes the scalars to a tensorboardX writer with the same tags as `add_scalars`"""
+
+    def __init__(self, tbX_writer):
+        self.tbX_writer = tbX_writer
+
+    def write(self, main_tag:str, tag_scalar_dict:Dict[str, float], step:int, wall_time:float):
+        self.tbX_writer.add_scalars(main_tag, tag_scalar_dict, step, walltime=wall_time)
+
+    def flush(self):
+        self.tbX_writer.flush()
+
+    def close(self):
+        # the writer is owned and closed by the training loop
+        self.flush()
+
+
+class CSVBackend():
+    """Appends the scalars as rows of wall_time, step, main_tag, tag, and value to a csv file"""
+
+    def __init__(self, path:str):
+        write_header = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._fid = open(path, 'a', newline='')
+        self._writer = csv.writer(self._fid)
+        if write_header:
+            self._writer.writerow(["wall_time", "step", "main_tag", "tag", "value"])
+
+    def write(self, main_tag:str, tag_scalar_dict:Dict[str, float], step:int, wall_time:float):
+        for tag, value in tag_scalar_dict.items():
+            self._writer.writerow([wall_time, step, main_tag, tag, value])
+
+    def flush(self):
+        self._fid.flush()
+
+    def close(self):
+        self._fid.close()
+
+
+class JSONLBackend():
+    """Appends the scalars of each point as a json line to a file"""
+
+    def __init__(self, path:str):
+        self._fid = open(path, 'a')
+
+    def write(self, main_tag:str, tag_scalar_dict:Dict[str, float], step:int, wall_time:float):
+        point = {"wall_time": wall_time, "step": step, "main_tag": main_tag, "scalars": tag_scalar_dict}
+        self._fid.write(json.dumps(point) + "\n")
+
+    def flush(self):
+        self._fid.flush()
+
+    def close(self):
+        self._fid.close()
+
+
+def get_file_backend(path:str):
+    """Returns a csv or jsonl backend based on the extension of `path`"""
+    if path.endswith(".csv"):
+        return CSVBackend(path)
+    if path.endswith(".jsonl"):
+        return JSONLBackend(path)
+    raise ValueError(f"scalar log file: {path} must end with '.csv' or '.jsonl'")
+
+
+class ScalarSink():
+    """
+    Drop-in replacement for the `add_scalars` calls of a tensorboardX writer in the training loop.
+    The scalars are accumulated in memory and every `log_every` values of a tag are reduced to a
+    single point at the step of the last value, either their mean or the last value. The points
+    are written to the backends by a background thread every `flush_secs` seconds, so the
+    training loop doesn't wait for the disk.
+
+    Args:
+        backends (list): objects with `write`, `flush`, and `close` methods, like
+            `TensorboardBackend` and `CSVBackend`
+        log_every (int): number of values of a tag that are reduced to a single point
+        reduce (str): 'mean' to average the values or 'last' to decimate them
+        flush_secs (float): seconds between the writes of the background thread
+    """
+
+    def __init__(self, backends:list, log_every:int=100, reduce:str='mean', flush_secs:float=10.0):
+        assert reduce in ['mean', 'last'], f"reduce: {reduce} must be 'mean' or 'last'"
+        assert log_every >= 1, f"log_every: {log_every} must be at least 1"
+        self.backends = backends
+        self.log_every = log_every
+        self.reduce = reduce
+        self.flush_secs = flush_secs
+        # maps the main tag to a dict of tag to the list of (step, value) tuples
+        self._values = defaultdict(lambda: defaultdict(list))
+        self._points = queue.Queue()
+        self._closed = False
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._write_loop, name="scalar-sink", daemon=True)
+        self._thread.start()
+
+    def add_scalars(self, main_tag:str, tag_scalar_dict:Dict[str, float], global_step:int,
+                    reduce:bool=True)->None:
+        """Adds the scalars of `tag_scalar_dict` to `main_tag` with the arguments of the
+        tensorboardX writer's `add_scalars`. If `reduce` is False, the scalars are written as a
+        point without being reduced, like the summaries that are already reduced.
+        """
+        assert not self._closed, "scalar sink is closed"
+        if not reduce:
+            self._put(main_tag, {tag: (global_step, float(value)) 
+                                 for tag, value in tag_scalar_dict.items()})
+            return
+        tag_values = self._values[main_tag]
+        reduced = dict()
+        for tag, value in tag_scalar_dict.items():
+            tag_values[tag].append((global_step, float(value)))
+            if len(tag_values[tag]) >= self.log_every:
+                reduced[tag] = self._reduce(tag_values.pop(tag))
+        self._put(main_tag, reduced)
+
+    def _reduce(self, step_values:List[Tuple[int, float]])->Tuple[int, float]:
+        step = step_values[-1][0]
+        if self.reduce == 'last':
+            return step, step_values[-1][1]
+        return step, float(np.mean([value for _, value in step_values]))
+
+    def _put(self, main_tag:str, reduced:Dict[str, Tuple[int, float]])->None:
+        # the tags of a main tag reduced at the same step are written as one point
+        steps = defaultdict(dict)
+        for tag, (step, value) in reduced.items():
+            steps[step][tag] = value
+        wall_time = time.time()
+        for step, tag_scalar_dict in steps.items():
+            self._points.put((main_tag, tag_scalar_dict, step, wall_time))
+
+    def _write_loop(self)->None:
+        while True:
+            self._wake.wait(self.flush_secs)
+            self._wake.clear()
+            if not self._write_points():
+                return
+
+    def _write_points(self)->bool:
+        """Writes the queued points to the backends. Returns False if the sink was closed."""
+        running = True
+        points = list()
+        while True:
+            try:
+                point = self._points.get_nowait()
+            except queue.Empty:
+                break
+            if point is None:
+                running = False
+                self._points.task_done()
+                break
+            points.append(point)
+        try:
+            for point in points:
+                for backend in self.backends:
+                    backend.write(*point)
+            if points:
+                for backend in self.backends:
+                    backend.flush()
+        except Exception as err:
+            # a failed write loses its points but doesn't stop the training
+            print(f"scalar sink failed to write {len(points)} points: {err}")
+        finally:
+            for _ in points:
+                self._points.task_done()
+        return running
+
+    def flush(self)->None:
+        """Writes the partially accumulated values as points and waits for all the points to be
+        written to the backends
+        """
+        for main_tag, tag_values in self._values.items():
+            reduced = {tag: self._reduce(values) for tag, values in tag_values.items() if values}
+            self._put(main_tag, reduced)
+        self._values.clear()
+        self._wake.set()
+        self._points.join()
+
+    def close(self)->None:
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        self._points.put(None)
+        self._wake.set()
+        self._thread.join()
+        for backend in self.backends:
+            backend.close()
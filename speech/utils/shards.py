@@ -0,0 +1,168 @@
+# This module packs a dataset of individual audio files into large tar shards that can be
+# read sequentially. Each example is stored as two tar members that share a key:
+# `<key>.wav` (or `<key>.flac`) with the pcm16 audio and `<key>.json` with the labels and duration.
+# A `shards.json` index records the path and number of examples of every shard.
+
+# standard libraries
+import io
+import json
+import os
+import random
+import tarfile
+from typing import Generator, List
+# third-party libraries
+import numpy as np
+import soundfile
+import tqdm
+# project libraries
+from speech.utils.io import read_data_json
+from speech.utils.wave import array_from_wave
+
+
+SHARD_INDEX_NAME = "shards.json"
+SHARD_NAME = "shard-{:06d}.tar"
+AUDIO_FORMATS = {'wav': ('WAV', 'PCM_16'), 'flac': ('FLAC', 'PCM_16')}
+
+
+def write_shards(data_json:str,
+                 out_dir:str,
+                 shard_size_mb:int=256,
+                 audio_format:str='flac',
+                 shuffle:bool=True,
+                 seed:int=0)->str:
+    """Packs the audio, labels, and duration of every example in `data_json` into tar shards.
+    The examples are shuffled before writing so each shard is a random mix of the dataset.
+
+    Args:
+        data_json (str): path to the dataset json file
+        out_dir (str): directory where the shards and index will be written
+        shard_size_mb (int): approximate maximum size of a shard in megabytes
+        audio_format (str): 'wav' or 'flac', the encoding of the pcm16 audio
+        shuffle (bool): if true, the examples are shuffled before writing
+        seed (int): seed of the shuffle
+    Returns:
+        (str): path to the shard index
+    """
+    assert audio_format in AUDIO_FORMATS, \
+        f"audio_format: {audio_format} must be one of {list(AUDIO_FORMATS.keys())}"
+    os.makedirs(out_dir, exist_ok=True)
+
+    dataset = read_data_json(data_json)
+    if shuffle:
+        random.Random(seed).shuffle(dataset)
+
+    max_shard_bytes = shard_size_mb * 1024 * 1024
+    shard_list = list()
+    tar, shard_bytes, shard_count, shard_duration = None, 0, 0, 0.0
+
+    for example_idx, example in enumerate(tqdm.tqdm(dataset)):
+        if tar is None or (shard_bytes > max_shard_bytes and shard_count > 0):
+            if tar is not None:
+                tar.close()
+                shard_list[-1].update({"num_examples": shard_count, "duration": shard_duration})
+            shard_name = SHARD_NAME.format(len(shard_list))
+            shard_list.append({"path": shard_name})
+            tar = tarfile.open(os.path.join(out_dir, shard_name), 'w')
+            shard_bytes, shard_count, shard_duration = 0, 0, 0.0
+
+        audio_data, samp_rate = array_from_wave(example['audio'])
+        audio_bytes = encode_audio(audio_data, samp_rate, audio_format)
+        meta = {
+            "audio": example['audio'],
+            "text": example['text'],
+            "duration": example['duration']
+        }
+        meta_bytes = json.dumps(meta).encode('utf-8')
+
+        key = f"{example_idx:09d}"
+        _add_tar_member(tar, f"{key}.{audio_format}", audio_bytes)
+        _add_tar_member(tar, f"{key}.json", meta_bytes)
+
+        shard_bytes += len(audio_bytes) + len(meta_bytes)
+        shard_count += 1
+        shard_duration += example['duration']
+
+    if tar is not None:
+        tar.close()
+        shard_list[-1].update({"num_examples": shard_count, "duration": shard_duration})
+
+    index_path = os.path.join(out_dir, SHARD_INDEX_NAME)
+    with open(index_path, 'w') as fid:
+        json.dump({"audio_format": audio_format, "shards": shard_list}, fid)
+    print(f"{len(dataset)} examples written to {len(shard_list)} shards in: {out_dir}")
+
+    return index_path
+
+
+def _add_tar_member(tar:tarfile.TarFile, name:str, data:bytes)->None:
+    info = tarfile.TarInfo(name=name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def encode_audio(audio_data:np.ndarray, samp_rate:int, audio_format:str)->bytes:
+    """Encodes the pcm16 audio array into wav or flac bytes
+    """
+    file_format, subtype = AUDIO_FORMATS[audio_format]
+    buffer = io.BytesIO()
+    soundfile.write(buffer, audio_data, samp_rate, subtype=subtype, format=file_format)
+    return buffer.getvalue()
+
+
+def decode_audio(audio_bytes:bytes)->tuple:
+    """Decodes wav or flac bytes into a pcm16 audio array and sample rate
+    """
+    audio_data, samp_rate = soundfile.read(io.BytesIO(audio_bytes), dtype='int16')
+    return audio_data, samp_rate
+
+
+def read_shard_index(index_path:str)->List[dict]:
+    """Returns the list of shards with absolute paths from the shard index
+    """
+    with open(index_path, 'r') as fid:
+        index = json.load(fid)
+    shard_dir = os.path.dirname(os.path.abspath(index_path))
+    shards = index['shards']
+    for shard in shards:
+        shard['path'] = os.path.join(shard_dir, shard['path'])
+    return shards
+
+
+def iterate_shard(shard_path:str)->Generator[dict, None, None]:
+    """Streams the examples in a shard sequentially. Each example is a dict with the keys of the
+    dataset json and an `audio_bytes` key with the encoded audio that can be read by `decode_audio`.
+    """
+    example = dict()
+    # the 'r|' mode reads the tar file as a stream without seeking
+    with tarfile.open(shard_path, 'r|') as tar:
+        for member in tar:
+            key, ext = os.path.splitext(member.name)
+            data = tar.extractfile(member).read()
+            if example and example['key'] != key:
+                yield example
+                example = dict()
+            example['key'] = key
+            if ext == '.json':
+                example.update(json.loads(data.decode('utf-8')))
+            else:
+                example['audio_bytes'] = data
+        if example:
+            yield example
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Packs a dataset json and its audio files into tar shards."
+    )
+    parser.add_argument("--data-json", type=str, required=True,
+        help="Path to the dataset json file.")
+    parser.add_argument("--out-dir", type=str, required=True,
+        help="Directory where the shards will be written.")
+    parser.add_argument("--shard-size-mb", type=int, default=256,
+        help="Approximate maximum size of a shard in megabytes.")
+    parser.add_argument("--audio-format", type=str, default='flac', choices=list(AUDIO_FORMATS.keys()),
+        help="Encoding of the audio in the shards.")
+    args = parser.parse_args()
+
+    write_shards(args.data_json, args.out_dir, args.shard_size_mb, args.audio_format)
@@ -1,17 +1,22 @@
 # standard libraries
 import argparse
 import audioop
+from fractions import Fraction
 import glob
+import hashlib
+import json
 import logging
 from logging import Logger
 import os
 import random
 import subprocess
 import shutil
+import tempfile
 from tempfile import NamedTemporaryFile
-from typing import Tuple
+from typing import Tuple, Union
 # third-party libraries
 import numpy as np
+import scipy.signal
 import scipy.stats      # need to include "stats" to aviod name-conflict
 import yaml
 # project libraries
@@ -76,7 +81,8 @@ def apply_augmentation(audio_path:str, preproc_cfg:dict, logger:Logger)\
                                             gain_range = preproc_cfg['gain_range'],
                                             pitch_range = preproc_cfg['pitch_range'],
                                             augment_from_normal = preproc_cfg['augment_from_normal'],
-                                            logger= logger)
+                                            logger= logger,
+                                            engine = preproc_cfg.get('tempo_gain_pitch_engine', 'sox'))
         else:
             aug_data, samp_rate = array_from_wave(audio_path)
     else: 
@@ -104,16 +110,20 @@ def apply_augmentation(audio_path:str, preproc_cfg:dict, logger:Logger)\
 # Sean Naren's Deepspeech implementation at:
 # https://github.com/SeanNaren/deepspeech.pytorch/blob/master/data/data_loader.py
 
-def tempo_gain_pitch_perturb(audio_path:str, sample_rate:int=16000, 
+def tempo_gain_pitch_perturb(audio_path:Union[str, np.ndarray], sample_rate:int=16000, 
                             tempo_range:AugmentRange=(0.85, 1.15),
                             gain_range:AugmentRange=(-6.0, 8.0),
                             pitch_range:AugmentRange=(-400, 400),
                             augment_from_normal:bool=False,
-                            logger=None)->Tuple[np.ndarray, int]:
+                            logger=None,
+                            engine:str='sox')->Tuple[np.ndarray, int]:
     """
     Picks tempo and gain uniformly, applies it to the utterance by using sox utility.
     Arguments:
+        audio_path - str or np.ndarray: path to the audio file or pcm16 audio array
         augment_from_normal - bool: if true, the augmentation values will be drawn from normal dist
+        engine - str: 'sox' runs the sox utility in a subprocess, 'numpy' augments the audio
+            in-process with `augment_audio_with_numpy`
     Returns:
         tuple(np.ndarray, int) - the augmente audio data and the sample_rate
     """
@@ -131,28 +141,47 @@ def tempo_gain_pitch_perturb(audio_path:str, sample_rate:int=16000,
         gain_value = np.random.uniform(*gain_range)
         pitch_value = np.random.uniform(*pitch_range)
 
-    if use_log: logger.info(f"tempo_gain_pitch_perturb: audio_file: {audio_path}")
+    if use_log and isinstance(audio_path, str): 
+        logger.info(f"tempo_gain_pitch_perturb: audio_file: {audio_path}")
     if use_log: logger.info(f"tempo_gain_pitch_perturb: tempo_value: {tempo_value}")
     if use_log: logger.info(f"tempo_gain_pitch_perturb: gain_value: {gain_value}")
     if use_log: logger.info(f"tempo_gain_pitch_perturb: pitch_value: {pitch_value}")
 
+    if engine == 'numpy':
+        if isinstance(audio_path, str):
+            audio_data, sample_rate = array_from_wave(audio_path)
+        else:
+            audio_data = audio_path
+        audio_data = augment_audio_with_numpy(audio_data, sample_rate, tempo_value, 
+                                                gain_value, pitch_value)
+        return audio_data, sample_rate
+    assert engine == 'sox', f"engine: {engine} must be either 'sox' or 'numpy'"
+
     try:    
         audio_data, samp_rate = augment_audio_with_sox(audio_path, sample_rate, tempo_value, 
                                                         gain_value, pitch_value, logger=logger)
     except RuntimeError as rterr:
         if use_log: logger.error(f"tempo_gain_pitch_perturb: RuntimeError: {rterr}")
-        audio_data, samp_rate = array_from_wave(audio_path)
+        if isinstance(audio_path, np.ndarray):
+            audio_data, samp_rate = audio_path, sample_rate
+        else:
+            audio_data, samp_rate = array_from_wave(audio_path)
         
     return audio_data, samp_rate 
 
 
-def augment_audio_with_sox(path:str, sample_rate:int, tempo:float, gain:float, 
+def augment_audio_with_sox(path:Union[str, np.ndarray], sample_rate:int, tempo:float, gain:float, 
                             pitch:float, logger=None)->Tuple[np.ndarray,int]:
     """
     Changes tempo, gain (volume), and pitch of the recording with sox and loads it.
+    If `path` is an audio array, it is written to a temporary file that sox reads.
     """
     use_log = (logger is not None)
-    with NamedTemporaryFile(suffix=".wav") as augmented_file:
+    with NamedTemporaryFile(suffix=".wav") as augmented_file, \
+         NamedTemporaryFile(suffix=".wav") as input_file:
+        if isinstance(path, np.ndarray):
+            array_to_wave(input_file.name, path, sample_rate)
+            path = input_file.name
         augmented_filename = augmented_file.name
         sox_cmd = ['sox', '-V3',                # verbosity level = 3
                     path,                       # file to augment
@@ -181,21 +210,107 @@ def augment_audio_with_sox(path:str, sample_rate:int, tempo:float, gain:float,
         return data, samp_rate
 
 
+# maximum denominator of the pitch-shift resampling ratio, roughly a 2 cent resolution
+PITCH_MAX_DENOMINATOR = 1000
+
+def augment_audio_with_numpy(audio_data:np.ndarray, sample_rate:int, tempo:float, gain:float, 
+                                pitch:float)->np.ndarray:
+    """
+    Changes the tempo, gain (in dB), and pitch (in hundredths of a semi-tone) of the pcm16 audio 
+    in-process with the same parameter semantics as `augment_audio_with_sox`. 
+    The pitch is shifted by resampling the audio and the change in duration from the resampling 
+    is undone in the same WSOLA time-stretch that changes the tempo.
+    Returns:
+        np.ndarray: the augmented pcm16 audio
+    """
+    audio = audio_data.astype(np.float64)
+    if audio.ndim > 1:
+        audio = audio.mean(axis=1)
+
+    # rational approximation of the resampling ratio that shifts the pitch
+    pitch_ratio = Fraction(2 ** (-pitch / 1200)).limit_denominator(PITCH_MAX_DENOMINATOR)
+    pitch_factor = pitch_ratio.denominator / pitch_ratio.numerator
+    
+    audio = wsola_tempo(audio, sample_rate, tempo / pitch_factor)
+    if pitch_ratio != 1:
+        audio = scipy.signal.resample_poly(audio, pitch_ratio.numerator, pitch_ratio.denominator)
+    
+    audio *= 10 ** (gain / 20)
+    return np.clip(np.round(audio), -2**15, 2**15 - 1).astype(np.int16)
+
+
+def wsola_tempo(audio:np.ndarray, sample_rate:int, tempo:float, frame_ms:float=30.0, 
+                search_ms:float=10.0)->np.ndarray:
+    """
+    Changes the tempo of the audio without changing the pitch using waveform-similarity 
+    overlap-add (WSOLA). Windowed frames are read from the input every `frame/2 * tempo` samples
+    and overlap-added every `frame/2` samples. Each frame is shifted by up to `search_ms` to 
+    maximize its cross-correlation with the natural continuation of the previous frame, 
+    which avoids phase discontinuities.
+    Arguments:
+        audio - np.ndarray: 1d float audio array
+        tempo - float: ratio of the output tempo to the input tempo, the output has 
+            `len(audio) / tempo` samples
+        frame_ms - float: length of the overlap-add frames in milliseconds
+        search_ms - float: maximum shift of each frame in milliseconds
+    Returns:
+        np.ndarray: 1d float audio array
+    """
+    assert tempo > 0, f"tempo: {tempo} must be positive"
+    if tempo == 1.0:
+        return audio.copy()
+    
+    frame_len = int(frame_ms * sample_rate / 1000) // 2 * 2
+    hop = frame_len // 2
+    search = int(search_ms * sample_rate / 1000)
+    out_len = int(round(len(audio) / tempo))
+    if len(audio) < frame_len or out_len < frame_len:
+        # too short to stretch the frames, so the audio is resampled instead
+        return scipy.signal.resample(audio, max(out_len, 1)) if len(audio) > 1 else audio.copy()
+
+    # periodic hann windows with half overlap sum to one
+    window = np.hanning(frame_len + 1)[:-1]
+    n_frames = int(np.ceil(out_len / hop)) + 1
+    # the padding allows the frames and search regions to extend beyond the audio
+    padded = np.pad(audio, (search, frame_len + search + int(np.ceil(n_frames * hop * tempo))))
+    output = np.zeros((n_frames + 1) * hop)
+
+    prev_pos = 0
+    for k in range(n_frames):
+        nominal_pos = int(round(k * hop * tempo))
+        if k == 0:
+            pos = nominal_pos
+        else:
+            # the continuation of the previous frame that would overlap with this frame
+            target = padded[search + prev_pos + hop: search + prev_pos + hop + hop]
+            region = padded[nominal_pos: nominal_pos + 2 * search + hop]
+            xcorr = np.correlate(region, target, mode='valid')
+            pos = nominal_pos - search + int(np.argmax(xcorr))
+        output[k * hop: k * hop + frame_len] += window * padded[search + pos: search + pos + frame_len]
+        prev_pos = pos
+
+    return output[:out_len]
+
+
 # Noise inject functions
 def inject_noise(data, data_samp_rate, noise_dir, noise_levels=(0, 0.5), 
-                    augment_from_normal:bool=False, logger=None):
+                    augment_from_normal:bool=False, logger=None, noise_bank=None):
     """
     injects noise from files in noise_dir into the input data. These
     methods require the noise files in noise_dir be resampled to 16kHz
     Arguments:
         augment_from_normal - bool: if true, augment value selected from normal distribution
-
-
+        noise_bank - NoiseBank: if not None, the noise is cropped from the preloaded noise bank
+            instead of reading the files in noise_dir with sox
     """
     use_log = (logger is not None)
-    pattern = os.path.join(noise_dir, "*.wav")
-    noise_files = glob.glob(pattern)    
-    noise_path = np.random.choice(noise_files)
+    if noise_bank is not None:
+        noise_idx = np.random.randint(len(noise_bank))
+        noise_path = noise_bank.noise_files[noise_idx]
+    else:
+        pattern = os.path.join(noise_dir, "*.wav")
+        noise_files = glob.glob(pattern)    
+        noise_path = np.random.choice(noise_files)
     if augment_from_normal:
         noise_level = get_value_from_truncnorm(center=0.0, value_range=noise_levels, bounds=noise_levels)
     else:
@@ -204,6 +319,8 @@ def inject_noise(data, data_samp_rate, noise_dir, noise_levels=(0, 0.5),
     if use_log: logger.info(f"noise_inj: noise_path: {noise_path}")
     if use_log: logger.info(f"noise_inj: noise_level: {noise_level}")
 
+    if noise_bank is not None:
+        return noise_bank.inject(data, data_samp_rate, noise_idx, noise_level, logger)
     return inject_noise_sample(data, data_samp_rate, noise_path, noise_level, logger)
 
 
@@ -231,21 +348,142 @@ def inject_noise_sample(data, sample_rate:int, noise_path:str, noise_level:float
             return data
 
         noise_dst = same_size(data, noise_dst)
-        # convert to float to avoid value integer overflow in .dot() operation
-        noise_dst = noise_dst.astype('float64')
-        data = data.astype('float64')
         assert len(data) == len(noise_dst), f"data len: {len(data)}, noise len: {len(noise_dst)}, data size: {data.size}, noise size: {noise_dst.size}, noise_path: {noise_path}"
-        
-        noise_rms = np.sqrt(noise_dst.dot(noise_dst) / noise_dst.size)
-        # avoid dividing by zero
-        if noise_rms != 0:
-            data_rms = np.sqrt(np.abs(data.dot(data)) / data.size)
-            data += noise_level * noise_dst * data_rms / noise_rms
 
         if use_log: logger.info(f"noise_inj: noise_start: {noise_start}")
         if use_log: logger.info(f"noise_inj: noise_end: {noise_end}")
 
-        return data.astype('int16')
+        return mix_noise(data, noise_dst, noise_level)
+
+
+def mix_noise(data:np.ndarray, noise_dst:np.ndarray, noise_level:float)->np.ndarray:
+    """
+    Adds the noise to the data scaled so the ratio of the noise rms to the data rms is noise_level
+    """
+    # convert to float to avoid value integer overflow in .dot() operation
+    noise_dst = noise_dst.astype('float64')
+    data = data.astype('float64')
+    
+    noise_rms = np.sqrt(noise_dst.dot(noise_dst) / noise_dst.size)
+    # avoid dividing by zero
+    if noise_rms != 0:
+        data_rms = np.sqrt(np.abs(data.dot(data)) / data.size)
+        data += noise_level * noise_dst * data_rms / noise_rms
+
+    return data.astype('int16')
+
+
+class NoiseBank():
+    """
+    Loads every wav file in noise_dir once, resampled to sample_rate, into a single contiguous
+    pcm16 array with a table of the offset and length of each file. The array is written to a 
+    .npy file in cache_dir and opened as a read-only memory-map, so all dataloader workers 
+    share the same pages and noise segments are cropped by slicing instead of calling sox.
+    Arguments:
+        noise_dir - str: directory of the noise wav files
+        sample_rate - int: sample rate of the audio the noise is injected into
+        cache_dir - str: directory of the noise-bank file, the system temp directory if None
+    """
+
+    def __init__(self, noise_dir:str, sample_rate:int=16000, cache_dir:str=None):
+        self.noise_dir = noise_dir
+        self.sample_rate = sample_rate
+        self.noise_files = sorted(glob.glob(os.path.join(noise_dir, "*.wav")))
+        assert len(self.noise_files) > 0, f"no wav files found in noise_dir: {noise_dir}"
+        
+        if cache_dir is None:
+            cache_dir = tempfile.gettempdir()
+        self.bank_path = os.path.join(cache_dir, f"noise_bank_{self._bank_key()}.npy")
+        self.offsets, self.lengths = self._build()
+        self._audio = None
+
+    def _bank_key(self)->str:
+        """Hash of the noise files and sample rate that identifies the noise-bank file
+        """
+        hasher = hashlib.md5()
+        hasher.update(str(self.sample_rate).encode('utf-8'))
+        for noise_file in self.noise_files:
+            stat = os.stat(noise_file)
+            hasher.update(f"{os.path.abspath(noise_file)}:{stat.st_size}:{stat.st_mtime}".encode('utf-8'))
+        return hasher.hexdigest()
+
+    def _build(self)->Tuple[np.ndarray, np.ndarray]:
+        """Writes the noise-bank file if it doesn't exist and returns the offset table
+        """
+        table_path = self.bank_path.replace(".npy", ".json")
+        if not (os.path.exists(self.bank_path) and os.path.exists(table_path)):
+            os.makedirs(os.path.dirname(self.bank_path), exist_ok=True)
+            noise_list = [self._load_noise(noise_file) for noise_file in self.noise_files]
+            lengths = [noise.size for noise in noise_list]
+            # the files are written with unique names and then renamed so concurrent 
+            # processes building the same bank never read a partial file
+            tmp_suffix = f".{os.getpid()}.tmp"
+            with open(self.bank_path + tmp_suffix, 'wb') as fid:
+                np.save(fid, np.concatenate(noise_list).astype(np.int16))
+            with open(table_path + tmp_suffix, 'w') as fid:
+                json.dump({"noise_files": self.noise_files, "lengths": lengths}, fid)
+            os.replace(self.bank_path + tmp_suffix, self.bank_path)
+            os.replace(table_path + tmp_suffix, table_path)
+        
+        with open(table_path, 'r') as fid:
+            lengths = np.array(json.load(fid)['lengths'], dtype=np.int64)
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        return offsets, lengths
+
+    def _load_noise(self, noise_file:str)->np.ndarray:
+        noise, samp_rate = array_from_wave(noise_file)
+        if noise.ndim > 1:
+            noise = noise.mean(axis=1)
+        if samp_rate != self.sample_rate:
+            noise = scipy.signal.resample_poly(noise.astype(np.float64), self.sample_rate, samp_rate)
+            noise = np.clip(np.round(noise), -2**15, 2**15 - 1)
+        return noise.astype(np.int16)
+
+    @property
+    def audio(self)->np.ndarray:
+        # the memory-map is opened lazily so each dataloader worker opens its own
+        if self._audio is None:
+            # a pickled bank may be loaded where its file doesn't exist
+            if not os.path.exists(self.bank_path):
+                self.offsets, self.lengths = self._build()
+            self._audio = np.load(self.bank_path, mmap_mode='r')
+        return self._audio
+
+    def __len__(self)->int:
+        return len(self.noise_files)
+
+    def __getstate__(self):
+        # the memory-map is not pickled and is re-opened in the new process
+        state = self.__dict__.copy()
+        state['_audio'] = None
+        return state
+
+    def crop(self, noise_idx:int, num_samples:int)->np.ndarray:
+        """
+        Returns a random segment of num_samples from the noise file at noise_idx, or None if 
+        the noise file is shorter than num_samples
+        """
+        noise_len = self.lengths[noise_idx]
+        if num_samples > noise_len:
+            return None
+        start = self.offsets[noise_idx] + np.random.randint(noise_len - num_samples + 1)
+        return self.audio[start: start + num_samples]
+
+    def inject(self, data:np.ndarray, sample_rate:int, noise_idx:int, noise_level:float, 
+                logger=None)->np.ndarray:
+        """
+        Adds a random segment of the noise file at noise_idx to the data in proportion to 
+        noise_level. Like `inject_noise_sample`, the data is returned unchanged if the noise 
+        file is shorter than the data.
+        """
+        use_log = (logger is not None)
+        assert sample_rate == self.sample_rate, \
+            f"data sample rate: {sample_rate} doesn't match noise bank rate: {self.sample_rate}"
+        noise_dst = self.crop(noise_idx, data.size)
+        if noise_dst is None:
+            if use_log: logger.info(f"noise_inj: noise file shorter than data, skipping")
+            return data
+        return mix_noise(data, noise_dst, noise_level)
 
 
 def audio_with_sox(path:str, sample_rate:int, start_time:float, end_time:float, logger=None)\
@@ -0,0 +1,156 @@
+# standard libraries
+from collections import defaultdict
+import json
+import os
+import time
+from typing import Dict, Tuple
+# third-party libraries
+import numpy as np
+import torch
+# project libraries
+from speech.utils.scalar_sink import ScalarSink
+
+
+class _NullPhase():
+    """Context manager that does nothing, returned by a disabled profiler"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _PhaseTimer():
+
+    def __init__(self, profiler:'StepProfiler', name:str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = self.profiler.clock()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, self.profiler.clock())
+        return False
+
+
+class StepProfiler():
+    """
+    Times the phases of the training steps, like the data wait, forward, and backward passes.
+    Every `log_every` steps, the time per step and the highest percentile of each phase's
+    duration are written to the tensorboard writer as `profile/per_step` and `profile/p<pct>`,
+    with the phases as the tags, so each is a single chart. The phases of the steps in 
+    `trace_steps` are also written as a Chrome trace to `trace_path`, which can be opened in 
+    chrome://tracing or Perfetto.
+
+    When the profiler is disabled, `phase` returns a shared no-op context manager, so the
+    instrumented training loop has almost no overhead.
+
+    Args:
+        enabled (bool): if False, nothing is timed or recorded
+        log_every (int): number of steps between the percentile summaries
+        percentiles (tuple): percentiles of the phase durations in the summaries
+        trace_steps (tuple): first and last (exclusive) step of the Chrome trace window
+        trace_path (str): path where the Chrome trace json is written
+        synchronize (bool): if True, waits for the cuda kernels at the end of each phase so
+            the gpu time is attributed to the phase that launched it
+    """
+
+    def __init__(self, enabled:bool=True, log_every:int=100, percentiles:tuple=(50, 90, 99),
+                 trace_steps:Tuple[int, int]=None, trace_path:str=None, synchronize:bool=False):
+        self.enabled = enabled
+        self.log_every = log_every
+        self.percentiles = percentiles
+        self.trace_steps = trace_steps
+        self.trace_path = trace_path
+        self.synchronize = enabled and synchronize and torch.cuda.is_available()
+        assert trace_steps is None or trace_path is not None, "trace_steps require a trace_path"
+        self.durations = defaultdict(list)
+        self.trace_events = list()
+        self.step = 0
+        self._steps_since_log = 0
+        self._time_origin = time.perf_counter()
+
+    def clock(self)->float:
+        if self.synchronize:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def phase(self, name:str):
+        """Returns a context manager that times the code in its block as the phase `name`"""
+        if not self.enabled:
+            return _NULL_PHASE
+        return _PhaseTimer(self, name)
+
+    def record(self, name:str, start:float, end:float)->None:
+        """Records a phase from its `start` and `end` times from `clock`"""
+        if not self.enabled:
+            return
+        self.durations[name].append(end - start)
+        if self.in_trace_window():
+            self.trace_events.append({
+                "name": name,
+                "ph": "X",
+                "ts": (start - self._time_origin) * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": os.getpid(),
+                "tid": 0,
+                "args": {"step": self.step}
+            })
+
+    def in_trace_window(self)->bool:
+        return self.trace_steps is not None and self.trace_steps[0] <= self.step < self.trace_steps[1]
+
+    def start_step(self, step:int)->None:
+        self.step = step
+
+    def end_step(self, tbX_writer=None)->Dict[str, Dict[str, float]]:
+        """Ends the current step. Returns the summary of the phase durations, which is written
+        to `tbX_writer` if it's not None, every `log_every` steps and None otherwise. 
+        `tbX_writer` can be a `ScalarSink`, which writes the summaries without reducing them.
+        """
+        if not self.enabled:
+            return None
+        if self.trace_steps is not None and self.step == self.trace_steps[1] - 1:
+            self.write_trace()
+
+        self._steps_since_log += 1
+        if self._steps_since_log < self.log_every:
+            return None
+        summary = self.summary()
+        if tbX_writer is not None:
+            write_kwargs = {"reduce": False} if isinstance(tbX_writer, ScalarSink) else dict()
+            # each tag of `add_scalars` has its own event-file writer, so only two stats are 
+            # written. the full summary is returned.
+            for stat in ["per_step", f"p{max(self.percentiles)}"]:
+                stat_dict = {name: stats[stat] for name, stats in summary.items()}
+                tbX_writer.add_scalars(f"profile/{stat}", stat_dict, self.step, **write_kwargs)
+        self.durations.clear()
+        self._steps_since_log = 0
+        return summary
+
+    def summary(self)->Dict[str, Dict[str, float]]:
+        """Returns the mean, percentiles, and total per step of each phase in milliseconds"""
+        summary = dict()
+        for name, durations in self.durations.items():
+            durations_ms = np.array(durations) * 1000
+            stats = {"mean": float(durations_ms.mean())}
+            for pct, value in zip(self.percentiles, np.percentile(durations_ms, self.percentiles)):
+                stats[f"p{pct}"] = float(value)
+            stats["per_step"] = float(durations_ms.sum() / max(self._steps_since_log, 1))
+            summary[name] = stats
+        return summary
+
+    def write_trace(self)->None:
+        trace_dir = os.path.dirname(self.trace_path)
+        if trace_dir:
+            os.makedirs(trace_dir, exist_ok=True)
+        with open(self.trace_path + ".tmp", 'w') as fid:
+            json.dump({"traceEvents": self.trace_events, "displayTimeUnit": "ms"}, fid)
+        os.replace(self.trace_path + ".tmp", self.trace_path)
+        self.trace_events = list()
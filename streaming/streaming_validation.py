@@ -14,6 +14,7 @@ import wave
 import speech
 from speech.loader import log_spectrogram_from_data, log_spectrogram_from_file
 from speech.models.ctc_decoder import decode as ctc_decode
+from speech.models.greedy_decoder import greedy_decode
 from speech.models.ctc_model import CTC
 from speech.utils.compat import normalize
 from speech.utils.convert import to_numpy
@@ -1026,18 +1027,9 @@ class Audio(object):
 
 
 def max_decode(output, blank=39):
-    # find the argmax of each label at each timestep. the label dimension is reduced. 
-    pred = np.argmax(output, 1)
-    # initialize the sequence as an empty list of the first prediction is blank index
-    prev = pred[0]
-    seq = [prev] if prev != blank else []
-    # iterate through the predictions and condense repeated predictions
-    for p in pred[1:]:
-        if p != blank and p != prev:
-            seq.append(p)
-        prev = p
-    
-    return seq
+    """Returns the greedy prediction from the (time x vocab) output of a single utterance"""
+    labels, _, _ = greedy_decode(output[None], blank=blank)
+    return labels[0].tolist()
 
 
 if __name__ == '__main__':
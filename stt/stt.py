@@ -25,6 +25,7 @@ from tqdm import tqdm
 # project libs
 from speech.utils.data_helpers import get_record_ids_map, path_to_id, process_text
 from speech.utils.io import read_data_json, write_data_json
+from speech.utils.manifest import load_manifest
 
 # not sure if there is a better way to do this.
 # without this var-declaration, `set_global_client` throws NameError
@@ -172,7 +173,8 @@ def stt_on_sample(
     random.seed(0)
     SAMPLE_SIZE = 100
 
-    data = read_data_json(data_path)
+    # only the sampled rows of the manifest are parsed
+    data = load_manifest(data_path, indexed=True)
     data_sample = random.choices(data, k=SAMPLE_SIZE)
     print(f"sampling {len(data_sample)} samples from {data_path}")
 
@@ -0,0 +1,55 @@
+# standard libraries
+import argparse
+import shutil
+import time
+# third-party libraries
+import numpy as np
+# project libraries
+from speech.utils.io import read_data_json
+from speech.utils.signal_augment import tempo_gain_pitch_perturb
+from speech.utils.wave import array_from_wave
+
+
+def main(data_json:str, num_examples:int, tempo_range:list, gain_range:list, pitch_range:list):
+    """
+    Times the 'sox' and 'numpy' engines of `tempo_gain_pitch_perturb` on the same audio arrays
+    with the same augmentation values.
+    """
+    dataset = read_data_json(data_json)[:num_examples]
+    audio_list = [array_from_wave(example['audio']) for example in dataset]
+    total_duration = sum(audio.shape[0] / samp_rate for audio, samp_rate in audio_list)
+    print(f"benchmarking {len(audio_list)} examples with {total_duration:.1f} seconds of audio")
+
+    engines = ['numpy']
+    if shutil.which('sox') is not None:
+        engines.append('sox')
+    else:
+        print("sox is not installed, only the numpy engine is timed")
+
+    for engine in engines:
+        # the same seed draws the same tempo, gain, and pitch values for each engine
+        np.random.seed(0)
+        start_time = time.time()
+        for audio, samp_rate in audio_list:
+            tempo_gain_pitch_perturb(audio, samp_rate, tempo_range, gain_range, pitch_range,
+                                        engine=engine)
+        elapsed = time.time() - start_time
+        print(f"engine: {engine}, total: {elapsed:.2f} s, "
+              f"per example: {1000 * elapsed / len(audio_list):.2f} ms, "
+              f"real-time factor: {total_duration / elapsed:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the sox and numpy tempo, gain, and pitch augmentation."
+    )
+    parser.add_argument("--data-json", type=str, required=True,
+        help="Path to the dataset json file.")
+    parser.add_argument("--num-examples", type=int, default=200,
+        help="Number of examples to augment.")
+    parser.add_argument("--tempo-range", type=float, nargs=2, default=[0.85, 1.15])
+    parser.add_argument("--gain-range", type=float, nargs=2, default=[-6.0, 8.0])
+    parser.add_argument("--pitch-range", type=float, nargs=2, default=[-400, 400])
+    args = parser.parse_args()
+
+    main(args.data_json, args.num_examples, args.tempo_range, args.gain_range, args.pitch_range)
@@ -0,0 +1,53 @@
+# standard libraries
+import pickle
+import random
+# third-party libraries
+import numpy as np
+# project libraries
+from speech.loader import AudioDataset, Preprocessor
+from speech.utils.io import read_data_json
+from speech.utils.manifest import CompactManifest, convert_to_compact, load_manifest
+from tests.pytest.utils import get_preproc_cfg, write_synthetic_dataset
+
+
+def test_compact_manifest_round_trip(tmp_path):
+    """
+    every example of the compact manifest should equal the JSONL example
+    """
+    data_json = write_synthetic_dataset(str(tmp_path), num_examples=20)
+    manifest_dir = convert_to_compact(data_json, str(tmp_path / "compact"))
+    manifest = load_manifest(manifest_dir)
+    dataset = read_data_json(data_json)
+
+    assert isinstance(manifest, CompactManifest)
+    assert len(manifest) == len(dataset)
+    assert list(manifest) == dataset
+    assert manifest[-1] == dataset[-1]
+    np.testing.assert_array_equal(manifest.durations, [xmpl['duration'] for xmpl in dataset])
+    np.testing.assert_array_equal(manifest.label_lens, [len(xmpl['text']) for xmpl in dataset])
+    assert random.Random(0).sample(manifest, k=5) == random.Random(0).sample(dataset, k=5)
+
+    loaded_manifest = pickle.loads(pickle.dumps(manifest))
+    assert loaded_manifest._arrays is None
+    assert loaded_manifest[3] == dataset[3]
+
+
+def test_dataset_and_preproc_accept_compact(tmp_path):
+    """
+    the audio dataset and preprocessor should be the same from the JSONL or compact manifest
+    """
+    data_json = write_synthetic_dataset(str(tmp_path), num_examples=20)
+    manifest_dir = convert_to_compact(data_json, str(tmp_path / "compact"))
+
+    json_preproc = Preprocessor(data_json, get_preproc_cfg())
+    compact_preproc = Preprocessor(manifest_dir, get_preproc_cfg())
+    assert compact_preproc.int_to_char == json_preproc.int_to_char
+    
+    json_dataset = AudioDataset(data_json, json_preproc, batch_size=2)
+    compact_dataset = AudioDataset(manifest_dir, json_preproc, batch_size=2)
+    assert len(compact_dataset) == len(json_dataset)
+    assert list(compact_dataset.data) == json_dataset.data
+    features, targets = compact_dataset[0]
+    json_features, json_targets = json_dataset[0]
+    np.testing.assert_array_equal(features, json_features)
+    assert targets == json_targets
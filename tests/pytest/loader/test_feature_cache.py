@@ -0,0 +1,106 @@
+# standard libraries
+import shutil
+# third-party libraries
+import numpy as np
+import pytest
+# project libraries
+from speech.loader import AudioDataset, Preprocessor
+from speech.utils.feature_cache import build_feature_cache, FeatureCache, open_feature_cache
+from tests.pytest.utils import get_preproc_cfg, write_synthetic_dataset
+
+
+def test_cache_matches_preprocess(tmp_path):
+    """
+    the features read from the cache should equal the features computed by the preprocessor
+    """
+    data_json = write_synthetic_dataset(str(tmp_path))
+    preproc = Preprocessor(data_json, get_preproc_cfg())
+    cache_path = build_feature_cache(data_json, preproc, str(tmp_path / "cache"), num_workers=2)
+
+    dataset = AudioDataset(data_json, preproc, batch_size=2, feature_cache=FeatureCache(cache_path))
+    for idx in range(len(dataset)):
+        datum = dataset.data[idx]
+        assert dataset.use_feature_cache(datum['audio'])
+        cached_features, cached_targets = dataset[idx]
+        features, targets = preproc.preprocess(datum['audio'], datum['text'])
+        np.testing.assert_array_equal(cached_features, features)
+        assert cached_targets == targets
+
+
+def test_float16_cache_and_small_shards(tmp_path):
+    """
+    a float16 cache written into many small shards should be close to the float32 features
+    """
+    data_json = write_synthetic_dataset(str(tmp_path))
+    preproc = Preprocessor(data_json, get_preproc_cfg())
+    cache_path = build_feature_cache(data_json, preproc, str(tmp_path / "cache"), dtype='float16',
+                                        shard_size_mb=0, num_workers=1)
+    cache = FeatureCache(cache_path)
+    assert len(cache.shard_files) == len(cache)
+
+    dataset = AudioDataset(data_json, preproc, batch_size=2)
+    for datum in dataset.data:
+        features = cache[datum['audio']]
+        assert features.dtype == np.float32
+        ref_features, _ = preproc.preprocess(datum['audio'], datum['text'])
+        np.testing.assert_allclose(features, ref_features, rtol=1e-2, atol=1e-2)
+
+
+def test_cache_not_used_with_augmentation(tmp_path):
+    """
+    the cache is keyed by the mean and std and is skipped if augmentation is on
+    """
+    data_json = write_synthetic_dataset(str(tmp_path))
+    preproc = Preprocessor(data_json, get_preproc_cfg())
+    cache_dir = str(tmp_path / "cache")
+    assert open_feature_cache(cache_dir, data_json, preproc) is None
+
+    build_feature_cache(data_json, preproc, cache_dir, num_workers=1)
+    cache = open_feature_cache(cache_dir, data_json, preproc)
+    assert cache is not None
+    
+    dataset = AudioDataset(data_json, preproc, batch_size=2, feature_cache=cache)
+    audio_path = dataset.data[0]['audio']
+    preproc.spec_augment = True
+    assert not dataset.use_feature_cache(audio_path)
+    preproc.set_eval()
+    assert dataset.use_feature_cache(audio_path)
+
+    # a different mean leads to a different cache
+    preproc.mean = preproc.mean + 1.0
+    assert open_feature_cache(cache_dir, data_json, preproc) is None
+
+
+def test_cache_keyed_on_manifest_path(tmp_path):
+    """
+    manifests with the same file name in different directories should get separate caches,
+    and a cache should not be used for another or a changed manifest
+    """
+    cv_json = write_synthetic_dataset(str(tmp_path / "cv"), num_examples=4, seed=0)
+    ted_json = write_synthetic_dataset(str(tmp_path / "ted"), num_examples=4, seed=1)
+    preproc = Preprocessor(cv_json, get_preproc_cfg())
+    cache_dir = str(tmp_path / "cache")
+
+    cv_path = build_feature_cache(cv_json, preproc, cache_dir, num_workers=1)
+    ted_path = build_feature_cache(ted_json, preproc, cache_dir, num_workers=1)
+    assert cv_path != ted_path
+    ted_dataset = AudioDataset(ted_json, preproc, batch_size=2,
+                                feature_cache=open_feature_cache(cache_dir, ted_json, preproc))
+    assert all(ted_dataset.use_feature_cache(datum['audio']) for datum in ted_dataset.data)
+
+    with pytest.raises(ValueError):
+        FeatureCache(cv_path, ted_json)
+
+    # a cache copied to the path of another manifest fails the source check
+    shutil.rmtree(ted_path)
+    shutil.copytree(cv_path, ted_path)
+    with pytest.raises(ValueError):
+        build_feature_cache(ted_json, preproc, cache_dir, num_workers=1)
+
+    # a manifest changed after the cache was built makes the cache stale
+    with open(cv_json, 'r') as fid:
+        lines = fid.readlines()
+    with open(cv_json, 'w') as fid:
+        fid.writelines(lines[:-1])
+    with pytest.raises(ValueError):
+        build_feature_cache(cv_json, preproc, cache_dir, num_workers=1)
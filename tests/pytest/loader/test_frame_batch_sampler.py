@@ -0,0 +1,65 @@
+# third-party libraries
+import pytest
+# project libraries
+from speech.loader import (
+    AudioDataset, DistributedFrameBatchSampler, example_frames, pack_frame_batches, 
+    padding_efficiency, Preprocessor
+)
+from tests.pytest.utils import get_preproc_cfg, write_synthetic_dataset
+
+
+def test_pack_frame_batches():
+    """
+    every example should be in one batch and batches should be within the frame budget
+    """
+    frames = [50, 300, 120, 80, 700, 60, 250, 90, 1500, 40]
+    batches = pack_frame_batches(frames, max_frames=600)
+    assert sorted(idx for batch in batches for idx in batch) == list(range(len(frames)))
+    for batch in batches:
+        padded_frames = len(batch) * max(frames[idx] for idx in batch)
+        # an example longer than the budget is in its own batch
+        assert padded_frames <= 600 or len(batch) == 1
+    assert [8] in batches and [4] in batches
+
+    batches = pack_frame_batches(frames, max_frames=10000, max_batch_size=3)
+    assert max(len(batch) for batch in batches) == 3
+    assert 0 < padding_efficiency(frames, batches) <= 1.0
+    assert padding_efficiency([10, 10], [[0, 1]]) == 1.0
+
+
+@pytest.mark.parametrize("num_replicas", [1, 2, 3])
+def test_frame_sampler_replicas(tmp_path, num_replicas):
+    """
+    all replicas should take the same number of steps over disjoint batches and the batch
+    order should only depend on the epoch
+    """
+    data_json = write_synthetic_dataset(str(tmp_path), num_examples=24)
+    preproc = Preprocessor(data_json, get_preproc_cfg())
+    dataset = AudioDataset(data_json, preproc, batch_size=1)
+    max_frames = 400
+
+    samplers = [
+        DistributedFrameBatchSampler(dataset, max_frames, preproc.step_size, 
+                                        num_replicas=num_replicas, rank=rank)
+        for rank in range(num_replicas)
+    ]
+    for epoch in range(2):
+        replica_batches = list()
+        for sampler in samplers:
+            sampler.set_epoch(epoch)
+            batches = list(sampler)
+            assert len(batches) == len(sampler) == samplers[0].n_batch_per_replica
+            replica_batches.append(batches)
+            for batch in batches:
+                frames = [example_frames(dataset.data[idx]['duration'], preproc.step_size) 
+                            for idx in batch]
+                assert len(batch) * max(frames) <= max_frames or len(batch) == 1
+        
+        all_indices = [idx for batches in replica_batches for batch in batches for idx in batch]
+        assert len(all_indices) == len(set(all_indices))
+        assert list(samplers[0]) == replica_batches[0]
+
+    samplers[0].set_epoch(0)
+    epoch_0 = list(samplers[0])
+    samplers[0].set_epoch(1)
+    assert list(samplers[0]) != epoch_0 or len(epoch_0) == 1
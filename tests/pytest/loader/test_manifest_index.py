@@ -0,0 +1,93 @@
+# standard libraries
+import os
+import pickle
+import random
+# third-party libraries
+import numpy as np
+import pytest
+# project libraries
+from speech.utils.data_helpers import path_to_id
+from speech.utils.io import read_data_json
+from speech.utils import manifest as manifest_module
+from speech.utils.manifest import build_manifest_index, JsonlManifest, load_manifest
+from tests.pytest.utils import write_synthetic_dataset
+
+
+def test_jsonl_manifest_rows(tmp_path):
+    """
+    every row of the indexed manifest should equal the JSONL example and sampling
+    should match sampling the list of examples
+    """
+    data_json = write_synthetic_dataset(str(tmp_path), num_examples=20)
+    manifest = load_manifest(data_json, indexed=True)
+    dataset = read_data_json(data_json)
+
+    assert isinstance(manifest, JsonlManifest)
+    assert len(manifest) == len(dataset)
+    assert list(manifest) == dataset
+    assert manifest[-1] == dataset[-1]
+    assert manifest[3:7] == dataset[3:7]
+    with pytest.raises(IndexError):
+        manifest[len(dataset)]
+    assert random.Random(0).sample(manifest, k=5) == random.Random(0).sample(dataset, k=5)
+    assert manifest.sample(5, random.Random(1)) == random.Random(1).sample(dataset, k=5)
+
+    loaded_manifest = pickle.loads(pickle.dumps(manifest))
+    assert loaded_manifest._mmap is None and loaded_manifest._arrays is None
+    assert loaded_manifest[5] == dataset[5]
+
+
+def test_jsonl_manifest_keys_and_rebuild(tmp_path):
+    """
+    the secondary keys should find rows by record id and duration, and the index
+    should be rebuilt when the manifest changes
+    """
+    data_json = write_synthetic_dataset(str(tmp_path), num_examples=20)
+    dataset = read_data_json(data_json)
+    index_dir = build_manifest_index(data_json, record_ids=True, durations=True)
+    assert index_dir == data_json + ".index"
+
+    manifest = JsonlManifest(data_json)
+    for example in dataset:
+        assert manifest.find_record(path_to_id(example['audio'])) == example
+    assert manifest.find_record("missing_id") is None
+
+    durations = np.array([example['duration'] for example in dataset])
+    expected = np.flatnonzero((durations >= 0.5) & (durations < 1.0))
+    np.testing.assert_array_equal(manifest.rows_by_duration(0.5, 1.0), expected)
+
+    # blank lines are skipped and the stale index is rebuilt with the same keys
+    with open(data_json, 'a') as fid:
+        fid.write("\n" + open(data_json).readline() + "\n")
+    st = os.stat(data_json)
+    os.utime(data_json, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+    manifest = JsonlManifest(data_json)
+    assert len(manifest) == len(dataset) + 1
+    assert manifest[-1] == dataset[0]
+    assert manifest.has_record_ids and manifest.has_durations
+
+    plain_manifest = JsonlManifest(data_json, index_dir=str(tmp_path / "plain"))
+    with pytest.raises(ValueError):
+        plain_manifest.find_record(path_to_id(dataset[0]['audio']))
+
+
+def test_jsonl_manifest_read_only_dir(tmp_path, monkeypatch):
+    """
+    if the directory of the manifest isn't writable, the index should be built in the cache
+    """
+    data_json = write_synthetic_dataset(str(tmp_path / "data"), num_examples=5)
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    build_index = manifest_module.build_manifest_index
+
+    def read_only_build(data_json, index_dir=None, *args):
+        if index_dir == data_json + ".index":
+            raise PermissionError(f"read-only: {index_dir}")
+        return build_index(data_json, index_dir, *args)
+
+    monkeypatch.setattr(manifest_module, "build_manifest_index", read_only_build)
+    manifest = JsonlManifest(data_json)
+    assert manifest.index_dir.startswith(str(tmp_path / "cache"))
+    assert not os.path.exists(data_json + ".index")
+    assert list(manifest) == read_data_json(data_json)
+    # the cached index is reused
+    assert JsonlManifest(data_json).index_dir == manifest.index_dir
@@ -0,0 +1,93 @@
+# standard library
+import random
+# third-party libraries
+import numpy as np
+import pytest
+import torch
+from torch.cuda.amp import GradScaler
+# project libraries
+from speech.loader import (
+    AudioDataset, DistributedBatchRandomSampler, DistributedFrameBatchSampler, Preprocessor
+)
+from speech.utils.io import load_train_checkpoint, save_train_checkpoint
+from tests.pytest.utils import get_preproc_cfg, write_synthetic_dataset
+
+
+def make_sampler(dataset, sampler_name, rank):
+    if sampler_name == "random":
+        return DistributedBatchRandomSampler(dataset, num_replicas=2, rank=rank, batch_size=2)
+    return DistributedFrameBatchSampler(dataset, max_frames=400, step_size=16, num_replicas=2, rank=rank)
+
+
+@pytest.mark.parametrize("sampler_name", ["random", "frame"])
+def test_sampler_resumes_epoch(tmp_path, sampler_name):
+    """
+    a sampler loaded with the state after `k` batches should yield the rest of the epoch
+    and the next epoch should be complete
+    """
+    data_json = write_synthetic_dataset(str(tmp_path), num_examples=24)
+    preproc = Preprocessor(data_json, get_preproc_cfg())
+    dataset = AudioDataset(data_json, preproc, batch_size=2)
+
+    for rank in range(2):
+        sampler = make_sampler(dataset, sampler_name, rank)
+        sampler.set_epoch(3)
+        full_epoch = list(sampler)
+        full_len = len(sampler)
+        batches_done = 2 if sampler_name == "frame" else 4
+        state = sampler.state_dict(batches_done)
+        assert state == {"epoch": 3, "batches_consumed": batches_done, "num_replicas": 2}
+
+        resumed_sampler = make_sampler(dataset, sampler_name, rank)
+        resumed_sampler.set_epoch(3)
+        resumed_sampler.load_state_dict(state)
+        # the random sampler yields example indices in batches of 2
+        skipped = batches_done if sampler_name == "frame" else 2 * batches_done
+        assert list(resumed_sampler) == full_epoch[skipped:]
+        assert len(resumed_sampler) == full_len - skipped
+        # a second interruption counts from the start of the epoch
+        assert resumed_sampler.state_dict(1)["batches_consumed"] == batches_done + 1
+
+        resumed_sampler.set_epoch(4)
+        sampler.set_epoch(4)
+        assert list(resumed_sampler) == list(sampler)
+
+
+def test_train_checkpoint_round_trip(tmp_path):
+    """
+    the momentum buffers, scheduler, and rng states should be restored so training continues
+    exactly as if it had not been interrupted
+    """
+    def make_objects():
+        torch.manual_seed(0)
+        model = torch.nn.Linear(4, 2)
+        optimizer = torch.optim.SGD(model.parameters(), lr=0.1, momentum=0.9)
+        lr_scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=1, gamma=0.5)
+        return model, optimizer, lr_scheduler, GradScaler(enabled=False)
+
+    def train_step(model, optimizer):
+        inputs = torch.randn(8, 4) + float(np.random.rand()) + random.random()
+        optimizer.zero_grad()
+        model(inputs).pow(2).sum().backward()
+        optimizer.step()
+
+    model, optimizer, lr_scheduler, scaler = make_objects()
+    train_step(model, optimizer)
+    lr_scheduler.step()
+    ckpt_path = str(tmp_path / "ckpt_train_state.pth")
+    sampler_state = {"epoch": 1, "batches_consumed": 5, "num_replicas": 1}
+    train_state = {"start_epoch": 1, "run_state": (6, 0.5), "best_so_far": 0.3}
+    save_train_checkpoint(ckpt_path, model, optimizer, lr_scheduler, scaler, sampler_state, train_state)
+    train_step(model, optimizer)
+
+    # the rng is advanced so it must be restored from the checkpoint
+    torch.manual_seed(1); np.random.seed(1); random.seed(1)
+    resumed_model, resumed_optimizer, resumed_scheduler, resumed_scaler = make_objects()
+    states = load_train_checkpoint(ckpt_path, resumed_model, resumed_optimizer, resumed_scheduler, 
+                                   resumed_scaler, torch.device("cpu"))
+    assert states == {"sampler": sampler_state, "train_state": train_state}
+    assert resumed_optimizer.param_groups[0]["lr"] == pytest.approx(0.05)
+    train_step(resumed_model, resumed_optimizer)
+
+    for param, resumed_param in zip(model.parameters(), resumed_model.parameters()):
+        torch.testing.assert_close(param, resumed_param)
@@ -0,0 +1,82 @@
+# standard libraries
+from collections import Counter
+# third-party libraries
+import numpy as np
+import pytest
+# project libraries
+from speech.loader import Preprocessor, ShardedAudioDataset, make_shard_loader
+from speech.utils.io import read_data_json
+from speech.utils.shards import decode_audio, iterate_shard, read_shard_index, write_shards
+from speech.utils.wave import array_from_wave
+from tests.pytest.utils import get_preproc_cfg, write_synthetic_dataset
+
+
+@pytest.mark.parametrize("audio_format", ['wav', 'flac'])
+def test_shard_round_trip(tmp_path, audio_format):
+    """
+    the audio, labels, and duration read from the shards should equal the original dataset
+    """
+    data_json = write_synthetic_dataset(str(tmp_path / "data"), num_examples=10)
+    index_path = write_shards(data_json, str(tmp_path / "shards"), shard_size_mb=0, 
+                                audio_format=audio_format)
+    shards = read_shard_index(index_path)
+    assert len(shards) == 10
+
+    dataset = {example['audio']: example for example in read_data_json(data_json)}
+    n_examples = 0
+    for shard in shards:
+        for example in iterate_shard(shard['path']):
+            reference = dataset[example['audio']]
+            assert example['text'] == reference['text']
+            assert example['duration'] == reference['duration']
+            audio_data, samp_rate = decode_audio(example['audio_bytes'])
+            ref_audio, ref_samp_rate = array_from_wave(reference['audio'])
+            np.testing.assert_array_equal(audio_data, ref_audio)
+            assert samp_rate == ref_samp_rate
+            n_examples += 1
+    assert n_examples == 10
+
+
+def test_replicas_equal_steps_no_overlap(tmp_path):
+    """
+    each replica should yield the same number of full batches and no example should be 
+    seen by more than one replica
+    """
+    data_json = write_synthetic_dataset(str(tmp_path / "data"), num_examples=23)
+    index_path = write_shards(data_json, str(tmp_path / "shards"), shard_size_mb=0)
+    preproc = Preprocessor(data_json, get_preproc_cfg())
+    batch_size, num_replicas = 2, 3
+
+    seen_labels = Counter()
+    for rank in range(num_replicas):
+        dataset = ShardedAudioDataset(index_path, preproc, batch_size, buffer_size=4,
+                                        num_replicas=num_replicas, rank=rank)
+        dataset.set_epoch(1)
+        batches = list(dataset)
+        assert len(batches) == len(dataset)
+        assert len(batches) == 23 // num_replicas // batch_size
+        for batch in batches:
+            assert len(batch) == batch_size
+            for features, targets in batch:
+                assert features.shape[1] == preproc.input_dim
+                seen_labels[tuple(targets)] += 1
+    
+    assert sum(seen_labels.values()) == num_replicas * len(batches) * batch_size
+    dataset_labels = Counter(tuple(preproc.encode(ex['text'])) for ex in read_data_json(data_json))
+    for labels, count in seen_labels.items():
+        assert count <= dataset_labels[labels]
+
+
+def test_shard_loader_with_workers(tmp_path):
+    """
+    the loader should yield the number of batches in its length with multiple workers
+    """
+    data_json = write_synthetic_dataset(str(tmp_path / "data"), num_examples=12)
+    index_path = write_shards(data_json, str(tmp_path / "shards"), shard_size_mb=0)
+    preproc = Preprocessor(data_json, get_preproc_cfg())
+    
+    ldr = make_shard_loader(index_path, preproc, batch_size=2, num_workers=2, buffer_size=2)
+    batches = [list(batch) for batch in ldr]
+    assert len(batches) == len(ldr) == 6
+    for inputs, labels in batches:
+        assert len(inputs) == len(labels) == 2
@@ -0,0 +1,79 @@
+# third-party libraries
+import numpy as np
+import torch
+import torch.utils.data as tud
+# project libraries
+from speech.loader import AudioDataset, BatchRandomSampler, Preprocessor, TensorCollate
+from speech.models.ctc_model_train import CTC_train
+from speech.models.model import pad_flat_labels
+from speech.models.seq2seq import end_pad_concat
+from speech.utils.data_structs import TensorBatch
+from tests.pytest.utils import get_model_cfg, get_preproc_cfg, write_synthetic_dataset
+
+
+def random_batch(rng, batch_size=3, feature_dim=5):
+    inputs = [rng.randn(rng.randint(2, 40), feature_dim).astype(np.float32) 
+                for _ in range(batch_size)]
+    labels = [list(rng.randint(0, 10, rng.randint(1, 6))) for _ in range(batch_size)]
+    return list(zip(inputs, labels))
+
+
+def test_tensor_collate_matches_collate():
+    """
+    the tensor batch should match the model collate and the reused buffers should be
+    zeroed beyond each example
+    """
+    rng = np.random.RandomState(0)
+    model = CTC_train(5, 10, get_model_cfg())
+    collate = TensorCollate(num_buffers=2, bucket_frames=16)
+    
+    for _ in range(6):
+        batch = random_batch(rng)
+        tensor_batch = collate(batch)
+        assert isinstance(tensor_batch, TensorBatch)
+        assert tensor_batch.inputs.is_contiguous()
+        expected = model.collate(*zip(*batch))
+        for tensor, expected_tensor in zip(model.collate_tensors(tensor_batch), expected):
+            assert tensor.dtype == expected_tensor.dtype
+            torch.testing.assert_close(tensor, expected_tensor)
+        np.testing.assert_array_equal(tensor_batch.input_lens, [inp.shape[0] for inp, _ in batch])
+
+    # the ring of buffers is reused
+    assert all(buffer is not None for buffer in collate._buffers)
+    assert collate(random_batch(rng)).inputs.data_ptr() == collate._buffers[0].data_ptr()
+
+
+def test_pad_flat_labels():
+    """
+    the padded labels should match the numpy end-padding of seq2seq
+    """
+    labels = [[1, 2, 3, 9], [4, 9], [5, 6, 9]]
+    flat_labels = torch.IntTensor([l for label in labels for l in label])
+    label_lens = torch.IntTensor([len(label) for label in labels])
+    padded = pad_flat_labels(flat_labels, label_lens, 9)
+    np.testing.assert_array_equal(padded.numpy(), end_pad_concat(labels))
+
+
+def test_tensor_collate_in_workers(tmp_path):
+    """
+    the loader workers should return pinned-compatible tensor batches with the features
+    of the dataset
+    """
+    data_json = write_synthetic_dataset(str(tmp_path))
+    preproc = Preprocessor(data_json, get_preproc_cfg())
+    dataset = AudioDataset(data_json, preproc, batch_size=2)
+    loader = tud.DataLoader(dataset, batch_size=2, sampler=BatchRandomSampler(dataset, 2), 
+                            num_workers=2, collate_fn=TensorCollate(), drop_last=True)
+    features = {tuple(dataset[idx][1]): dataset[idx][0] for idx in range(len(dataset))}
+    
+    n_batches = 0
+    for batch in loader:
+        assert isinstance(batch, TensorBatch)
+        offset = 0
+        for e, (n_frames, n_labels) in enumerate(zip(batch.input_lens, batch.label_lens)):
+            label = tuple(batch.labels[offset:offset + n_labels].tolist())
+            offset += int(n_labels)
+            np.testing.assert_array_equal(batch.inputs[e, :n_frames].numpy(), features[label])
+            assert torch.all(batch.inputs[e, n_frames:] == 0)
+        n_batches += 1
+    assert n_batches == len(dataset) // 2
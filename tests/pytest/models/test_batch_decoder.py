@@ -0,0 +1,94 @@
+# third-party libraries
+import numpy as np
+import torch
+# project libraries
+import speech.loader as loader
+from speech.models.batch_decoder import BatchDecoder
+from speech.models.ctc_decoder_fast import decode
+from speech.models.ctc_model_train import CTC_train
+from evaluate.eval import eval_loop, log_input_report, pruning_report
+from tests.pytest.utils import get_model_cfg, get_preproc_cfg, write_synthetic_dataset
+
+
+def test_batch_decoder_matches_decode():
+    """
+    the pool should return the n-best lists of each example over its length in batch order
+    """
+    rng = np.random.RandomState(0)
+    probs = np.exp(rng.randn(7, 40, 6) * 2).astype(np.float32)
+    probs /= probs.sum(axis=2, keepdims=True)
+    lengths = torch.IntTensor([40, 3, 17, 1, 25, 40, 9])
+    expected = [decode(probs[i, :length], 4, 5, 2) for i, length in enumerate(lengths.tolist())]
+
+    with BatchDecoder(num_workers=2, beam_size=4, blank=5, n_top_beams=2) as decoder:
+        jobs = [decoder.submit(torch.from_numpy(probs), lengths), decoder.submit(probs[:2])]
+        assert jobs[0].get() == expected
+        assert jobs[1].get() == [decode(p, 4, 5, 2) for p in probs[:2]]
+        assert decoder.decode(probs[:0]) == []
+
+    serial_decoder = BatchDecoder(num_workers=0, beam_size=4, blank=5, n_top_beams=2)
+    assert serial_decoder.decode(probs, lengths) == expected
+
+    log_probs = np.log(probs)
+    with BatchDecoder(num_workers=2, beam_size=4, blank=5, n_top_beams=2, log_input=True) as decoder:
+        assert decoder.decode(log_probs, lengths) == \
+            [decode(log_probs[i, :length], 4, 5, 2, log_input=True) 
+             for i, length in enumerate(lengths.tolist())]
+
+
+def test_eval_loop_decode_workers(tmp_path):
+    """
+    the pipelined decoding in the pool should give the same results as decoding in the loop
+    """
+    data_json = write_synthetic_dataset(str(tmp_path), num_examples=8)
+    preproc = loader.Preprocessor(data_json, get_preproc_cfg())
+    ldr = loader.make_loader(data_json, preproc, batch_size=2, num_workers=0)
+    torch.manual_seed(0)
+    model = CTC_train(preproc.input_dim, preproc.vocab_size, get_model_cfg())
+    model.set_eval()
+
+    # the loader shuffles the batches, so the results are compared in label order
+    expected = sorted(eval_loop(model, ldr, torch.device("cpu")))
+    assert len(expected) == 8
+    assert sorted(eval_loop(model, ldr, torch.device("cpu"), decode_workers=2)) == expected
+
+
+def test_pruning_report(tmp_path):
+    """
+    pruning that removes nothing should have the same PER and save no expansions
+    """
+    data_json = write_synthetic_dataset(str(tmp_path), num_examples=4)
+    preproc = loader.Preprocessor(data_json, get_preproc_cfg())
+    ldr = loader.make_loader(data_json, preproc, batch_size=2, num_workers=0)
+    torch.manual_seed(0)
+    model = CTC_train(preproc.input_dim, preproc.vocab_size, get_model_cfg())
+    model.set_eval()
+
+    report = pruning_report(model, ldr, torch.device("cpu"), preproc, beam_size=3, 
+                            pruning={"blank_threshold": 1.1})
+    assert report["per_delta"] == 0
+    assert report["pruned_frames"] == 0 and report["expansions_saved"] == 0
+    assert report["exact_per"] > 0
+
+    # an empty loader reports zeros instead of dividing by zero
+    report = pruning_report(model, [], torch.device("cpu"), preproc, pruning={"top_k": 2})
+    assert report["pruned_frames"] == 0 and report["expansions_saved"] == 0
+    assert report["exact_per"] == report["pruned_per"] == 0
+
+
+def test_log_input_report(tmp_path):
+    """
+    decoding the log-softmax outputs should give the same predictions as the softmax outputs
+    """
+    data_json = write_synthetic_dataset(str(tmp_path), num_examples=4)
+    preproc = loader.Preprocessor(data_json, get_preproc_cfg())
+    ldr = loader.make_loader(data_json, preproc, batch_size=2, num_workers=0)
+    torch.manual_seed(0)
+    model = CTC_train(preproc.input_dim, preproc.vocab_size, get_model_cfg())
+    model.set_eval()
+
+    report = log_input_report(model, ldr, torch.device("cpu"), beam_size=3)
+    assert report["same_preds"] == 1
+    assert report["max_score_diff"] < 1e-3
+    assert report["softmax_time"] > 0 and report["log_softmax_time"] > 0
+    assert 0 <= report["zero_probs"] < 1
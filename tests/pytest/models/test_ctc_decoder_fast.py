@@ -0,0 +1,143 @@
+# standard libraries
+import time
+# third-party libraries
+import numpy as np
+import pytest
+# project libraries
+from speech.models import ctc_decoder, ctc_decoder_fast
+
+
+def random_probs(rng, time_steps, vocab_size, scale):
+    logits = rng.randn(time_steps, vocab_size) * scale
+    probs = np.exp(logits)
+    return probs / probs.sum(axis=1, keepdims=True)
+
+
+def test_fast_decoder_matches_reference():
+    """
+    the fast decoder should return the same beams and scores as the reference decoder on
+    random outputs with different lengths, vocab sizes, blank indices, and beam sizes
+    """
+    rng = np.random.RandomState(0)
+    for _ in range(200):
+        vocab_size = rng.randint(2, 12)
+        probs = random_probs(rng, rng.randint(1, 50), vocab_size, rng.uniform(0.5, 4))
+        beam_size = int(rng.choice([1, 2, 3, 5, 10, 20]))
+        blank = rng.randint(vocab_size)
+        n_top_beams = rng.randint(1, beam_size + 1)
+
+        expected = ctc_decoder.decode(probs, beam_size, blank, n_top_beams)
+        beams = ctc_decoder_fast.decode(probs, beam_size, blank, n_top_beams)
+        assert len(beams) == len(expected)
+        # the order of the beams with zero probability is arbitrary
+        expected = [beam for beam in expected if np.isfinite(beam[1])]
+        assert [preds for preds, _ in beams[:len(expected)]] == [preds for preds, _ in expected]
+        np.testing.assert_allclose(
+            [score for _, score in beams[:len(expected)]], [score for _, score in expected]
+        )
+
+
+def test_fast_decoder_zero_probs_and_batch():
+    """
+    labels with zero probability should never be decoded and `decode_batch` should return the
+    top beam of each example
+    """
+    rng = np.random.RandomState(1)
+    probs = random_probs(rng, 30, 6, 2.0)
+    probs[:, 2] = 0
+    probs /= probs.sum(axis=1, keepdims=True)
+    preds, score = ctc_decoder_fast.decode(probs, beam_size=5, blank=5)[0]
+    assert 2 not in preds and np.isfinite(score)
+    assert preds == ctc_decoder.decode(probs, beam_size=5, blank=5)[0][0]
+
+    probs_list = [random_probs(rng, length, 6, 2.0) for length in [5, 17, 1]]
+    assert ctc_decoder_fast.decode_batch(probs_list, blank=0) == \
+        [ctc_decoder.decode(probs, beam_size=3, blank=0)[0][0] for probs in probs_list]
+
+
+@pytest.mark.parametrize("beam_size", [3, 20])
+def test_fast_decoder_speed(beam_size):
+    """
+    the fast decoder should be much faster than the reference on a dev-set sized output
+    """
+    probs = random_probs(np.random.RandomState(2), 200, 40, 3.0)
+    start = time.perf_counter()
+    expected = ctc_decoder.decode(probs, beam_size=beam_size, blank=39)
+    reference_time = time.perf_counter() - start
+    start = time.perf_counter()
+    beams = ctc_decoder_fast.decode(probs, beam_size=beam_size, blank=39)
+    fast_time = time.perf_counter() - start
+    assert beams[0][0] == expected[0][0]
+    assert reference_time / fast_time > 5
+
+
+def test_prune_labels():
+    """
+    the mask should keep the top-k labels and the smallest set that reaches the cumulative probability
+    """
+    probs = np.array([[0.5, 0.3, 0.15, 0.05], [0.05, 0.1, 0.25, 0.6]])
+    np.testing.assert_array_equal(
+        ctc_decoder_fast.prune_labels(probs, top_k=2), [[1, 1, 0, 0], [0, 0, 1, 1]]
+    )
+    np.testing.assert_array_equal(
+        ctc_decoder_fast.prune_labels(probs, cum_prob=0.9), [[1, 1, 1, 0], [0, 1, 1, 1]]
+    )
+    np.testing.assert_array_equal(
+        ctc_decoder_fast.prune_labels(probs, top_k=3, cum_prob=0.5), [[1, 0, 0, 0], [0, 0, 0, 1]]
+    )
+    assert ctc_decoder_fast.prune_labels(probs).all()
+
+
+def test_pruned_decoder():
+    """
+    pruning that removes nothing should give the exact output and pruning of a peaky output 
+    should keep the top beam while saving most of the expansions
+    """
+    rng = np.random.RandomState(3)
+    probs = random_probs(rng, 40, 8, 2.0)
+    stats = dict()
+    assert ctc_decoder_fast.decode(probs, 5, 7, 2, blank_threshold=1.1, top_k=8, stats=stats) == \
+        ctc_decoder_fast.decode(probs, 5, 7, 2)
+    assert stats["frames"] == 40 and stats["pruned_frames"] == 0
+    assert stats["expansions"] == stats["full_expansions"]
+
+    # most frames of a peaky output have a blank probability close to one
+    logits = rng.randn(200, 40)
+    is_blank = rng.rand(200) < 0.7
+    logits[is_blank, 39] += 12
+    logits[~is_blank, rng.randint(0, 39, (~is_blank).sum())] += 6
+    probs = np.exp(logits) / np.exp(logits).sum(axis=1, keepdims=True)
+    stats = dict()
+    beams = ctc_decoder_fast.decode(
+        probs, 20, 39, blank_threshold=0.999, cum_prob=0.999, stats=stats
+    )
+    assert beams[0][0] == ctc_decoder_fast.decode(probs, 20, 39)[0][0]
+    assert stats["pruned_frames"] > 0
+    assert stats["expansions"] < 0.5 * stats["full_expansions"]
+
+
+def test_log_input_decoder():
+    """
+    decoding the log-probabilities should give the same beams and scores as the probabilities,
+    with and without pruning, and keep the labels whose probabilities underflow to zero
+    """
+    rng = np.random.RandomState(4)
+    probs = random_probs(rng, 60, 10, 3.0)
+    log_probs = np.log(probs)
+    for pruning in [dict(), {"blank_threshold": 0.9, "top_k": 4}, {"cum_prob": 0.99}]:
+        beams = ctc_decoder_fast.decode(log_probs, 10, 9, 3, log_input=True, **pruning)
+        expected = ctc_decoder_fast.decode(probs, 10, 9, 3, **pruning)
+        assert [preds for preds, _ in beams] == [preds for preds, _ in expected]
+        np.testing.assert_allclose([score for _, score in beams], [score for _, score in expected])
+    assert ctc_decoder.decode(log_probs, 5, 9, log_input=True) == ctc_decoder.decode(probs, 5, 9)
+
+    # the label is far more probable than the blank, whose probability is zero in float32
+    log_probs = np.full((3, 3), -200.0, dtype=np.float32)
+    log_probs[:, 1] = 0
+    log_probs[1, 2] = -120
+    probs = np.exp(log_probs)
+    assert probs[1, 2] == 0
+    (preds, score), = ctc_decoder_fast.decode(log_probs, 3, 0, log_input=True)
+    assert preds == (1,) and np.isfinite(score)
+    assert np.isfinite(ctc_decoder_fast.decode(log_probs, 3, 0, 3, log_input=True)[2][1])
+    assert not np.isfinite(ctc_decoder_fast.decode(probs, 3, 0, 3)[2][1])
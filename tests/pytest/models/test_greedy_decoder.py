@@ -0,0 +1,78 @@
+# third-party libraries
+import numpy as np
+import torch
+# project libraries
+import speech.loader as loader
+from speech.models.ctc_model_train import CTC_train
+from speech.models.greedy_decoder import collapse_repeats, greedy_decode
+from tests.pytest.utils import get_model_cfg, get_preproc_cfg, write_synthetic_dataset
+
+
+def loop_decode(log_probs, blank):
+    """Reference greedy decoder of a single (time x vocab) output with a loop over the frames"""
+    pred = np.argmax(log_probs, 1)
+    labels, frames, confidences = list(), list(), list()
+    for t, p in enumerate(pred):
+        prob = float(np.exp(log_probs[t, p]))
+        if t > 0 and p == pred[t - 1]:
+            if p != blank:
+                confidences[-1] = max(confidences[-1], prob)
+        elif p != blank:
+            labels.append(int(p))
+            frames.append(t)
+            confidences.append(prob)
+    return labels, frames, confidences
+
+
+def test_greedy_decode_matches_loop():
+    """
+    the labels, alignments, and confidences of each utterance should match the loop decoder
+    over the utterance's length
+    """
+    rng = np.random.RandomState(0)
+    for _ in range(50):
+        batch_size, max_len, vocab_size = rng.randint(1, 6), rng.randint(1, 30), rng.randint(2, 6)
+        # a small vocab gives many repeats and blanks
+        log_probs = torch.log_softmax(torch.from_numpy(rng.randn(batch_size, max_len, vocab_size)), dim=2)
+        lengths = torch.from_numpy(rng.randint(0, max_len + 1, batch_size))
+        blank = rng.randint(vocab_size)
+
+        labels, alignments, confidences = greedy_decode(log_probs, lengths, blank)
+        assert len(labels) == len(alignments) == len(confidences) == batch_size
+        for i, length in enumerate(lengths.tolist()):
+            expected = loop_decode(log_probs[i, :length].numpy(), blank)
+            assert labels[i].tolist() == expected[0]
+            assert alignments[i].tolist() == expected[1]
+            np.testing.assert_allclose(confidences[i], expected[2])
+
+    labels, _, _ = greedy_decode(log_probs.numpy(), blank=blank)
+    assert [label.tolist() for label in labels] == \
+        [loop_decode(log_prob, blank)[0] for log_prob in log_probs.numpy()]
+
+
+def test_collapse_repeats():
+    assert collapse_repeats([1, 2, 2, 0, 0, 0, 2, 1], blank=0) == [1, 2, 2, 1]
+    assert collapse_repeats([2, 2, 2], blank=0) == [2]
+    assert collapse_repeats([0, 0, 0], blank=0) == []
+    assert collapse_repeats([], blank=0) == []
+
+
+def test_infer_maxdecode(tmp_path):
+    """
+    the greedy predictions of the model should match the loop decoder over each output length
+    """
+    data_json = write_synthetic_dataset(str(tmp_path), num_examples=4)
+    preproc = loader.Preprocessor(data_json, get_preproc_cfg())
+    ldr = loader.make_loader(data_json, preproc, batch_size=4, num_workers=0)
+    torch.manual_seed(0)
+    model = CTC_train(preproc.input_dim, preproc.vocab_size, get_model_cfg())
+    model.set_eval()
+
+    batch = list(next(iter(ldr)))
+    with torch.no_grad():
+        preds = model.infer_maxdecode(batch)
+        x, _, x_lens, _ = model.collate(*batch)
+        out, _ = model(x, softmax=False, lengths=x_lens)
+    log_probs = torch.log_softmax(out, dim=2).numpy()
+    assert preds == [tuple(loop_decode(log_prob[:length], model.blank)[0])
+                     for log_prob, length in zip(log_probs, x_lens.tolist())]
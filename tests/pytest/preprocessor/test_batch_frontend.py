@@ -0,0 +1,76 @@
+# third-party libraries
+import numpy as np
+import pytest
+import python_speech_features
+import torch
+# project libraries
+from speech.loader import AudioDataset, FrontendCollate, log_spectrogram, mfcc, Preprocessor
+from speech.utils.feature_frontend import BatchFeatureFrontend, pad_audio
+from tests.pytest.utils import get_preproc_cfg, write_synthetic_dataset
+
+
+SAMPLE_RATE = 16000
+
+
+def reference_log_mel(audio, sample_rate, window_size, step_size):
+    """log-mel filterbank and deltas with the same settings as `speech.loader.log_mel_filterbank`
+    """
+    feat, _ = python_speech_features.fbank(audio,
+                                           sample_rate,
+                                           winlen=window_size/1000,
+                                           winstep=step_size/1000,
+                                           winfunc=np.hanning)
+    log_mel = np.log(feat)
+    delta = python_speech_features.delta(log_mel, N=1)
+    delta_delta = python_speech_features.delta(delta, N=1)
+    return np.concatenate((log_mel, delta, delta_delta), axis=1).astype(np.float32)
+
+
+REFERENCE_FNS = {
+    'log_spectrogram': log_spectrogram,
+    'mfcc': mfcc,
+    'log_mel': reference_log_mel
+}
+
+
+@pytest.mark.parametrize("preprocessor", ['log_spectrogram', 'log_mel', 'mfcc'])
+@pytest.mark.parametrize("dtype, atol", [(torch.float64, 1e-4), (torch.float32, 5e-4)])
+def test_frontend_matches_reference(preprocessor, dtype, atol):
+    """
+    the features of each example in a padded batch should match the single-utterance functions
+    and the padded frames should be zero
+    """
+    rng = np.random.RandomState(0)
+    audio_list = [(rng.randn(n) * 3000).astype(np.int16) for n in [16000, 12345, 8000, 700]]
+    for window_size, step_size in [(32, 16), (20, 10)]:
+        frontend = BatchFeatureFrontend(preprocessor, SAMPLE_RATE, window_size, step_size)
+        audio, audio_lens = pad_audio(audio_list, dtype=dtype)
+        features, frame_lens = frontend(audio, audio_lens)
+
+        for i, audio_array in enumerate(audio_list):
+            expected = REFERENCE_FNS[preprocessor](audio_array, SAMPLE_RATE, window_size, step_size)
+            n_frames = int(frame_lens[i])
+            assert n_frames == expected.shape[0]
+            np.testing.assert_allclose(features[i, :n_frames].numpy(), expected, atol=atol, rtol=1e-4)
+            assert torch.all(features[i, n_frames:] == 0)
+
+
+@pytest.mark.parametrize("preprocessor", ['log_spectrogram', 'mfcc'])
+def test_collate_matches_preprocess(tmp_path, preprocessor):
+    """
+    the normalized features from the collate function should match `Preprocessor.preprocess`
+    """
+    data_json = write_synthetic_dataset(str(tmp_path))
+    preproc_cfg = get_preproc_cfg(preprocessor)
+    preproc_cfg['use_feature_normalize'] = True
+    preproc = Preprocessor(data_json, preproc_cfg)
+
+    dataset = AudioDataset(data_json, preproc, batch_size=4, raw_audio=True)
+    collate = FrontendCollate(preproc)
+    inputs, labels = collate([dataset[idx] for idx in range(len(dataset))])
+
+    for datum, batch_input, batch_label in zip(dataset.data, inputs, labels):
+        features, targets = preproc.preprocess(datum['audio'], datum['text'])
+        assert batch_input.dtype == np.float32
+        np.testing.assert_allclose(batch_input, features, atol=1e-3, rtol=1e-3)
+        assert batch_label == targets
@@ -4,10 +4,13 @@ import os
 import numpy as np
 import pytest
 # project libraries
-from speech.loader import compute_mean_std
+from speech.loader import (
+    compute_mean_std, feature_normalize, merge_feature_stats, Preprocessor, process_audio
+)
 from speech.utils.compat import get_main_dir_path
-from speech.utils.io import read_pickle
-from tests.pytest.utils import get_all_test_audio
+from speech.utils.io import read_data_json, read_pickle
+from speech.utils.wave import array_from_wave
+from tests.pytest.utils import get_all_test_audio, get_preproc_cfg, write_synthetic_dataset
 
 # constants
 WINDOW_SIZE = 32
@@ -72,3 +75,61 @@ def test_compute_mean_std_empty_input():
             mean, std = compute_mean_std(audio_files, preprocessor, WINDOW_SIZE, 
                                             STEP_SIZE, use_feature_normalize)
    
+
+
+def test_streaming_matches_stacked(tmp_path):
+    """
+    the merged per-file statistics, serial and with a pool, should match the statistics of all
+    stacked feature frames
+    """
+    data_json = write_synthetic_dataset(str(tmp_path))
+    audio_files = [example['audio'] for example in read_data_json(data_json)]
+    for use_feature_normalize in [False, True]:
+        samples = list()
+        for audio_file in audio_files:
+            audio_data, samp_rate = array_from_wave(audio_file)
+            features = process_audio(audio_data, samp_rate, WINDOW_SIZE, STEP_SIZE, 'log_spectrogram')
+            if use_feature_normalize:
+                features = feature_normalize(features)
+            samples.append(features)
+        samples = np.vstack(samples).astype(np.float64)
+
+        for num_workers in [1, 2]:
+            mean, std = compute_mean_std(audio_files, 'log_spectrogram', WINDOW_SIZE, STEP_SIZE, 
+                                            use_feature_normalize, num_workers=num_workers)
+            assert mean.dtype == np.float32 and std.dtype == np.float32
+            np.testing.assert_allclose(mean, samples.mean(axis=0), rtol=1e-5, atol=1e-5)
+            np.testing.assert_allclose(std, samples.std(axis=0), rtol=1e-5, atol=1e-5)
+
+
+def test_mean_std_cache(tmp_path):
+    """
+    a second preprocessor with the same dataset and feature config should read the cached stats
+    and a different feature config should compute new stats
+    """
+    data_json = write_synthetic_dataset(str(tmp_path))
+    preproc_cfg = get_preproc_cfg()
+    preproc_cfg['mean_std_cache_dir'] = str(tmp_path / "stats")
+    preproc = Preprocessor(data_json, preproc_cfg, max_samples=4)
+    assert len(os.listdir(tmp_path / "stats")) == 1
+
+    # a different random subset would give different stats if they were recomputed
+    cached_preproc = Preprocessor(data_json, preproc_cfg, max_samples=4)
+    np.testing.assert_array_equal(cached_preproc.mean, preproc.mean)
+    np.testing.assert_array_equal(cached_preproc.std, preproc.std)
+
+    preproc_cfg['window_size'] = 20
+    Preprocessor(data_json, preproc_cfg, max_samples=4)
+    assert len(os.listdir(tmp_path / "stats")) == 2
+
+
+def test_merge_feature_stats_empty_file():
+    """
+    a file with zero frames has a NaN mean and should not change the merged stats
+    """
+    stats = (10, np.ones(3), np.ones(3))
+    empty = (0, np.full(3, np.nan), np.zeros(3))
+    for merged in (merge_feature_stats(stats, empty), merge_feature_stats(empty, stats)):
+        assert merged[0] == 10
+        np.testing.assert_array_equal(merged[1], stats[1])
+        np.testing.assert_array_equal(merged[2], stats[2])
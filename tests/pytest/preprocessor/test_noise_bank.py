@@ -0,0 +1,75 @@
+# standard library
+import pickle
+# third-party libraries
+import numpy as np
+# project libraries
+from speech.utils.signal_augment import inject_noise, NoiseBank
+from speech.utils.wave import array_to_wave
+
+
+def write_noise_files(noise_dir, samp_rates=(16000, 16000, 8000), seconds=(2.0, 0.5, 1.0)):
+    """Writes random noise files and returns the noise arrays"""
+    noise_dir.mkdir()
+    rng = np.random.RandomState(0)
+    noise_list = list()
+    for idx, (samp_rate, duration) in enumerate(zip(samp_rates, seconds)):
+        noise = (rng.randn(int(samp_rate * duration)) * 2000).astype(np.int16)
+        array_to_wave(str(noise_dir / f"noise_{idx}.wav"), noise, samp_rate)
+        noise_list.append(noise)
+    return noise_list
+
+
+def test_noise_bank_offsets_and_resampling(tmp_path):
+    """
+    the bank should contain every file in order at 16 kHz and crops should be slices of one file
+    """
+    noise_list = write_noise_files(tmp_path / "noise")
+    bank = NoiseBank(str(tmp_path / "noise"), sample_rate=16000, cache_dir=str(tmp_path / "cache"))
+
+    assert len(bank) == 3
+    np.testing.assert_array_equal(bank.lengths, [32000, 8000, 16000])
+    np.testing.assert_array_equal(bank.audio[:32000], noise_list[0])
+    np.testing.assert_array_equal(bank.audio[32000:40000], noise_list[1])
+
+    crop = bank.crop(0, 1000)
+    assert crop.dtype == np.int16 and crop.size == 1000
+    # the crop is a contiguous segment of the first file
+    start = np.flatnonzero(noise_list[0] == crop[0])
+    assert any(np.array_equal(noise_list[0][s:s + 1000], crop) for s in start)
+    # files shorter than the data aren't cropped
+    assert bank.crop(1, 8001) is None
+
+
+def test_noise_bank_reuse_and_pickle(tmp_path):
+    """
+    a second bank of the same files should reuse the cache file and a pickled bank
+    should re-open the memory-map
+    """
+    write_noise_files(tmp_path / "noise")
+    bank = NoiseBank(str(tmp_path / "noise"), cache_dir=str(tmp_path / "cache"))
+    bank.audio
+    other_bank = NoiseBank(str(tmp_path / "noise"), cache_dir=str(tmp_path / "cache"))
+    assert other_bank.bank_path == bank.bank_path
+    assert len(list((tmp_path / "cache").iterdir())) == 2
+
+    loaded_bank = pickle.loads(pickle.dumps(bank))
+    assert loaded_bank._audio is None
+    np.testing.assert_array_equal(loaded_bank.audio, bank.audio)
+
+
+def test_inject_noise_with_bank(tmp_path):
+    """
+    the noise rms should be scaled to the noise level relative to the data rms
+    """
+    write_noise_files(tmp_path / "noise")
+    bank = NoiseBank(str(tmp_path / "noise"), cache_dir=str(tmp_path / "cache"))
+    data = (np.random.RandomState(1).randn(4000) * 3000).astype(np.int16)
+
+    np.random.seed(0)
+    for _ in range(10):
+        noisy_data = inject_noise(data, 16000, str(tmp_path / "noise"), noise_levels=(0.5, 0.5),
+                                    noise_bank=bank)
+        assert noisy_data.dtype == np.int16 and noisy_data.size == data.size
+        noise = noisy_data.astype(np.float64) - data.astype(np.float64)
+        rms_ratio = np.sqrt(np.mean(noise**2)) / np.sqrt(np.mean(data.astype(np.float64)**2))
+        np.testing.assert_allclose(rms_ratio, 0.5, rtol=1e-2)
@@ -93,4 +93,53 @@ def test_gain_increase_amplitude():
             scaled_aug_rms = audioop.rms(aug_data, 2)/amp_ratio
             accuracy = -1  # same up to 10^(-accuracy)
             print(f"audio rms: {audio_rms}, scaled_aug rms: {scaled_aug_rms}, ratio:{amp_ratio}, accuracy:{10**(-accuracy)}")
-            np.testing.assert_almost_equal(audio_rms, scaled_aug_rms, decimal=accuracy)
\ No newline at end of file
+            np.testing.assert_almost_equal(audio_rms, scaled_aug_rms, decimal=accuracy)
+
+def sine_audio(freq:float=440.0, duration:float=2.0, samp_rate:int=16000)->np.ndarray:
+    time = np.arange(int(duration * samp_rate)) / samp_rate
+    return (8000 * np.sin(2 * np.pi * freq * time)).astype(np.int16)
+
+
+def peak_frequency(audio_data:np.ndarray, samp_rate:int=16000)->float:
+    spectrum = np.abs(np.fft.rfft(audio_data.astype(np.float64) * np.hanning(audio_data.size)))
+    return np.argmax(spectrum) * samp_rate / audio_data.size
+
+
+def test_numpy_engine_no_augment():
+    """
+    the numpy engine should return the input audio when there is no augmentation
+    """
+    audio_data = sine_audio()
+    aug_data, samp_rate = tempo_gain_pitch_perturb(audio_data, sample_rate=16000, 
+        tempo_range=(1.0, 1.0), gain_range=(0, 0), pitch_range=(0, 0), engine='numpy')
+    assert aug_data.dtype == np.int16
+    np.testing.assert_array_equal(audio_data, aug_data)
+
+
+def test_numpy_engine_tempo_gain_pitch():
+    """
+    the tempo should scale the size, the pitch should shift the frequency without changing the 
+    size, and the gain should scale the rms of the audio
+    """
+    audio_data = sine_audio(freq=440.0)
+    for tempo, gain, pitch in [(0.8, 0, 0), (1.15, 0, 0), (1.0, 0, 400), (1.0, 0, -400), 
+                               (1.0, 6, 0), (0.85, -6, 250)]:
+        aug_data, samp_rate = tempo_gain_pitch_perturb(audio_data, sample_rate=16000, 
+            tempo_range=(tempo, tempo), gain_range=(gain, gain), pitch_range=(pitch, pitch), 
+            engine='numpy')
+        assert aug_data.dtype == np.int16
+        assert audio_data.size == pytest.approx(aug_data.size * tempo, rel=1e-3)
+        assert peak_frequency(aug_data) == pytest.approx(440.0 * 2**(pitch / 1200), rel=5e-3)
+        rms_ratio = audioop.rms(aug_data, 2) / audioop.rms(audio_data, 2)
+        assert rms_ratio == pytest.approx(10**(gain / 20), rel=2e-2)
+
+
+def test_numpy_engine_clips_gain():
+    """
+    a large gain should clip the audio to the pcm16 range instead of overflowing
+    """
+    audio_data = sine_audio()
+    aug_data, samp_rate = tempo_gain_pitch_perturb(audio_data, sample_rate=16000, 
+        tempo_range=(1.0, 1.0), gain_range=(20, 20), pitch_range=(0, 0), engine='numpy')
+    assert aug_data.max() == 2**15 - 1 and aug_data.min() == -2**15
+    assert np.all(np.sign(aug_data[audio_data != 0]) == np.sign(audio_data[audio_data != 0]))
@@ -0,0 +1,63 @@
+# third-party libraries
+import pytest
+import torch
+# project libraries
+import speech.loader as loader
+from speech.models.ctc_model_train import CTC_train
+from speech.utils.async_eval import AsyncEvaluator
+from train import eval_dev
+from tests.pytest.utils import get_model_cfg, get_preproc_cfg, write_synthetic_dataset
+
+
+def test_async_eval_matches_eval_dev(tmp_path):
+    """
+    the results of each submitted epoch should match `eval_dev` on the weights at submission
+    even if the model is updated while the job is pending
+    """
+    data_json = write_synthetic_dataset(str(tmp_path), num_examples=6)
+    preproc = loader.Preprocessor(data_json, get_preproc_cfg())
+    dev_ldr = loader.make_loader(data_json, preproc, batch_size=4, num_workers=0)
+    torch.manual_seed(0)
+    model = CTC_train(preproc.input_dim, preproc.vocab_size, get_model_cfg())
+
+    evaluator = AsyncEvaluator(
+        eval_dev, model, preproc, {"dev": data_json}, "native", batch_size=4, num_threads=1
+    )
+    expected = dict()
+    for epoch in range(2):
+        expected[epoch] = eval_dev(model, dev_ldr, preproc, None, "native")
+        evaluator.submit(epoch, model)
+        # the training continues to update the weights after the submission
+        with torch.no_grad():
+            for param in model.parameters():
+                param.add_(0.1 * torch.randn_like(param))
+
+    results = evaluator.poll() + evaluator.close()
+    assert [epoch for epoch, _, _ in results] == [0, 1]
+    for epoch, state_dict, dev_results in results:
+        loss, per = dev_results["dev"]
+        assert loss == pytest.approx(expected[epoch][0], rel=1e-4)
+        assert per == pytest.approx(expected[epoch][1])
+        assert all(tensor.device.type == "cpu" for tensor in state_dict.values())
+    assert not evaluator._process.is_alive()
+
+
+def test_async_eval_dead_process(tmp_path):
+    """
+    if the evaluation process fails to create its loaders, `submit` should raise instead of
+    blocking on the full job queue and `close` should return
+    """
+    data_json = write_synthetic_dataset(str(tmp_path), num_examples=2)
+    preproc = loader.Preprocessor(data_json, get_preproc_cfg())
+    model = CTC_train(preproc.input_dim, preproc.vocab_size, get_model_cfg())
+
+    evaluator = AsyncEvaluator(
+        eval_dev, model, preproc, {"dev": str(tmp_path / "missing.json")}, "native", 
+        num_threads=1, poll_secs=0.1
+    )
+    with pytest.raises(RuntimeError, match="missing.json"):
+        for epoch in range(3):
+            evaluator.submit(epoch, model)
+            evaluator.poll()
+    assert evaluator.close() == []
+    assert not evaluator._process.is_alive()
@@ -0,0 +1,67 @@
+# standard libraries
+import json
+import os
+# third-party libraries
+import pytest
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+# project libraries
+import speech.loader as loader
+from speech.models.ctc_model_train import CTC_train
+from train import eval_dev
+from tests.pytest.utils import get_model_cfg, get_preproc_cfg, write_synthetic_dataset
+
+
+def test_eval_batch_sampler_covers_dataset():
+    """
+    the replicas should together yield every index exactly once, including the partial batch
+    """
+    dataset = list(range(23))
+    for num_replicas in [1, 2, 3, 4]:
+        indices = list()
+        for rank in range(num_replicas):
+            sampler = loader.DistributedEvalBatchSampler(dataset, 4, num_replicas, rank)
+            batches = list(sampler)
+            assert len(batches) == len(sampler)
+            assert all(0 < len(batch) <= 4 for batch in batches)
+            indices.extend(idx for batch in batches for idx in batch)
+        assert sorted(indices) == dataset
+
+
+def _eval_rank(rank:int, world_size:int, data_json:str, tmp_dir:str):
+    dist.init_process_group(
+        "gloo", init_method=f"file://{tmp_dir}/dist_init", rank=rank, world_size=world_size
+    )
+    torch.set_num_threads(1)
+    preproc = loader.Preprocessor(data_json, get_preproc_cfg())
+    torch.manual_seed(0)
+    model = CTC_train(preproc.input_dim, preproc.vocab_size, get_model_cfg())
+    dev_ldr = loader.make_eval_loader(data_json, preproc, batch_size=2, num_workers=0)
+    loss, per = eval_dev(model, dev_ldr, preproc, None, "native", distributed=True)
+    with open(os.path.join(tmp_dir, f"rank_{rank}.json"), 'w') as fid:
+        json.dump([loss, per], fid)
+    dist.destroy_process_group()
+
+
+@pytest.mark.parametrize("world_size", [2, 3])
+def test_distributed_eval_dev_is_exact(tmp_path, world_size):
+    """
+    every rank should return the loss and PER of the full dev set from a single process
+    """
+    data_json = write_synthetic_dataset(str(tmp_path / "data"), num_examples=7)
+    mp.spawn(_eval_rank, args=(world_size, data_json, str(tmp_path)), nprocs=world_size)
+
+    preproc = loader.Preprocessor(data_json, get_preproc_cfg())
+    torch.manual_seed(0)
+    model = CTC_train(preproc.input_dim, preproc.vocab_size, get_model_cfg())
+    dev_ldr = loader.make_eval_loader(
+        data_json, preproc, batch_size=2, num_workers=0, num_replicas=1, rank=0
+    )
+    expected_loss, expected_per = eval_dev(model, dev_ldr, preproc, None, "native")
+
+    for rank in range(world_size):
+        with open(tmp_path / f"rank_{rank}.json") as fid:
+            loss, per = json.load(fid)
+        assert loss == pytest.approx(expected_loss, rel=1e-5)
+        assert per == pytest.approx(expected_per)
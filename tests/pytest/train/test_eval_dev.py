@@ -0,0 +1,64 @@
+# third-party libraries
+import pytest
+import torch
+# project libraries
+import speech
+import speech.loader as loader
+from speech.models.batch_decoder import BatchDecoder
+from speech.models.ctc_decoder import decode
+from speech.models.ctc_model_train import CTC_train
+from speech.models.greedy_decoder import collapse_repeats
+from train import eval_dev, native_loss
+from tests.pytest.utils import get_model_cfg, get_preproc_cfg, write_synthetic_dataset
+
+
+def test_eval_dev_single_pass(tmp_path):
+    """
+    the loss and error rate from one forward pass should match a separate loss and decoding
+    of each example, with the greedy decoder and the beam search with and without the 
+    decoding pool
+    """
+    data_json = write_synthetic_dataset(str(tmp_path), num_examples=8)
+    preproc = loader.Preprocessor(data_json, get_preproc_cfg())
+    dev_ldr = loader.make_loader(data_json, preproc, batch_size=4, num_workers=0)
+    torch.manual_seed(0)
+    model = CTC_train(preproc.input_dim, preproc.vocab_size, get_model_cfg())
+
+    model.eval()
+    losses, results, greedy_results = list(), list(), list()
+    with torch.no_grad():
+        for batch in dev_ldr:
+            batch = list(batch)
+            inputs, labels, input_lens, label_lens = model.collate(*batch)
+            out, _ = model(inputs, lengths=input_lens)
+            losses.append(native_loss(out, labels, input_lens, label_lens, model.blank).item())
+            for example, label, length in zip(batch[0], batch[1], input_lens):
+                # each example is decoded from its own unpadded forward pass
+                probs, _ = model(torch.from_numpy(example)[None], softmax=True)
+                assert probs.shape[1] == length
+                pred = decode(probs[0].numpy(), beam_size=3, blank=model.blank)[0][0]
+                results.append((preproc.decode(label), preproc.decode(pred)))
+                greedy_pred = collapse_repeats(probs[0].argmax(dim=1).numpy(), model.blank)
+                greedy_results.append((preproc.decode(label), preproc.decode(greedy_pred)))
+    expected_loss = sum(losses) / len(losses)
+    expected_cer = speech.compute_cer(results)
+
+    loss, cer = eval_dev(model, dev_ldr, preproc, None, "native")
+    assert loss == pytest.approx(expected_loss, rel=1e-5)
+    assert cer == pytest.approx(speech.compute_cer(greedy_results))
+
+    for decode_workers in [0, 2]:
+        loss, cer = eval_dev(model, dev_ldr, preproc, None, "native", decode_workers=decode_workers,
+                             dev_decoder="beam")
+        assert loss == pytest.approx(expected_loss, rel=1e-5)
+        assert cer == pytest.approx(expected_cer)
+        assert model.training
+
+    # a decoder that is passed in is kept open across the evaluations
+    with BatchDecoder(num_workers=2, beam_size=3, blank=model.blank, log_input=True) as decoder:
+        for _ in range(2):
+            loss, cer = eval_dev(model, dev_ldr, preproc, None, "native", dev_decoder="beam", 
+                                 decoder=decoder)
+            assert cer == pytest.approx(expected_cer)
+            assert decoder._pool is not None
+
@@ -0,0 +1,74 @@
+# third-party libraries
+import pytest
+import torch
+import torch.nn as nn
+# project libraries
+from speech.utils.model_debug import (
+    check_nan_params_grads, layer_norms, list_nonfinite_steps, params_nonfinite, 
+    save_nonfinite_step
+)
+
+
+def get_model_with_grads():
+    torch.manual_seed(0)
+    model = nn.Sequential(nn.Linear(4, 3), nn.ReLU(), nn.Linear(3, 2))
+    model(torch.randn(5, 4)).sum().backward()
+    return model
+
+
+@pytest.mark.parametrize("bad_value", [float('nan'), float('inf')])
+def test_params_nonfinite(bad_value):
+    """
+    the fused check should find a single NaN or inf value in the parameters or gradients
+    """
+    model = get_model_with_grads()
+    assert not params_nonfinite(model.parameters(), check_grads=True)
+    assert not check_nan_params_grads(model.parameters())
+
+    model[2].weight.grad[0, 1] = bad_value
+    assert not params_nonfinite(model.parameters())
+    assert params_nonfinite(model.parameters(), check_grads=True)
+
+    with torch.no_grad():
+        model[0].bias[2] = bad_value
+    assert params_nonfinite(model.parameters())
+
+
+def test_save_nonfinite_step(tmp_path):
+    """
+    the saved step should contain the batch on the cpu and the norms of every layer
+    """
+    model = get_model_with_grads()
+    model[0].weight.grad.fill_(float('nan'))
+    inputs = torch.randn(2, 10, 4)
+    save_path = save_nonfinite_step(
+        str(tmp_path / "ckpt"), 7, 1, {"inputs": inputs, "loss": 3.0}, model.named_parameters()
+    )
+    assert save_path.endswith("nonfinite_step_7_rank_1.pth")
+
+    step_state = torch.load(save_path)
+    assert step_state["iter_count"] == 7
+    assert torch.equal(step_state["batch"]["inputs"], inputs)
+    assert step_state["batch"]["loss"] == 3.0
+
+    norms = step_state["layer_norms"]
+    assert list(norms) == [name for name, _ in model.named_parameters()]
+    assert norms["0.weight"]["grad"] != norms["0.weight"]["grad"]
+    assert norms["2.bias"] == pytest.approx(
+        {"param": model[2].bias.norm().item(), "grad": model[2].bias.grad.norm().item()}
+    )
+    assert layer_norms(model.named_parameters())["2.weight"]["param"] == \
+        pytest.approx(model[2].weight.norm().item())
+
+
+def test_list_nonfinite_steps(tmp_path):
+    """
+    the saved steps of each rank should be listed so the captures can be bounded across epochs
+    """
+    model = get_model_with_grads()
+    save_dir = str(tmp_path / "ckpt")
+    assert list_nonfinite_steps(save_dir, 0) == []
+    paths = [save_nonfinite_step(save_dir, iter_count, rank, {"loss": 1.0}, model.named_parameters())
+             for iter_count, rank in [(3, 0), (4, 1), (12, 0)]]
+    assert list_nonfinite_steps(save_dir, 0) == sorted([paths[0], paths[2]])
+    assert list_nonfinite_steps(save_dir, 1) == [paths[1]]
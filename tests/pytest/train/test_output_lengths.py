@@ -0,0 +1,38 @@
+# third-party libraries
+import numpy as np
+import torch
+# project libraries
+from speech.models.ctc_model_train import CTC_train
+from tests.pytest.utils import get_model_cfg
+
+
+def test_packed_batch_matches_single_examples():
+    """
+    the output lengths should match the single-example forward and the outputs of each example
+    in a padded batch should not depend on the padding
+    """
+    torch.manual_seed(0)
+    model = CTC_train(20, 10, get_model_cfg())
+    model.eval()
+
+    rng = np.random.RandomState(0)
+    inputs = [rng.randn(n_frames, 20).astype(np.float32) for n_frames in [37, 12, 25, 1]]
+    labels = [[1, 2], [3], [4, 5, 6], [7]]
+    x, y, x_lens, y_lens = model.collate(inputs, labels)
+    assert x_lens.dtype == torch.int32
+    for inp, x_len in zip(inputs, x_lens):
+        assert x_len == model.conv_out_size(inp.shape[0] + 2 * model.time_pad, 0)
+
+    with torch.no_grad():
+        batch_out, _ = model(x, lengths=x_lens)
+        for idx, inp in enumerate(inputs):
+            single_out, _ = model(torch.from_numpy(inp)[None])
+            assert single_out.shape[1] == x_lens[idx]
+            torch.testing.assert_close(batch_out[idx, :x_lens[idx]], single_out[0], atol=1e-5, rtol=1e-4)
+
+        # the rnn outputs after the end of each example are zero
+        encoded, _ = model.encode(
+            torch.nn.functional.pad(x, (0, 0, model.time_pad, model.time_pad)), lengths=x_lens
+        )
+        for idx, x_len in enumerate(x_lens):
+            assert torch.all(encoded[idx, x_len:] == 0)
@@ -0,0 +1,69 @@
+# standard libraries
+import json
+import time
+# project libraries
+from speech.utils.step_profiler import StepProfiler
+
+
+class ScalarRecorder():
+    """Records the calls to `add_scalars` like a tensorboard writer"""
+
+    def __init__(self):
+        self.calls = list()
+
+    def add_scalars(self, tag, scalars, step):
+        self.calls.append((tag, scalars, step))
+
+
+def run_steps(profiler, writer, num_steps):
+    for step in range(num_steps):
+        profiler.start_step(step)
+        with profiler.phase("forward"):
+            time.sleep(0.002)
+        with profiler.phase("backward"):
+            pass
+        summary = profiler.end_step(writer)
+        if summary is not None:
+            forward_stats = summary["forward"]
+            assert set(forward_stats) == {"mean", "p50", "p90", "p99", "per_step"}
+            assert 2.0 <= forward_stats["p50"] <= forward_stats["p99"]
+
+
+def test_profiler_summaries_and_trace(tmp_path):
+    """
+    the summaries should be written every `log_every` steps and the trace should hold the
+    phases of the steps in the trace window
+    """
+    trace_path = str(tmp_path / "profile" / "trace.json")
+    profiler = StepProfiler(log_every=3, trace_steps=(2, 4), trace_path=trace_path)
+    writer = ScalarRecorder()
+    run_steps(profiler, writer, num_steps=6)
+
+    assert [(tag, step) for tag, _, step in writer.calls] == [
+        ("profile/per_step", 2), ("profile/p99", 2), ("profile/per_step", 5), ("profile/p99", 5)
+    ]
+    assert all(set(scalars) == {"forward", "backward"} for _, scalars, _ in writer.calls)
+    per_step, p99 = writer.calls[0][1], writer.calls[1][1]
+    assert 2.0 <= per_step["forward"] and 2.0 <= p99["forward"]
+    assert per_step["backward"] < per_step["forward"]
+
+    with open(trace_path) as fid:
+        trace = json.load(fid)
+    events = trace["traceEvents"]
+    assert [(event["name"], event["args"]["step"]) for event in events] == [
+        ("forward", 2), ("backward", 2), ("forward", 3), ("backward", 3)
+    ]
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in events)
+    assert events[0]["ts"] + events[0]["dur"] <= events[1]["ts"]
+
+
+def test_disabled_profiler_records_nothing():
+    """
+    a disabled profiler should use a shared no-op phase and not write any scalars
+    """
+    profiler = StepProfiler(enabled=False, log_every=1)
+    writer = ScalarRecorder()
+    assert profiler.phase("forward") is profiler.phase("backward")
+    run_steps(profiler, writer, num_steps=3)
+    profiler.record("data_wait", 0.0, 1.0)
+    assert writer.calls == [] and len(profiler.durations) == 0
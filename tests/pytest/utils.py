@@ -19,3 +19,75 @@ def get_all_test_audio():
     test_audio_dir = os.path.join(system_main_dir, common_path)
     pattern = "*"
     return glob.glob(os.path.join(test_audio_dir, pattern))
+
+
+def get_preproc_cfg(preprocessor:str='log_spectrogram')->dict:
+    """Returns a preprocessor config with all augmentations turned off
+    """
+    return {
+        'preprocessor': preprocessor,
+        'blank_idx': 'last',
+        'window_size': 32,
+        'step_size': 16,
+        'use_feature_normalize': False,
+        'augment_from_normal': False,
+        'tempo_gain_pitch_perturb': False,
+        'tempo_range': [0.85, 1.15],
+        'gain_range': [-6, 8],
+        'pitch_range': [-400, 400],
+        'synthetic_gaussian_noise': False,
+        'background_noise': False,
+        'spec_augment': False,
+        'spec_augment_policy': {}
+    }
+
+
+def get_model_cfg()->dict:
+    """Returns a small CTC model config with the three conv-layer encoder of the ctc configs
+    """
+    return {
+        'dropout': 0.1,
+        'blank_idx': 'last',
+        'encoder': {
+            'conv': [
+                [8, 5, 11, 1, 2, 0, 5],
+                [8, 5, 11, 1, 2, 0, 5],
+                [8, 5, 11, 1, 1, 0, 5]
+            ],
+            'rnn': {
+                'type': 'GRU',
+                'dim': 16,
+                'bidirectional': False,
+                'layers': 1
+            }
+        }
+    }
+
+
+def write_synthetic_dataset(data_dir:str, num_examples:int=8, samp_rate:int=16000, 
+                            seed:int=0)->str:
+    """Writes `num_examples` random wav files of different durations and a dataset json file
+    with random phoneme labels into `data_dir`. Returns the path to the dataset json.
+    """
+    import json
+    import numpy as np
+    from speech.utils.wave import array_to_wave
+
+    os.makedirs(data_dir, exist_ok=True)
+    rng = np.random.RandomState(seed)
+    phonemes = ['aa', 'ae', 'ah', 'b', 'd', 'iy', 'k', 's', 't', 'z']
+    data_json = os.path.join(data_dir, "data.json")
+    with open(data_json, 'w') as fid:
+        for i in range(num_examples):
+            duration = round(rng.uniform(0.5, 2.0), 2)
+            n_samples = int(duration * samp_rate)
+            # a sine wave with noise so the spectrogram has no zero-valued bins
+            t = np.arange(n_samples) / samp_rate
+            audio = 3000 * np.sin(2 * np.pi * rng.uniform(100, 1000) * t) \
+                + rng.normal(0, 500, n_samples)
+            audio_path = os.path.join(data_dir, f"audio_{i}.wav")
+            array_to_wave(audio_path, audio.astype(np.int16), samp_rate)
+            text = list(rng.choice(phonemes, size=rng.randint(2, 12)))
+            json.dump({'audio': audio_path, 'duration': duration, 'text': text}, fid)
+            fid.write("\n")
+    return data_json
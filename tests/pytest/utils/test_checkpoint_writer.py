@@ -0,0 +1,131 @@
+# standard libraries
+import os
+import pickle
+import threading
+# third-party libraries
+import pytest
+import torch
+# project libraries
+from speech.utils.checkpoint import AsyncCheckpointWriter, DirectorySync, LocalStorage, snapshot_to_cpu
+
+
+def test_snapshot_is_a_copy():
+    """
+    the snapshot should not change when the model is updated and should load into the model
+    """
+    model = torch.nn.Sequential(torch.nn.Linear(3, 2), torch.nn.BatchNorm1d(2))
+    snapshot = snapshot_to_cpu(model.state_dict())
+    expected = {key: value.clone() for key, value in model.state_dict().items()}
+    with torch.no_grad():
+        for param in model.parameters():
+            param.add_(1.0)
+
+    for key, value in expected.items():
+        assert torch.equal(snapshot[key], value)
+    assert snapshot._metadata == model.state_dict()._metadata
+    model.load_state_dict(snapshot)
+    assert snapshot_to_cpu({"a": [1, (2.0, "b")]}) == {"a": [1, (2.0, "b")]}
+
+
+def test_writer_saves_and_uploads(tmp_path):
+    """
+    the files should be written locally and uploaded to the storage backend, and the
+    callbacks should report each job
+    """
+    local_dir, remote_dir = tmp_path / "local", tmp_path / "remote"
+    local_dir.mkdir()
+    completed, failed = list(), list()
+    writer = AsyncCheckpointWriter(
+        LocalStorage(str(remote_dir)), 
+        str(local_dir), 
+        remote_dir="run_1",
+        on_complete=completed.append,
+        on_failure=lambda name, err: failed.append((name, err))
+    )
+    model = torch.nn.Linear(3, 2)
+    writer.save("ckpt", {"model.pth": model.state_dict(), "state.pickle": pickle.dumps({"step": 5})})
+    writer.upload("missing_file")
+    writer.close()
+
+    assert completed == ["ckpt"]
+    assert [name for name, _ in failed] == ["missing_file"]
+    assert writer.failures == failed
+    for path in (local_dir / "model.pth", remote_dir / "run_1" / "model.pth"):
+        state_dict = torch.load(str(path))
+        assert torch.equal(state_dict["weight"], model.weight.detach())
+    with open(remote_dir / "run_1" / "state.pickle", 'rb') as fid:
+        assert pickle.load(fid) == {"step": 5}
+    assert sorted(p.name for p in local_dir.iterdir()) == ["model.pth", "state.pickle"]
+    with pytest.raises(RuntimeError):
+        writer.upload("model.pth")
+
+
+def test_writer_queue_is_bounded(tmp_path):
+    """
+    `submit` should block while `max_pending` jobs are waiting
+    """
+    writer = AsyncCheckpointWriter(LocalStorage(str(tmp_path)), str(tmp_path), max_pending=1)
+    release = threading.Event()
+    writer.submit("blocking", release.wait)
+    writer.submit("queued", lambda: None)
+
+    submitter = threading.Thread(target=writer.submit, args=("blocked", lambda: None))
+    submitter.start()
+    submitter.join(timeout=0.2)
+    assert submitter.is_alive()
+
+    release.set()
+    submitter.join(timeout=5)
+    assert not submitter.is_alive()
+    writer.close()
+
+
+class CountingStorage(LocalStorage):
+    """Local storage that records the uploads and fails on the paths in `fail_paths`"""
+
+    def __init__(self, root_dir):
+        super().__init__(root_dir)
+        self.uploads = list()
+        self.fail_paths = set()
+
+    def upload(self, local_path, remote_path):
+        if remote_path in self.fail_paths:
+            raise IOError(f"upload of {remote_path} failed")
+        self.uploads.append(remote_path)
+        super().upload(local_path, remote_path)
+
+
+def test_directory_sync_is_incremental(tmp_path):
+    """
+    only new and changed files should be uploaded and the manifest should persist across
+    sync objects
+    """
+    local_dir = tmp_path / "train"
+    (local_dir / "loss").mkdir(parents=True)
+    (local_dir / "events.1").write_bytes(b"abc")
+    (local_dir / "loss" / "events.2").write_bytes(b"def")
+    storage = CountingStorage(str(tmp_path / "remote"))
+    manifest_path = str(tmp_path / "sync.json")
+
+    uploaded = DirectorySync(storage, manifest_path).sync(str(local_dir), "run/train")
+    assert sorted(uploaded) == ["run/train/events.1", "run/train/loss/events.2"]
+    assert (tmp_path / "remote" / "run" / "train" / "loss" / "events.2").read_bytes() == b"def"
+
+    # a growing event file is uploaded, a touched file with the same contents is not
+    syncer = DirectorySync(storage, manifest_path)
+    with open(local_dir / "events.1", 'ab') as fid:
+        fid.write(b"ghi")
+    stat = os.stat(local_dir / "loss" / "events.2")
+    os.utime(local_dir / "loss" / "events.2", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert syncer.sync(str(local_dir), "run/train") == ["run/train/events.1"]
+    assert syncer.sync(str(local_dir), "run/train") == []
+    assert (tmp_path / "remote" / "run" / "train" / "events.1").read_bytes() == b"abcghi"
+
+    # a failed upload is retried at the next sync
+    (local_dir / "events.3").write_bytes(b"jkl")
+    storage.fail_paths.add("run/train/events.3")
+    with pytest.raises(IOError):
+        syncer.sync(str(local_dir), "run/train")
+    storage.fail_paths.clear()
+    assert syncer.sync(str(local_dir), "run/train") == ["run/train/events.3"]
+    assert storage.uploads.count("run/train/events.1") == 2
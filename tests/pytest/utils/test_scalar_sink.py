@@ -0,0 +1,91 @@
+# standard libraries
+import csv
+import json
+# third-party libraries
+import pytest
+# project libraries
+from speech.utils.scalar_sink import get_file_backend, ScalarSink
+
+
+class ListBackend():
+    """Backend that keeps the written points in a list"""
+
+    def __init__(self):
+        self.points = list()
+        self.closed = False
+
+    def write(self, main_tag, tag_scalar_dict, step, wall_time):
+        self.points.append((main_tag, tag_scalar_dict, step))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.mark.parametrize("reduce", ["mean", "last"])
+def test_scalar_sink_reduces_values(reduce):
+    """
+    every `log_every` values of a tag should be reduced to one point at the last step and
+    the partial values should be written by `flush`
+    """
+    backend = ListBackend()
+    sink = ScalarSink([backend], log_every=4, reduce=reduce, flush_secs=60)
+    for step in range(10):
+        sink.add_scalars('train/loss', {"loss": float(step), "avg_loss": 2.0 * step}, step)
+        sink.add_scalars('train/grad', {"grad_norm": 1.0}, step)
+    sink.flush()
+
+    loss_points = [(d, step) for tag, d, step in backend.points if tag == 'train/loss']
+    if reduce == "mean":
+        expected = [({"loss": 1.5, "avg_loss": 3.0}, 3), ({"loss": 5.5, "avg_loss": 11.0}, 7),
+                    ({"loss": 8.5, "avg_loss": 17.0}, 9)]
+    else:
+        expected = [({"loss": 3.0, "avg_loss": 6.0}, 3), ({"loss": 7.0, "avg_loss": 14.0}, 7),
+                    ({"loss": 9.0, "avg_loss": 18.0}, 9)]
+    assert loss_points == expected
+    assert [step for tag, _, step in backend.points if tag == 'train/grad'] == [3, 7, 9]
+
+    sink.close()
+    assert backend.closed
+    with pytest.raises(AssertionError):
+        sink.add_scalars('train/loss', {"loss": 0.0}, 10)
+
+
+def test_scalar_sink_file_backends(tmp_path):
+    """
+    the csv and jsonl backends should contain the same points with the tensorboard tag names
+    """
+    csv_path, jsonl_path = str(tmp_path / "scalars.csv"), str(tmp_path / "scalars.jsonl")
+    sink = ScalarSink([get_file_backend(csv_path), get_file_backend(jsonl_path)], log_every=2)
+    for step in range(4):
+        sink.add_scalars('train/loss', {"loss": float(step)}, step)
+    sink.close()
+
+    with open(csv_path) as fid:
+        rows = list(csv.DictReader(fid))
+    assert [(row["step"], row["main_tag"], row["tag"], float(row["value"])) for row in rows] == \
+        [("1", "train/loss", "loss", 0.5), ("3", "train/loss", "loss", 2.5)]
+    with open(jsonl_path) as fid:
+        points = [json.loads(line) for line in fid]
+    assert [(point["step"], point["scalars"]) for point in points] == \
+        [(1, {"loss": 0.5}), (3, {"loss": 2.5})]
+
+    with pytest.raises(ValueError):
+        get_file_backend(str(tmp_path / "scalars.txt"))
+
+
+def test_scalar_sink_unreduced_points():
+    """
+    the scalars added with `reduce=False` should be written as they are at their own step
+    """
+    backend = ListBackend()
+    sink = ScalarSink([backend], log_every=4, flush_secs=60)
+    sink.add_scalars('profile/forward', {"p50": 2.0, "p99": 5.0}, 3, reduce=False)
+    sink.add_scalars('train/loss', {"loss": 1.0}, 3)
+    sink.flush()
+    assert backend.points == [
+        ('profile/forward', {"p50": 2.0, "p99": 5.0}, 3), ('train/loss', {"loss": 1.0}, 3)
+    ]
+    sink.close()
@@ -1,12 +1,14 @@
 # standard libraries
 import argparse
 import contextlib
+from collections import deque
 import os
 import itertools
 import json
 import logging
 import math
 from pathlib import Path
+import pickle
 import random
 import time
 # third-party libraries
@@ -23,13 +25,24 @@ import yaml
 # project libraries
 import speech
 import speech.loader as loader
+from speech.models.batch_decoder import BatchDecoder
 from speech.models.ctc_model_train import CTC_train
-from speech.utils.checkpoint import GCSCheckpointHandler
-from speech.utils.io import load_config, load_from_trained, read_pickle, save, write_pickle 
+from speech.models.greedy_decoder import greedy_decode
+from speech.utils.async_eval import AsyncEvaluator
+from speech.utils.checkpoint import AsyncCheckpointWriter, GCSCheckpointHandler
+from speech.utils.data_structs import TensorBatch
+from speech.utils.feature_cache import build_feature_cache, FeatureCache
+from speech.utils.io import (
+    get_train_checkpoint, load_config, load_from_trained, load_train_checkpoint, read_pickle, save, 
+    save_state_dict, save_train_checkpoint, TRAIN_CKPT, write_pickle
+)
 from speech.utils.logging import get_logger, get_logger_filename
+from speech.utils.scalar_sink import get_file_backend, ScalarSink, TensorboardBackend
+from speech.utils.step_profiler import StepProfiler
 from speech.utils.model_debug import (
-    check_nan_params_grads, log_batchnorm_mean_std, log_cpu_mem_disk_usage, log_model_grads,
-    log_param_grad_norms, plot_grad_flow_line, plot_grad_flow_bar, save_batch_log_stats
+    log_batchnorm_mean_std, log_cpu_mem_disk_usage, log_model_grads, log_param_grad_norms, 
+    params_nonfinite, plot_grad_flow_line, plot_grad_flow_bar, save_batch_log_stats, 
+    list_nonfinite_steps, save_nonfinite_step
 )
 
 
@@ -45,7 +58,15 @@ def run_epoch(model,
               loss_name:str, 
               save_path:str,
               gcs_ckpt_handler,
-              scaler:GradScaler=None)->tuple:
+              scaler:GradScaler=None,
+              lr_scheduler=None,
+              train_state:dict=None,
+              ckpt_writer:AsyncCheckpointWriter=None,
+              profiler:StepProfiler=None,
+              nan_check_every:int=1,
+              skip_nonfinite_steps:bool=False,
+              scalar_sink:ScalarSink=None,
+              max_nonfinite_captures:int=1)->tuple:
     """
     Performs a forwards and backward pass through the model
     Args:
@@ -54,6 +75,21 @@ def run_epoch(model,
         gcs_ckpt_handler: facilities saving files to google cloud storage
         scaler (GradScaler): gradient scaler to prevent gradient underflow when autocast
             uses float16 precision for forward pass
+        lr_scheduler: learning rate scheduler saved in the full training checkpoint
+        train_state (dict): if not None, the mid-epoch checkpoints include a full training 
+            checkpoint with this dict of `start_epoch` and `best_so_far`
+        ckpt_writer (AsyncCheckpointWriter): if not None, the mid-epoch checkpoints are copied
+            to cpu memory and written and uploaded in the background
+        profiler (StepProfiler): if not None, times the phases of each step
+        nan_check_every (int): number of steps between the checks of the parameters for NaN or
+            inf values. the gradients are checked every step from the clipped gradient norm.
+            if zero, the parameters aren't checked.
+        skip_nonfinite_steps (bool): if true, the optimizer step is skipped when the gradients 
+            have NaN or inf values. with amp, the gradient scaler already skips these steps.
+        scalar_sink (ScalarSink): if not None, the per-iteration scalars are buffered and 
+            written in the background instead of with `tbX_writer`
+        max_nonfinite_captures (int): maximum number of steps with NaN or inf values that each
+            rank saves to `save_path`, including the steps saved in earlier epochs or runs
     Returns:
         Tuple[int, float]: train state of # batch iterations and average loss
     """
@@ -66,46 +102,96 @@ def run_epoch(model,
     model_t, data_t = 0.0, 0.0
     end_t = time.time()
 
+    # the per-iteration scalars go through the sink if there is one
+    scalar_writer = scalar_sink if scalar_sink is not None else tbX_writer
+
     # progress bar for rank_0 process
     tq = tqdm.tqdm(train_ldr)  if is_rank_0 else train_ldr
     
     # counter for model checkpointing
     batch_counter = 0
+    # a resumed epoch has fewer batches, so the interval is at least one batch
+    ckpt_interval = max(len(train_ldr) // gcs_ckpt_handler.chkpt_per_epoch, 1)
+    sampler = loader.get_resumable_sampler(train_ldr)
     device = torch.device("cuda:" + str(local_rank))
     
     # if scaler is enabled, amp is being used
     use_amp = scaler.is_enabled()
     print(f"Amp is being used: {use_amp}")
+
+    # the saved steps are counted so the NaN parameters don't save every remaining step
+    rank = torch.distributed.get_rank()
+    num_nonfinite_captures = len(list_nonfinite_steps(save_path, rank))
+
+    # a disabled profiler's phases are no-op context managers
+    if profiler is None:
+        profiler = StepProfiler(enabled=False)
+    step_end_t = profiler.clock()
     
     # training loop
     for batch in tq:
+        profiler.start_step(iter_count)
+        profiler.record("data_wait", step_end_t, profiler.clock())
         if use_log: logger.info(f"train: ====== Iteration: {iter_count} in run_epoch =======")
         
         ##############  Mid-epoch checkpoint ###############
         if is_rank_0 \
-        and batch_counter % (len(train_ldr) // gcs_ckpt_handler.chkpt_per_epoch) == 0 \
+        and batch_counter % ckpt_interval == 0 \
         and batch_counter != 0:
-            preproc = train_ldr.dataset.preproc
-            save(model.module, preproc, save_path, tag='ckpt')
-            gcs_ckpt_handler.upload_to_gcs("ckpt_model_state_dict.pth")
-            gcs_ckpt_handler.upload_to_gcs("ckpt_preproc.pyc")
-            # save the run_sate
-            ckpt_state_path = os.path.join(save_path, "ckpt_run_state.pickle")
-            write_pickle(ckpt_state_path, {'run_state': (iter_count, avg_loss)})
-            gcs_ckpt_handler.upload_to_gcs("ckpt_run_state.pickle")
-            # checkpoint tensorboard
-            gcs_ckpt_handler.upload_tensorboard_ckpt()    
+            with profiler.phase("checkpoint"):
+                preproc = train_ldr.dataset.preproc
+                sampler_state = sampler.state_dict(batch_counter) if sampler is not None else None
+                # the writer copies the states to cpu and writes and uploads them in the background
+                if ckpt_writer is not None:
+                    ckpt_files = {
+                        "ckpt_model_state_dict.pth": model.module.state_dict(),
+                        "ckpt_preproc.pyc": pickle.dumps(preproc),
+                        "ckpt_run_state.pickle": pickle.dumps({'run_state': (iter_count, avg_loss)})
+                    }
+                    if train_state is not None:
+                        ckpt_files[TRAIN_CKPT] = get_train_checkpoint(
+                            model.module, optimizer, lr_scheduler, scaler, sampler_state,
+                            dict(train_state, run_state=(iter_count, avg_loss))
+                        )
+                    ckpt_writer.save("ckpt", ckpt_files)
+                    ckpt_writer.submit("tensorboard", gcs_ckpt_handler.upload_tensorboard_ckpt)
+                else:
+                    save(model.module, preproc, save_path, tag='ckpt')
+                    gcs_ckpt_handler.upload_to_gcs("ckpt_model_state_dict.pth")
+                    gcs_ckpt_handler.upload_to_gcs("ckpt_preproc.pyc")
+                    # save the run_sate
+                    ckpt_state_path = os.path.join(save_path, "ckpt_run_state.pickle")
+                    write_pickle(ckpt_state_path, {'run_state': (iter_count, avg_loss)})
+                    gcs_ckpt_handler.upload_to_gcs("ckpt_run_state.pickle")
+                    # the full checkpoint resumes training from the next batch of this epoch
+                    if train_state is not None:
+                        save_train_checkpoint(
+                            os.path.join(save_path, TRAIN_CKPT), 
+                            model.module, 
+                            optimizer, 
+                            lr_scheduler, 
+                            scaler,
+                            sampler_state,
+                            dict(train_state, run_state=(iter_count, avg_loss))
+                        )
+                        gcs_ckpt_handler.upload_to_gcs(TRAIN_CKPT)
+                    # checkpoint tensorboard
+                    gcs_ckpt_handler.upload_tensorboard_ckpt()
         
         batch_counter += 1
         ####################################################
 
+        # a TensorBatch is already padded and pinned by the loader workers
+        is_tensor_batch = isinstance(batch, TensorBatch)
         # convert the temprorary generator batch to a permanent list
-        batch = list(batch) 
+        if not is_tensor_batch:
+            batch = list(batch) 
         
         # save the batch information
         if use_log: 
             if debug_mode:  
-                save_batch_log_stats(batch, logger)
+                if not is_tensor_batch:
+                    save_batch_log_stats(batch, logger)
                 log_batchnorm_mean_std(model.module.state_dict(), logger)
  
         start_t = time.time()
@@ -114,21 +200,29 @@ def run_epoch(model,
         #  will autocast to lower precision if amp is used. otherwise, it's no-operation
         with autocast(enabled = use_amp):
             # unpack the batch 
-            inputs, labels, input_lens, label_lens = model.module.collate(*batch)
-            inputs = inputs.cuda() #.to(device) #.cuda(local_rank)
-            out, rnn_args = model(inputs, softmax=False)
+            with profiler.phase("collate"):
+                if is_tensor_batch:
+                    inputs, labels, input_lens, label_lens = model.module.collate_tensors(batch)
+                else:
+                    inputs, labels, input_lens, label_lens = model.module.collate(*batch)
+            with profiler.phase("host_to_device"):
+                inputs = inputs.cuda(non_blocking=is_tensor_batch) #.to(device) #.cuda(local_rank)
+            with profiler.phase("forward"):
+                out, rnn_args = model(inputs, softmax=False, lengths=input_lens)
             
             # use the loss function defined in `loss_name`
-            if loss_name == "native":
-                loss = native_loss(out, labels, input_lens, label_lens, model.module.blank)
-            elif loss_name == "awni":
-                loss = awni_loss(out, labels, input_lens, label_lens, model.module.blank)
-            elif loss_name == "naren":
-                loss = naren_loss(out, labels, input_lens, label_lens, model.module.blank)
+            with profiler.phase("loss_" + loss_name):
+                if loss_name == "native":
+                    loss = native_loss(out, labels, input_lens, label_lens, model.module.blank)
+                elif loss_name == "awni":
+                    loss = awni_loss(out, labels, input_lens, label_lens, model.module.blank)
+                elif loss_name == "naren":
+                    loss = naren_loss(out, labels, input_lens, label_lens, model.module.blank)
        
         # backward pass 
-        loss = loss.cuda()      # amp needs the loss to be on cuda
-        scaler.scale(loss).backward() 
+        with profiler.phase("backward"):
+            loss = loss.cuda()      # amp needs the loss to be on cuda
+            scaler.scale(loss).backward() 
         
         if use_log: 
             if debug_mode: 
@@ -136,10 +230,17 @@ def run_epoch(model,
                 log_param_grad_norms(model.module.named_parameters(), logger)
 
         # gradient clipping and optimizer step, scaling disabled if amp is not used
-        scaler.unscale_(optimizer)
-        grad_norm = nn.utils.clip_grad_norm_(model.parameters(), 200).item()
-        scaler.step(optimizer)
-        scaler.update()
+        with profiler.phase("clip"):
+            scaler.unscale_(optimizer)
+            grad_norm = nn.utils.clip_grad_norm_(model.parameters(), 200).item()
+        # the total norm is NaN or inf if any gradient is. with amp, the scaler handles these steps
+        grads_nonfinite = not use_amp and not math.isfinite(grad_norm)
+        with profiler.phase("optimizer_step"):
+            if grads_nonfinite and skip_nonfinite_steps:
+                print(f"\n~~~ optimizer step skipped at iter {iter_count}: grad_norm is {grad_norm} ~~~\n")
+            else:
+                scaler.step(optimizer)
+            scaler.update()
 
         # logging in rank_0 process
         if is_rank_0:
@@ -165,8 +266,8 @@ def run_epoch(model,
                 avg_grad_norm = exp_w * avg_grad_norm + (1 - exp_w) * grad_norm
             
             # writing to the tensorboard log files
-            tbX_writer.add_scalars('train/loss', {"loss": loss}, iter_count)
-            tbX_writer.add_scalars('train/loss', {"avg_loss": avg_loss}, iter_count)
+            scalar_writer.add_scalars('train/loss', {"loss": loss}, iter_count)
+            scalar_writer.add_scalars('train/loss', {"avg_loss": avg_loss}, iter_count)
             
             # adding this to suppress a tbX WARNING about inf values
             # TODO, this may or may not be a good idea as it masks inf in tensorboard
@@ -174,7 +275,7 @@ def run_epoch(model,
                 tbX_grad_norm = 1
             else:
                 tbX_grad_norm  = grad_norm
-            tbX_writer.add_scalars('train/grad', {"grad_norm": tbX_grad_norm}, iter_count)
+            scalar_writer.add_scalars('train/grad', {"grad_norm": tbX_grad_norm}, iter_count)
 
             # progress bar update    
             tq.set_postfix(
@@ -194,21 +295,42 @@ def run_epoch(model,
             if iter_count % log_modulus == 0:
                 if use_log: log_cpu_mem_disk_usage(logger)
         
-        # checks for nan gradients
-        if check_nan_params_grads(model.module.parameters()):
+        # checks the parameters for nan values every `nan_check_every` steps
+        with profiler.phase("nan_check"):
+            has_nan = grads_nonfinite
+            if not has_nan and nan_check_every and iter_count % nan_check_every == 0:
+                has_nan = params_nonfinite(model.module.parameters())
+        if has_nan and num_nonfinite_captures >= max_nonfinite_captures:
+            print(f"\n~~~ NaN value detected at iter {iter_count}, the step isn't saved ~~~\n")
+        elif has_nan:
             print("\n~~~ NaN value detected in gradients or parameters ~~~\n")
+            # the batch of every rank is saved as the offending example can be on any rank
+            num_nonfinite_captures += 1
+            nan_step_path = save_nonfinite_step(
+                save_path, 
+                iter_count, 
+                rank, 
+                {"inputs": inputs, "labels": labels, "input_lens": input_lens, 
+                 "label_lens": label_lens, "loss": loss, "grad_norm": grad_norm},
+                model.module.named_parameters()
+            )
+            print(f"NaN step saved to: {nan_step_path}")
             if use_log:
                 logger.error(
                     f"train: labels: {[labels]}, label_lens: {label_lens} state_dict: {model.module.state_dict()}"
                 )
                 log_model_grads(model.module.named_parameters(), logger)
-                save_batch_log_stats(batch, logger)
+                if not is_tensor_batch:
+                    save_batch_log_stats(batch, logger)
                 log_param_grad_norms(model.module.named_parameters(), logger)
                 plot_grad_flow_bar(model.module.named_parameters(), get_logger_filename(logger))
             
             #debug_mode = True
             #torch.autograd.set_detect_anomaly(True)
 
+        # the summaries go through the sink, whose thread is then the only writer of tbX_writer
+        profiler.end_step(scalar_writer)
+        step_end_t = profiler.clock()
         iter_count += 1
 
     return iter_count, avg_loss
@@ -247,49 +369,92 @@ def naren_loss(out, labels, input_lens, label_lens, blank_idx):
     return loss
 
 
-def eval_dev(model, ldr, preproc,  logger, loss_name):
+def eval_dev(model, ldr, preproc,  logger, loss_name, decode_workers:int=0, 
+             distributed:bool=False, dev_decoder:str="greedy", decoder:BatchDecoder=None):
     """
-    Runs the devset evaluation loop.
+    Runs the devset evaluation loop. The loss and the predictions are computed from a single
+    forward pass of each batch. The predictions are decoded by the vectorized greedy decoder if
+    `dev_decoder` is "greedy" or by the beam search if it is "beam". The beam search runs in
+    `decoder`, a `BatchDecoder` of log-probabilities that is kept across the evaluations, or
+    else in a decoder with `decode_workers` processes that is created for this evaluation. The
+    batches are decoded in the pool while the next batches are evaluated.
+    If `distributed` is true, each rank evaluates its shard of the dev set from a loader made
+    by `loader.make_eval_loader` and the loss sums, edit distances, and label lengths are 
+    all-reduced, so every rank returns the loss and PER of the full dev set.
     """
-    losses = []; all_preds = []; all_labels = []
+    losses = []; all_labels = []; decoded_batches = []
         
     model.set_eval()
     preproc.set_eval()  # turns off dataset augmentation
     use_log = (logger is not None)
+    device = next(model.parameters()).device
+    assert dev_decoder in ["greedy", "beam"], f"dev_decoder: {dev_decoder} must be 'greedy' or 'beam'"
+    use_greedy = dev_decoder == "greedy"
+    own_decoder = decoder is None and not use_greedy
+    if own_decoder:
+        decoder = BatchDecoder(decode_workers, beam_size=3, blank=model.blank, log_input=True)
+    if decoder is not None:
+        assert decoder.log_input, "the dev-set decoder must take log-probabilities"
+    # only a few decoded batches are pending at a time to limit the shared memory
+    pending_jobs = deque()
+    max_pending = max(2 * decoder.num_workers, 1) if decoder is not None else 0
 
     # saves time by not computing and saving gradients as there is no backwards pass
-    with torch.no_grad():
-        for batch in tqdm.tqdm(ldr):
-            batch = list(batch)
-            preds = model.infer(batch)
-            
-            inputs, labels, input_lens, label_lens = model.collate(*batch)
-            inputs = inputs.cuda(non_blocking=True)
-            out, rnn_args = model(inputs, softmax=False)
-
-            if loss_name == "native":
-                loss = native_loss(out, labels, input_lens, label_lens, model.blank)
-            elif loss_name == "awni":
-                loss = awni_loss(out, labels, input_lens, label_lens, model.blank)
-            elif loss_name == "naren":
-                loss = naren_loss(out, labels, input_lens, label_lens, model.blank)
-
-            losses.append(loss.item())
-            all_preds.extend(preds)
-            all_labels.extend(batch[1])        #add the labels in the batch object
+    try:
+        with torch.no_grad():
+            for batch in tqdm.tqdm(ldr, disable=distributed and dist.get_rank() != 0):
+                batch = list(batch)
+                inputs, labels, input_lens, label_lens = model.collate(*batch)
+                inputs = inputs.to(device, non_blocking=True)
+                out, rnn_args = model(inputs, softmax=False, lengths=input_lens)
+
+                if loss_name == "native":
+                    loss = native_loss(out, labels, input_lens, label_lens, model.blank)
+                elif loss_name == "awni":
+                    loss = awni_loss(out, labels, input_lens, label_lens, model.blank)
+                elif loss_name == "naren":
+                    loss = naren_loss(out, labels, input_lens, label_lens, model.blank)
+                losses.append(loss.item())
+
+                # the predictions are decoded from the same output over each example's length
+                log_probs = nn.functional.log_softmax(out, dim=2)
+                if use_greedy:
+                    preds, _, _ = greedy_decode(log_probs, input_lens, model.blank)
+                    decoded_batches.append([tuple(pred.tolist()) for pred in preds])
+                else:
+                    # the beam search takes the log-probabilities without a softmax and log
+                    pending_jobs.append(decoder.submit(log_probs, input_lens))
+                    while len(pending_jobs) > max_pending:
+                        decoded_batches.append([nbest[0][0] for nbest in pending_jobs.popleft().get()])
+                all_labels.extend(batch[1])        #add the labels in the batch object
+
+        while pending_jobs:
+            decoded_batches.append([nbest[0][0] for nbest in pending_jobs.popleft().get()])
+    finally:
+        if own_decoder:
+            decoder.close()
+    all_preds = [pred for preds in decoded_batches for pred in preds]
             
-    loss = sum(losses) / len(losses)
-
     # decodes from integer tokens back to phoneme labels
     results = [(preproc.decode(l), preproc.decode(p))
                for l, p in zip(all_labels, all_preds)]
     
-    cer = speech.compute_cer(results)
+    if distributed:
+        # a rank with an empty shard adds zeros to the sums
+        dist_len = speech.compute_cer(results, verbose=False, dist_len=True)[1] if results else (0, 0)
+        totals = torch.tensor([sum(losses), len(losses), *dist_len], dtype=torch.float64, device=device)
+        dist.all_reduce(totals)
+        loss_sum, num_batches, edit_dist, label_len = totals.tolist()
+        loss = loss_sum / num_batches
+        cer = edit_dist / label_len
+    else:
+        loss = sum(losses) / len(losses)
+        cer = speech.compute_cer(results)
     print("Dev: Loss {:.3f}, CER {:.3f}".format(loss, cer))
     
     if use_log: 
-        logger.info(f"eval_dev: loss calculated as: {loss.item():0.3f}")
-        logger.info(f"eval_dev: loss is nan: {math.isnan(loss.item())}")
+        logger.info(f"eval_dev: loss calculated as: {loss:0.3f}")
+        logger.info(f"eval_dev: loss is nan: {math.isnan(loss)}")
         logger.info(f"eval_dev: results {results}")
         logger.info(f"CER: {cer}")
 
@@ -300,6 +465,26 @@ def eval_dev(model, ldr, preproc,  logger, loss_name):
     return loss, cer
 
 
+def eval_dev_sets(model, dev_ldr_dict:dict, preproc, logger, loss_name:str, 
+                  decode_workers:int=0, distributed:bool=False, dev_decoder:str="greedy",
+                  decoder:BatchDecoder=None)->dict:
+    """Evaluates the model on each dev-set loader with `eval_dev` and returns a dict that maps
+    the dev-set name to a (loss, PER) tuple
+    """
+    use_log = logger is not None
+    dev_results = dict()
+    # iterating through the dev-set loaders to calculate the PER/loss
+    for dev_name, dev_ldr in dev_ldr_dict.items():
+        print(f"evaluating devset: {dev_name}")
+        if use_log: logger.info(f"train: === evaluating devset: {dev_name} ==")
+        dev_results[dev_name] = eval_dev(
+            model, dev_ldr, preproc, logger, loss_name, decode_workers=decode_workers, 
+            distributed=distributed, dev_decoder=dev_decoder, decoder=decoder
+        )
+        if use_log: logger.info(f"train: ====== eval_dev {dev_name} finished =======")
+    return dev_results
+
+
 def run(local_rank:int, config:dict)->None:
     """Main function that defines the data, optimizer, and model objects and runs the training
     and evaluation loops.
@@ -342,6 +527,45 @@ def run(local_rank:int, config:dict)->None:
     # creates tensorboardX writer in rank_0 process 
     tbX_writer = SummaryWriter(logdir=ckpt_cfg["local_save_path"]) if is_rank_0 else None
 
+    # the step profiler times the phases of the training steps in the rank_0 process
+    profiler = None
+    if log_cfg.get("profile_every") and is_rank_0:
+        profiler = StepProfiler(
+            log_every=log_cfg["profile_every"],
+            trace_steps=log_cfg.get("profile_trace_steps"),
+            # the profile dir is synced to gcs with the tensorboard logs
+            trace_path=os.path.join(ckpt_cfg["local_save_path"], "profile", "profile_trace.json"),
+            synchronize=log_cfg.get("profile_synchronize", True)
+        )
+
+    # the per-iteration scalars are averaged and written in the background in the rank_0 process
+    scalar_sink = None
+    if log_cfg.get("scalar_log_every") and is_rank_0:
+        scalar_backends = list()
+        if log_cfg.get("scalar_log_tensorboard", True):
+            scalar_backends.append(TensorboardBackend(tbX_writer))
+        if log_cfg.get("scalar_log_file"):
+            scalar_backends.append(get_file_backend(log_cfg["scalar_log_file"]))
+        scalar_sink = ScalarSink(
+            scalar_backends, 
+            log_every=log_cfg["scalar_log_every"], 
+            reduce=log_cfg.get("scalar_reduce", "mean")
+        )
+
+    # the mid-epoch checkpoints are written and uploaded in the background in the rank_0 process
+    ckpt_writer = None
+    if ckpt_cfg.get("async_checkpoint", False) and is_rank_0:
+        def on_ckpt_failure(name, err):
+            print(f"checkpoint job: {name} failed with: {err}")
+            if use_log: logger.error(f"train: checkpoint job: {name} failed with: {err}")
+        ckpt_writer = AsyncCheckpointWriter(
+            gcs_ckpt_handler.storage,
+            ckpt_cfg['local_save_path'],
+            remote_dir=ckpt_cfg['gcs_dir'],
+            max_pending=ckpt_cfg.get("max_pending_checkpoints", 2),
+            on_failure=on_ckpt_failure
+        )
+
     
     # Load previous train state: dict with contents:
         # {start_epoch: int, run_state: (int, float), best_so_far: float, learning_rate: float}
@@ -363,21 +587,90 @@ def run(local_rank:int, config:dict)->None:
     
     # create the loaders
     batch_size = opt_cfg["batch_size"]
+    # with a stats cache, rank_0 computes the mean and std first and the other ranks read them
+    use_stats_cache = bool(preproc_cfg.get("mean_std_cache_dir"))
+    if use_stats_cache and not is_rank_0:
+        dist.barrier()
     preproc = loader.Preprocessor(
         data_cfg["train_set"], 
         preproc_cfg, 
         logger, 
         start_and_end=data_cfg["start_and_end"]
     )
+    if use_stats_cache and is_rank_0:
+        dist.barrier()
     
-    train_ldr = loader.make_ddp_loader(data_cfg["train_set"], preproc, batch_size, num_workers=data_cfg["num_workers"])
-
-    # create the dev-set loaders in the rank_0 process
-    if is_rank_0:
+    # the sharded dataset streams tar shards instead of reading individual audio files
+    if data_cfg.get("train_shards"):
+        train_ldr = loader.make_shard_loader(
+            data_cfg["train_shards"], 
+            preproc, 
+            batch_size, 
+            num_workers=data_cfg["num_workers"],
+            buffer_size=data_cfg.get("shard_buffer_size", 2000)
+        )
+    else:
+        # the batch frontend computes the features of a whole batch in the collate function
+        train_ldr = loader.make_ddp_loader(
+            data_cfg["train_set"], 
+            preproc, 
+            batch_size, 
+            num_workers=data_cfg["num_workers"],
+            batch_frontend=data_cfg.get("batch_frontend", False),
+            max_frames=opt_cfg.get("max_frames"),
+            tensor_collate=data_cfg.get("tensor_collate", False)
+        )
+        if use_log and isinstance(train_ldr.batch_sampler, loader.DistributedFrameBatchSampler):
+            logger.info(f"train: padding efficiency: {train_ldr.batch_sampler.efficiency:.3f}")
+
+    # create the dev-set loaders in the rank_0 process or, with distributed evaluation,
+    # a loader over each rank's shard of the dev sets in every process
+    use_async_eval = data_cfg.get("async_eval", False)
+    use_distributed_eval = data_cfg.get("distributed_eval", False)
+    assert not (use_async_eval and use_distributed_eval), \
+        "async_eval and distributed_eval can't both be used"
+    # rank_0 builds the feature caches before the other ranks read them
+    build_dev_caches = use_distributed_eval and bool(data_cfg.get("feature_cache_dir"))
+    if build_dev_caches and not is_rank_0:
+        dist.barrier()
+    if is_rank_0 or use_distributed_eval:
         dev_ldr_dict = dict() 
+        dev_cache_paths = dict()
         for dev_name, dev_path in data_cfg["dev_sets"].items():
-            dev_ldr = loader.make_loader(dev_path, preproc, batch_size=8, num_workers=data_cfg["num_workers"])
+            # the dev-set features are deterministic and can be read from a precomputed cache
+            feature_cache = None
+            if data_cfg.get("feature_cache_dir"):
+                cache_path = build_feature_cache(
+                    dev_path, 
+                    preproc, 
+                    data_cfg["feature_cache_dir"], 
+                    dtype=data_cfg.get("feature_cache_dtype", "float32"),
+                    num_workers=data_cfg["num_workers"]
+                )
+                feature_cache = FeatureCache(cache_path, dev_path)
+                dev_cache_paths[dev_name] = cache_path
+            # the asynchronous evaluator creates its own loaders
+            if use_async_eval:
+                continue
+            if use_distributed_eval:
+                dev_ldr = loader.make_eval_loader(
+                    dev_path, 
+                    preproc, 
+                    batch_size=8, 
+                    num_workers=data_cfg["num_workers"],
+                    feature_cache=feature_cache
+                )
+            else:
+                dev_ldr = loader.make_loader(
+                    dev_path, 
+                    preproc, 
+                    batch_size=8, 
+                    num_workers=data_cfg["num_workers"],
+                    feature_cache=feature_cache
+                )
             dev_ldr_dict.update({dev_name: dev_ldr})
+    if build_dev_caches and is_rank_0:
+        dist.barrier()
 
     # Model
     model_cfg.update({'blank_idx': preproc_cfg['blank_idx']})   # add the blank_idx to model_cfg
@@ -410,11 +703,62 @@ def run(local_rank:int, config:dict)->None:
         gamma=opt_cfg["sched_gamma"]
     )
 
+    # the beam-search decoding pool of the dev sets is kept across the epochs
+    dev_beam_decoder = None
+    if data_cfg.get("dev_decoder", "greedy") == "beam" and not use_async_eval \
+            and (is_rank_0 or use_distributed_eval):
+        dev_beam_decoder = BatchDecoder(
+            data_cfg.get("decode_workers", 0), beam_size=3, blank=model.blank, log_input=True
+        )
+
     # gradient scaler, too large a value for init_scale produces NaN gradients
     scaler = GradScaler(enabled=train_cfg['amp'], init_scale=16)
 
-    # call the ddp wrappers
+    # the dev sets are evaluated on the cpu in a separate process while training continues
+    evaluator = None
+    if use_async_eval and is_rank_0:
+        evaluator = AsyncEvaluator(
+            eval_dev,
+            model,
+            preproc,
+            data_cfg["dev_sets"],
+            train_cfg['loss_name'],
+            feature_caches=dev_cache_paths,
+            num_workers=data_cfg["num_workers"],
+            decode_workers=data_cfg.get("decode_workers", 0),
+            dev_decoder=data_cfg.get("dev_decoder", "greedy"),
+            num_threads=data_cfg.get("async_eval_threads")
+        )
+
+    # the full training checkpoint resumes an interrupted epoch from the next batch
+    use_full_ckpt = ckpt_cfg.get("full_checkpoint", False)
+    train_sampler = loader.get_resumable_sampler(train_ldr)
+    sampler_state = None
     model.cuda(local_rank)
+    if use_full_ckpt:
+        train_ckpt_path = gcs_ckpt_handler.download_from_gcs_bucket(
+            os.path.join(ckpt_cfg['gcs_dir'], TRAIN_CKPT)
+        )
+        if train_ckpt_path:
+            print(f"load full training checkpoint from: {train_ckpt_path}")
+            ckpt_states = load_train_checkpoint(
+                train_ckpt_path, model, optimizer, lr_scheduler, scaler, torch.device("cuda", local_rank)
+            )
+            sampler_state = ckpt_states['sampler']
+            run_state = ckpt_states['train_state']['run_state']
+            best_so_far = ckpt_states['train_state']['best_so_far']
+            start_epoch = ckpt_states['train_state']['start_epoch']
+            # the streamed shards can't skip batches, so an interrupted epoch restarts from
+            # its first batch and the examples already trained on are seen again. the
+            # mid-epoch checkpoints of the shard loader have no sampler state.
+            if train_sampler is None \
+            and (sampler_state is None or sampler_state['batches_consumed'] > 0):
+                msg = f"train: the shard loader can't resume mid-epoch, epoch {start_epoch} " \
+                      f"restarts from its first batch"
+                print(msg)
+                if use_log: logger.warning(msg)
+
+    # call the ddp wrappers
     model = nn.parallel.DistributedDataParallel(model, device_ids=[local_rank], output_device=local_rank)
     
     if use_log: 
@@ -437,6 +781,14 @@ def run(local_rank:int, config:dict)->None:
     for epoch in range(start_epoch, opt_cfg["epochs"]):
         
         start = time.time()
+        if isinstance(train_ldr.dataset, loader.ShardedAudioDataset):
+            train_ldr.dataset.set_epoch(epoch)
+        if train_sampler is not None:
+            train_sampler.set_epoch(epoch)
+            # skips the batches of the interrupted epoch that were already trained on
+            if sampler_state is not None and sampler_state['epoch'] == epoch:
+                train_sampler.load_state_dict(sampler_state)
+                print(f"resuming epoch {epoch} after {sampler_state['batches_consumed']} batches")
         for group in optimizer.param_groups:
             if is_rank_0: print(f'learning rate: {group["lr"]}')
             if use_log: logger.info(f"train: learning rate: {group['lr']}")
@@ -444,7 +796,11 @@ def run(local_rank:int, config:dict)->None:
         try:
             run_state = run_epoch(
                 model, optimizer, train_ldr, logger, debug_mode, tbX_writer, *run_state, local_rank,
-                train_cfg['loss_name'], ckpt_cfg['local_save_path'], gcs_ckpt_handler, scaler
+                train_cfg['loss_name'], ckpt_cfg['local_save_path'], gcs_ckpt_handler, scaler,
+                lr_scheduler, {"start_epoch": epoch, "best_so_far": best_so_far} if use_full_ckpt else None,
+                ckpt_writer, profiler, train_cfg.get("nan_check_every", 1), 
+                train_cfg.get("skip_nonfinite_steps", False), scalar_sink,
+                train_cfg.get("max_nonfinite_captures", 1)
             )
         except Exception as err:
             if use_log: 
@@ -458,11 +814,26 @@ def run(local_rank:int, config:dict)->None:
     
         # update the learning rate
         lr_scheduler.step()       
+
+        # the background checkpoints finish before the end-of-epoch files are written over them
+        if ckpt_writer is not None:
+            ckpt_writer.wait()
  
         if use_log:
             logger.info(f"train: ====== Run_state finished =======") 
             logger.info(f"train: preproc type: {type(preproc)}")
+        # with distributed evaluation, every rank evaluates its shard of the dev sets
+        if use_distributed_eval:
+            epoch_results = eval_dev_sets(
+                model.module, dev_ldr_dict, preproc, logger, train_cfg['loss_name'], 
+                decode_workers=data_cfg.get("decode_workers", 0), distributed=True,
+                dev_decoder=data_cfg.get("dev_decoder", "greedy"), decoder=dev_beam_decoder
+            )
+
         if is_rank_0:
+            # the buffered scalars of the epoch are written before the tensorboard upload
+            if scalar_sink is not None:
+                scalar_sink.flush()
             msg = "Epoch {} completed in {:.2f} (hr)."
             epoch_time_hr = (time.time() - start)/60/60
             print(msg.format(epoch, epoch_time_hr))
@@ -479,44 +850,45 @@ def run(local_rank:int, config:dict)->None:
                 logger.info(f"train: ====== model saved =======")
                 preproc.logger = logger
 
-            # creating the dictionaries that hold the PER and loss values
-            dev_loss_dict = dict()
-            dev_per_dict = dict()
-            # iterating through the dev-set loaders to calculate the PER/loss
-            for dev_name, dev_ldr in dev_ldr_dict.items():
-                print(f"evaluating devset: {dev_name}")
-                if use_log: logger.info(f"train: === evaluating devset: {dev_name} ==")
-                dev_loss, dev_per = eval_dev(model.module, dev_ldr, preproc, logger, train_cfg['loss_name'])
-
-                dev_loss_dict.update({dev_name: dev_loss})
-                dev_per_dict.update({dev_name: dev_per})
-
-                if use_log: logger.info(f"train: ====== eval_dev {dev_name} finished =======")
-                
-                # Save the best model on the dev set
-                if dev_name == data_cfg['dev_set_save_reference']:
-                    print(f"dev_reference {dev_name}: current PER: {dev_per} vs. best_so_far: {best_so_far}")
-                    
-                    if use_log: logger.info(f"dev_reference {dev_name}: current PER: {dev_per} vs. best_so_far: {best_so_far}")
-                    if dev_per < best_so_far:
-                        if use_log: preproc.logger = None   # remove the logger to save the model
-                        best_so_far = dev_per
-                        speech.save(model.module, preproc, ckpt_cfg["local_save_path"], tag="best")
-                        gcs_ckpt_handler.upload_to_gcs("best_model_state_dict.pth")
-                        gcs_ckpt_handler.upload_to_gcs("best_preproc.pyc")
-
-                        if use_log: 
-                            preproc.logger = logger
-                            logger.info(f"model saved based per on: {dev_name} dataset")
-
-                        print(f"UPDATED: best_model based on PER {best_so_far} for {dev_name} devset")
-                
-            per_diff_dict = calc_per_difference(dev_per_dict) 
-
-            tbX_writer.add_scalars('dev/loss', dev_loss_dict, epoch)
-            tbX_writer.add_scalars('dev/per', dev_per_dict, epoch)
-            tbX_writer.add_scalars('dev/per/diff', per_diff_dict, epoch)
-            gcs_ckpt_handler.upload_tensorboard_ckpt()  
+            dev_results = list()
+            if evaluator is not None:
+                try:
+                    # the results of earlier epochs are recorded with the weights they belong to
+                    evaluator.submit(epoch, model.module)
+                    dev_results = evaluator.poll()
+                except RuntimeError as error:
+                    # the dev sets are evaluated in this process if the evaluation process died
+                    print(f"{error}\nfalling back to evaluating the dev sets in training")
+                    if use_log: logger.error(f"train: async evaluation failed: {error}")
+                    dev_results = evaluator.close()
+                    evaluator = None
+                    dev_ldr_dict = {
+                        dev_name: loader.make_loader(
+                            dev_path, 
+                            preproc, 
+                            batch_size=8, 
+                            num_workers=data_cfg["num_workers"],
+                            feature_cache=FeatureCache(dev_cache_paths[dev_name], dev_path) 
+                                if dev_name in dev_cache_paths else None
+                        )
+                        for dev_name, dev_path in data_cfg["dev_sets"].items()
+                    }
+            if evaluator is None:
+                if not use_distributed_eval:
+                    epoch_results = eval_dev_sets(
+                        model.module, dev_ldr_dict, preproc, logger, train_cfg['loss_name'], 
+                        decode_workers=data_cfg.get("decode_workers", 0),
+                        dev_decoder=data_cfg.get("dev_decoder", "greedy"), decoder=dev_beam_decoder
+                    )
+                dev_results.append((epoch, model.module.state_dict(), epoch_results))
+
+            for result_epoch, state_dict, epoch_results in dev_results:
+                if epoch_results is not None:
+                    best_so_far = record_dev_results(
+                        result_epoch, epoch_results, best_so_far, state_dict, preproc, 
+                        data_cfg['dev_set_save_reference'], ckpt_cfg["local_save_path"],
+                        gcs_ckpt_handler, tbX_writer, logger
+                    )
 
             learning_rate = list(optimizer.param_groups)[0]["lr"]
             # save the current state of training
@@ -526,6 +898,82 @@ def run(local_rank:int, config:dict)->None:
                            "learning_rate": learning_rate}
             write_pickle(os.path.join(ckpt_cfg["local_save_path"], "train_state.pickle"), train_state)
             gcs_ckpt_handler.upload_to_gcs("train_state.pickle")
+            # the end-of-epoch full checkpoint starts the next epoch from its first batch
+            if use_full_ckpt:
+                save_train_checkpoint(
+                    os.path.join(ckpt_cfg["local_save_path"], TRAIN_CKPT), 
+                    model.module, 
+                    optimizer, 
+                    lr_scheduler, 
+                    scaler,
+                    {"epoch": epoch + 1, "batches_consumed": 0, "num_replicas": dist.get_world_size()},
+                    {"start_epoch": epoch + 1, "run_state": run_state, "best_so_far": best_so_far}
+                )
+                gcs_ckpt_handler.upload_to_gcs(TRAIN_CKPT)
+
+    if ckpt_writer is not None:
+        ckpt_writer.close()
+    if scalar_sink is not None:
+        scalar_sink.close()
+    if dev_beam_decoder is not None:
+        dev_beam_decoder.close()
+    # the evaluations of the last epochs are recorded after training finishes
+    if evaluator is not None:
+        for result_epoch, state_dict, epoch_results in evaluator.close():
+            if epoch_results is not None:
+                best_so_far = record_dev_results(
+                    result_epoch, epoch_results, best_so_far, state_dict, preproc, 
+                    data_cfg['dev_set_save_reference'], ckpt_cfg["local_save_path"],
+                    gcs_ckpt_handler, tbX_writer, logger
+                )
+
+
+def record_dev_results(epoch:int, 
+                       dev_results:dict, 
+                       best_so_far:float, 
+                       state_dict:dict, 
+                       preproc, 
+                       dev_set_save_reference:str, 
+                       save_path:str, 
+                       gcs_ckpt_handler, 
+                       tbX_writer, 
+                       logger)->float:
+    """Writes the dev-set results of `epoch` to tensorboard and saves `state_dict`, the weights
+    that were evaluated, as the best model if the PER on the reference dev set improved.
+
+    Args:
+        dev_results (dict): mapping from dev-set name to a (loss, PER) tuple
+        best_so_far (float): best PER on the reference dev set before this epoch
+    Returns:
+        float: the updated best PER
+    """
+    use_log = logger is not None
+    dev_loss_dict = {dev_name: loss for dev_name, (loss, per) in dev_results.items()}
+    dev_per_dict = {dev_name: per for dev_name, (loss, per) in dev_results.items()}
+
+    # Save the best model on the dev set
+    if dev_set_save_reference in dev_per_dict:
+        dev_per = dev_per_dict[dev_set_save_reference]
+        print(f"dev_reference {dev_set_save_reference}: epoch {epoch} PER: {dev_per} vs. best_so_far: {best_so_far}")
+        if use_log: logger.info(f"dev_reference {dev_set_save_reference}: epoch {epoch} PER: {dev_per} vs. best_so_far: {best_so_far}")
+        if dev_per < best_so_far:
+            preproc_logger, preproc.logger = preproc.logger, None   # remove the logger to save the model
+            best_so_far = dev_per
+            save_state_dict(state_dict, preproc, save_path, tag="best")
+            gcs_ckpt_handler.upload_to_gcs("best_model_state_dict.pth")
+            gcs_ckpt_handler.upload_to_gcs("best_preproc.pyc")
+            preproc.logger = preproc_logger
+            if use_log: logger.info(f"model saved based per on: {dev_set_save_reference} dataset")
+            print(f"UPDATED: best_model based on PER {best_so_far} for {dev_set_save_reference} devset")
+
+    per_diff_dict = calc_per_difference(dev_per_dict) 
+
+    tbX_writer.add_scalars('dev/loss', dev_loss_dict, epoch)
+    tbX_writer.add_scalars('dev/per', dev_per_dict, epoch)
+    tbX_writer.add_scalars('dev/per/diff', per_diff_dict, epoch)
+    gcs_ckpt_handler.upload_tensorboard_ckpt()  
+
+    return best_so_far
 
 
 def calc_per_difference(dev_per_dict:dict) -> dict: